@@ -0,0 +1,231 @@
+# Benchmark of the cashier pipeline on synthetic test cases
+import argparse
+import contextlib
+import io
+import json
+import platform
+import resource
+import time
+
+import numpy as np
+
+from cashier import process
+from datasource.mongo_data_source import MongoDataSource
+from scripts.in_memory_db import InMemoryDatabase
+from scripts.synthetic_store import generate_store
+from utils.instrumentation_utils import Instrumentation
+from utils.prefetch_utils import PREFETCH_DEPTH
+
+# not in TestCaseStartTime.json, the whole recording is processed
+BENCHMARK_DB_NAME = "synthetic-benchmark"
+
+"""
+Function to run cashier.process on a database, measuring every stage
+Input:
+    data_source: DataSource of a test case
+    trace_memory: measure the peak of the memory allocated by the run with tracemalloc, and by
+        every stage from Python 3.9 on, which slows down the stages that allocate many python
+        objects
+    profile: capture a cProfile of the run
+    verbose: print the predictions of cashier.process
+    chunk_seconds, prefetch_depth: see cashier.process
+Returns:
+    receipts, dict with the instrumentation report and the processed volume
+"""
+
+
+def run_pipeline(
+    data_source,
+    db_name=BENCHMARK_DB_NAME,
+    trace_memory=True,
+    profile=False,
+    verbose=False,
+    chunk_seconds=None,
+    prefetch_depth=PREFETCH_DEPTH,
+):
+    instrumentation = Instrumentation(trace_memory=trace_memory, profile=profile)
+    with contextlib.ExitStack() as stack:
+        if not verbose:
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        # the stage cache would skip the stages on the next runs
+        receipts = process(
+            db_name,
+            data_source,
+            instrumentation=instrumentation,
+            use_stage_cache=False,
+            chunk_seconds=chunk_seconds,
+            prefetch_depth=prefetch_depth,
+        )
+
+    report = instrumentation.get_report()
+    counters = report["counters"]
+    result = {
+        "seconds": report["seconds"],
+        "plate_docs": counters.get("plate_docs", 0),
+        "samples": counters.get("samples", 0),
+        "events": counters.get("events", 0),
+        "events_per_second": counters.get("events", 0) / report["seconds"],
+        "samples_per_second": counters.get("samples", 0) / report["seconds"],
+        "report": report,
+    }
+    return receipts, result
+
+
+"""
+Function to compare receipts to the expected receipts of a synthetic test case
+Returns:
+    dict with the number of expected, predicted and correct items
+"""
+
+
+def compare_receipts(receipts, expected_receipts):
+    num_expected = sum(sum(items.values()) for items in expected_receipts.values())
+    num_predicted = 0
+    num_correct = 0
+    for target_id, customer_receipt in receipts.items():
+        expected_items = expected_receipts.get(target_id, {})
+        for product_id, (_, quantity) in customer_receipt.purchaseList.items():
+            num_predicted += quantity
+            num_correct += min(quantity, expected_items.get(product_id, 0))
+    return {
+        "expected_items": num_expected,
+        "predicted_items": num_predicted,
+        "correct_items": num_correct,
+    }
+
+
+def benchmark(args):
+    store_config = {
+        "num_gondolas": args.gondolas,
+        "num_shelves": args.shelves,
+        "num_plates": args.plates,
+        "num_products": args.products,
+        "num_shoppers": args.shoppers,
+        "duration": args.duration,
+        "pick_rate": args.pick_rate,
+        "putback_rate": args.putback_rate,
+        "seed": args.seed,
+    }
+    start_time = time.perf_counter()
+    synthetic_store = generate_store(**store_config)
+    generate_seconds = time.perf_counter() - start_time
+    print("Generated {} in {:.1f}s".format(synthetic_store, generate_seconds))
+    expected_receipts = synthetic_store.get_expected_receipts()
+
+    runs = []
+    for run_idx in range(args.repeat):
+        # the planogram is updated by putbacks, every run starts from the documents
+        data_source = MongoDataSource(InMemoryDatabase(synthetic_store.collections))
+        receipts, run_result = run_pipeline(
+            data_source,
+            trace_memory=not args.no_trace_memory,
+            profile=args.profile,
+            verbose=args.verbose,
+            chunk_seconds=args.chunk_seconds,
+            prefetch_depth=args.prefetch_depth,
+        )
+        run_result["accuracy"] = compare_receipts(receipts, expected_receipts)
+        runs.append(run_result)
+        print(
+            "Run {}: {} events, {} samples in {:.2f}s, {:.1f} events/s, {:.0f} samples/s".format(
+                run_idx,
+                run_result["events"],
+                run_result["samples"],
+                run_result["seconds"],
+                run_result["events_per_second"],
+                run_result["samples_per_second"],
+            )
+        )
+        for path, span in run_result["report"]["spans"].items():
+            if "/" not in path:
+                print("    {}: {:.3f}s".format(path, span["seconds"]))
+
+    median_run = sorted(runs, key=lambda run: run["seconds"])[len(runs) // 2]
+    report = {
+        "config": dict(
+            store_config,
+            repeat=args.repeat,
+            chunk_seconds=args.chunk_seconds,
+            prefetch_depth=args.prefetch_depth,
+        ),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+        },
+        "store": {
+            "collections": {
+                name: len(docs) for name, docs in synthetic_store.collections.items()
+            },
+            "actions": len(synthetic_store.ground_truth),
+            "generate_seconds": generate_seconds,
+        },
+        "runs": runs,
+        "median": {
+            "seconds": median_run["seconds"],
+            "events_per_second": median_run["events_per_second"],
+            "samples_per_second": median_run["samples_per_second"],
+            "spans": {
+                path: float(
+                    np.median([run["report"]["spans"][path]["seconds"] for run in runs])
+                )
+                for path in median_run["report"]["spans"]
+            },
+        },
+        # kilobytes on linux
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+    if not args.no_trace_memory:
+        report["peak_bytes"] = max(run["report"]["peak_bytes"] for run in runs)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Benchmark written to", args.output)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the cashier pipeline on a synthetic test case"
+    )
+    parser.add_argument("--gondolas", type=int, default=5)
+    parser.add_argument("--shelves", type=int, default=6)
+    parser.add_argument("--plates", type=int, default=12)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--shoppers", type=int, default=4)
+    parser.add_argument(
+        "--duration", type=float, default=120.0, help="seconds of recording"
+    )
+    parser.add_argument(
+        "--pick-rate", type=float, default=0.1, help="actions per second per shopper"
+    )
+    parser.add_argument(
+        "--putback-rate",
+        type=float,
+        default=0.2,
+        help="probability that an action is a putback",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--no-trace-memory",
+        action="store_true",
+        help="do not measure the memory peaks, tracemalloc slows down the stages",
+    )
+    parser.add_argument(
+        "--profile", action="store_true", help="capture a cProfile of every run"
+    )
+    parser.add_argument(
+        "--chunk-seconds",
+        type=float,
+        default=None,
+        help="run the chunked detection with chunks of this many seconds",
+    )
+    parser.add_argument(
+        "--prefetch-depth",
+        type=int,
+        default=PREFETCH_DEPTH,
+        help="batches of plate data read and decoded ahead, 0 to disable the prefetch",
+    )
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--output", default="benchmark.json")
+    benchmark(parser.parse_args())
@@ -2,39 +2,59 @@
 import datetime
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import numpy as np
 from PIL.ImageOps import crop
-from pymongo import MongoClient
 
 from computations.book_keeper import BookKeeper
 from computations.score_calculator import *
-from computations.weight_trigger import WeightTrigger
+from computations.target_timeline import TargetTimeline
+from computations.weight_stream import WeightStream
+from computations.weight_trigger import (
+    DEFAULT_THRESHOLDS,
+    DEFAULT_WINDOW_SIZE,
+    WeightTrigger,
+)
 from constants import (
     VERBOSE,
     ASSOCIATION_TYPE,
     CE_ASSOCIATION,
     CLOSEST_ASSOCIATION,
+    NUM_GONDOLA,
 )
 from cpsdriver.codec import Targets, DocObjectCodec
-from utils.coordinate_utils import get_3d_coordinates_for_plate
+from data.event_table import EventTable
+from datasource.bson_data_source import BsonDataSource
+from datasource.mongo_data_source import MongoDataSource
+from utils.coordinate_utils import build_plate_coordinates
+from utils.instrumentation_utils import NO_INSTRUMENTATION
+from utils.plate_cache_utils import load_agg_weight, save_agg_weight
+from utils.plate_data_utils import stream_plate_data
+from utils.prefetch_utils import PREFETCH_DEPTH
+from utils.stage_cache_utils import NO_STAGE_CACHE, StageCache, get_cache_key
 from utils.planogram_utils import load_planogram
 from utils.product_utils import (
     build_all_products_cache,
+    build_product_catalog,
     get_product_ids_from_position_3d,
     get_product_ids_from_position_2d,
     get_product_by_id,
 )
-from utils.store_meta_utils import build_dicts_from_store_meta
+from utils.store_meta_utils import load_store_meta
 from utils.target_association_utils import (
-    associate_product_ce,
-    associate_product_closest,
-    associate_product_naive,
+    associate_product_ce_array,
+    associate_product_closest_array,
+    associate_product_naive_array,
 )
 from utils.time_utils import get_test_start_time
 
 PUTBACK_JITTER_RATE = 0.75
 GRAB_FROM_SHELF_JITTER_RATE = 0.4
+WEIGHT_TRIGGER_WORKERS = NUM_GONDOLA
+# seconds of recording processed at once by detect_events_chunked
+CHUNK_SECONDS = 60.0
 
 
 class CustomerReceipt:
@@ -77,244 +97,712 @@ Cashier class to generate receipts
 SHOULD_GRAPH = False
 
 
-def process(db_name):
-    with open("src/main/resources/store_meta/Gondolas.json") as f:
-        gondolas_meta = json.load(f)["gondolas"]
-    with open("src/main/resources/store_meta/Shelves.json") as f:
-        shelves_meta = json.load(f)["shelves"]
-    with open("src/main/resources/store_meta/Plates.json") as f:
-        plates_meta = json.load(f)["plates"]
-
-    # Access instance DB
-    _mongoClient = MongoClient("mongodb://localhost:27017")
-    db = _mongoClient[db_name]
-
-    # Reference to DB collections
-    planogram_cursor = db["planogram"].find()
-    products_cursor = db["products"]
-    plate_cursor = db["plate_data"]
-    targets_cursor = db["full_targets"]
-    if targets_cursor.count() == 0:
-        targets_cursor = db["targets"]
-    frame_cursor = db["frame_message"]
-
-    products_cache, product_ids_from_products_table = build_all_products_cache(
-        products_cursor
-    )
-    planogram = load_planogram(planogram_cursor, products_cursor, products_cache)
-    gondolas_dict, shelves_dict, plates_dict = build_dicts_from_store_meta(
-        gondolas_meta, shelves_meta, plates_meta
-    )
+class Store:
+    """
+    Static data of a store loaded before the plate data is processed
+    products_cache, product_ids_from_products_table: see build_all_products_cache
+    product_catalog: ProductCatalog of the products with a weight
+    planogram: Planogram, updated by putbacks
+    plate_coordinates: see build_plate_coordinates
+    bookkeeper: BookKeeper with the targets of the database
+    cache_key: stage cache key of the products and planogram documents, the inputs of the
+        split of the events besides the plate data
+    """
+
+    def __init__(
+        self,
+        products_cache,
+        product_ids_from_products_table,
+        product_catalog,
+        planogram,
+        plate_coordinates,
+        bookkeeper,
+        cache_key=None,
+    ):
+        self.cache_key = cache_key
+        self.products_cache = products_cache
+        self.product_ids_from_products_table = product_ids_from_products_table
+        self.product_catalog = product_catalog
+        self.planogram = planogram
+        self.plate_coordinates = plate_coordinates
+        self.bookkeeper = bookkeeper
+
+
+"""
+Function to open the data source of a test case
+Input:
+    db_name: name of the database
+    dump_dir: directory with a mongodump of the database, as a <db_name> directory or a
+        <db_name>.archive[.gz] file, None to read the mongo database db_name
+    use_change_streams: tail the mongo database with change streams, see MongoDataSource
+Returns:
+    DataSource
+"""
+
+
+def open_data_source(db_name, dump_dir=None, use_change_streams=False):
+    if dump_dir is None:
+        return MongoDataSource.from_uri(db_name, use_change_streams=use_change_streams)
+    return BsonDataSource.from_dump_dir(dump_dir, db_name)
+
+
+"""
+Function to generate the receipts of a database
+Input:
+    db_name: name of the database
+    data_source: DataSource of the test case, the mongo database db_name by default
+    instrumentation: Instrumentation entered for the run, its report has the seconds of every
+        stage and substep, the counters and the memory peaks
+    use_stage_cache: False to compute every stage instead of loading the stages whose
+        inputs did not change from the StageCache
+    chunk_seconds: seconds of recording processed at once, see detect_events_chunked,
+        None to aggregate the whole recording before the detection
+    prefetch_depth: batches of plate data read and decoded ahead of the aggregation in
+        background threads, the targets are then also loaded while the plate data is
+        processed; 0 to read everything in the calling thread
+Returns:
+    dict of customer ID -> CustomerReceipt
+"""
+
+
+def process(
+    db_name,
+    data_source=None,
+    instrumentation=NO_INSTRUMENTATION,
+    use_stage_cache=True,
+    chunk_seconds=None,
+    prefetch_depth=PREFETCH_DEPTH,
+):
+    if data_source is None:
+        data_source = open_data_source(db_name)
+    stage_cache = StageCache() if use_stage_cache else NO_STAGE_CACHE
+
+    with instrumentation, ThreadPoolExecutor(max_workers=1) as executor:
+        # the stages are cached while the plate data and targets documents do not change
+        plate_cache_key = None
+        targets_cache_key = None
+        if use_stage_cache:
+            with instrumentation.span("cache_keys"):
+                plate_cache_key = get_plate_data_cache_key(db_name, data_source)
+                targets_cache_key = get_targets_cache_key(db_name, data_source)
+
+        target_timeline = None
+        with instrumentation.span("store"):
+            if prefetch_depth > 0:
+                store = load_store(data_source, instrumentation, TargetTimeline())
+                # the targets are fetched and loaded while the plate data is processed,
+                # outside of the spans, the wait for them is the targets_wait span
+                target_timeline = executor.submit(
+                    load_target_timeline,
+                    data_source,
+                    stage_cache=stage_cache,
+                    cache_key=targets_cache_key,
+                )
+            else:
+                store = load_store(
+                    data_source,
+                    instrumentation,
+                    load_target_timeline(
+                        data_source, instrumentation, stage_cache, targets_cache_key
+                    ),
+                )
+
+        # the split events only change with the plate data, the detection parameters and
+        # the products and planogram, the receipt parameters are applied after them
+        events_cache_key = None
+        columns = None
+        if use_stage_cache:
+            events_cache_key = get_cache_key(
+                "events",
+                plate_cache_key,
+                DEFAULT_WINDOW_SIZE,
+                DEFAULT_THRESHOLDS,
+                store.cache_key,
+            )
+            with instrumentation.span("cache_load"):
+                columns = stage_cache.load("events", events_cache_key)
+            instrumentation.count("events_cache_hits", int(columns is not None))
+        if columns is not None:
+            event_table = EventTable.from_columns(columns)
+        elif chunk_seconds is not None:
+            with instrumentation.span("events"):
+                event_table = detect_events_chunked(
+                    db_name,
+                    data_source,
+                    store,
+                    chunk_seconds,
+                    prefetch_depth,
+                    instrumentation,
+                )
+        else:
+            with instrumentation.span("plate_data"):
+                weight_trigger = load_weight_trigger(
+                    db_name,
+                    data_source,
+                    store,
+                    stage_cache,
+                    plate_cache_key,
+                    prefetch_depth,
+                    instrumentation,
+                )
+            # moving weight, detection and split run per gondola, in parallel
+            with instrumentation.span("events"):
+                event_table = weight_trigger.get_events()
+        if use_stage_cache and columns is None:
+            with instrumentation.span("cache_save"):
+                stage_cache.save("events", events_cache_key, event_table.get_columns())
+
+        if target_timeline is not None:
+            with instrumentation.span("targets_wait"):
+                store.bookkeeper.target_timeline = target_timeline.result()
+            instrumentation.count(
+                "target_snapshots", len(store.bookkeeper.target_timeline)
+            )
+        with instrumentation.span("receipts"):
+            receipts = build_receipts(
+                db_name, store, event_table, instrumentation, stage_cache
+            )
+    return receipts
+
+
+"""
+Function to load the products, planogram, store meta and targets of a database
+Input:
+    data_source: DataSource of the test case
+    target_timeline: TargetTimeline of the store, all the targets of the data source are
+        loaded by default
+Returns:
+    Store
+"""
+
+
+def load_store(data_source, instrumentation=NO_INSTRUMENTATION, target_timeline=None):
+    with instrumentation.span("products"):
+        product_docs = list(data_source.get_products())
+        products_cache, product_ids_from_products_table = build_all_products_cache(
+            product_docs
+        )
+        product_catalog = build_product_catalog(
+            products_cache, product_ids_from_products_table
+        )
+    with instrumentation.span("planogram"):
+        planogram_docs = list(data_source.get_planogram())
+        planogram = load_planogram(planogram_docs, products_cache)
+    with instrumentation.span("store_meta"):
+        gondolas_dict, shelves_dict, plates_dict = load_store_meta()
+        # absolute coordinates of every plate, the store geometry is static for a run
+        plate_coordinates = build_plate_coordinates(
+            gondolas_dict, shelves_dict, plates_dict
+        )
+
+    instrumentation.count("products", len(product_catalog))
+    if target_timeline is None:
+        target_timeline = load_target_timeline(data_source, instrumentation)
 
     bookkeeper = BookKeeper(
         planogram,
-        lambda x: targets_cursor.find(x),
-        lambda x: frame_cursor.find(x),
+        target_timeline,
+        data_source.find_frames,
         product_ids_from_products_table,
         gondolas_dict,
         shelves_dict,
         plates_dict,
     )
+    return Store(
+        products_cache,
+        product_ids_from_products_table,
+        product_catalog,
+        planogram,
+        plate_coordinates,
+        bookkeeper,
+        get_cache_key("store", product_docs, planogram_docs),
+    )
+
+
+"""
+Function to load the target snapshots of a database
+Input:
+    data_source: DataSource of the test case
+    stage_cache: StageCache of the target snapshots
+    cache_key: key of the target snapshots, see get_targets_cache_key, None to not cache them
+Returns:
+    TargetTimeline
+"""
+
+
+def load_target_timeline(
+    data_source,
+    instrumentation=NO_INSTRUMENTATION,
+    stage_cache=NO_STAGE_CACHE,
+    cache_key=None,
+):
+    with instrumentation.span("targets"):
+        columns = stage_cache.load("targets", cache_key)
+        if columns is not None:
+            target_timeline = TargetTimeline.from_columns(columns, cache_key)
+        else:
+            target_timeline = TargetTimeline(data_source.get_targets())
+            stage_cache.save("targets", cache_key, target_timeline.get_columns())
+            target_timeline.cache_key = cache_key
+    instrumentation.count("target_snapshots", len(target_timeline))
+    return target_timeline
+
+
+# stage cache key of the aggregated plate data of a database, the root of the plate stages
+def get_plate_data_cache_key(db_name, data_source):
+    return get_cache_key(
+        "plate_data",
+        db_name,
+        data_source.get_plate_data_fingerprint(),
+        get_test_start_time(data_source, db_name),
+    )
+
+
+# stage cache key of the target snapshots of a database
+def get_targets_cache_key(db_name, data_source):
+    return get_cache_key(
+        "targets", db_name, data_source.get_targets_fingerprint(), CE_ASSOCIATION
+    )
+
+
+"""
+Function to aggregate the plate data of a database into a WeightTrigger
+Input:
+    db_name: name of the database
+    data_source: DataSource of the test case
+    store: Store of the database
+    stage_cache: StageCache of the aggregated plate data, and of the moving stats and
+        detected events of the WeightTrigger
+    cache_key: key of the aggregated plate data, see get_plate_data_cache_key, None to not
+        cache the plate stages
+    prefetch_depth, instrumentation: see process
+Returns:
+    WeightTrigger
+"""
+
+
+def load_weight_trigger(
+    db_name,
+    data_source,
+    store,
+    stage_cache=NO_STAGE_CACHE,
+    cache_key=None,
+    prefetch_depth=0,
+    instrumentation=NO_INSTRUMENTATION,
+):
+    planogram = store.planogram
+    products_cache = store.products_cache
+
+    # aggregated plate data is cached on disk while the plate data does not change
+    test_start_time = get_test_start_time(data_source, db_name)
+    agg_weight = None
+    if cache_key is not None:
+        with instrumentation.span("cache_load"):
+            agg_weight = load_agg_weight(stage_cache, cache_key)
+        instrumentation.count("agg_weight_cache_hits", int(agg_weight is not None))
+    plate_data = []
+    plate_doc_counts = None
+    if agg_weight is None:
+        # decoded one batch at a time while the tensors are filled
+        plate_data = stream_plate_data(
+            data_source,
+            test_start_time,
+            prefetch_depth=prefetch_depth,
+            instrumentation=instrumentation,
+        )
+        plate_doc_counts = data_source.get_plate_doc_counts(test_start_time)
 
     weight_trigger = WeightTrigger(
-        get_test_start_time(plate_cursor, db_name),
-        list(
-            map(
-                lambda x: DocObjectCodec.decode(doc=x, collection="plate_data"),
-                plate_cursor.find(),
-            )
-        ),
+        test_start_time,
+        plate_data,
         (lambda x, y: get_product_ids_from_position_2d(x, y, planogram)),
         (lambda x, y, z: get_product_ids_from_position_3d(x, y, z, planogram)),
         lambda x: get_product_by_id(x, products_cache),
-        (
-            lambda x, y, z: get_3d_coordinates_for_plate(
-                x, y, z, gondolas_dict, shelves_dict, plates_dict
-            )
-        ),
+        num_workers=WEIGHT_TRIGGER_WORKERS,
+        agg_weight=agg_weight,
+        plate_doc_counts=plate_doc_counts,
+        instrumentation=instrumentation,
+        stage_cache=stage_cache,
+        cache_key=cache_key,
     )
+    if cache_key is not None and agg_weight is None:
+        with instrumentation.span("cache_save"):
+            save_agg_weight(
+                stage_cache,
+                cache_key,
+                (
+                    weight_trigger.agg_plate_data,
+                    weight_trigger.agg_shelf_data,
+                    weight_trigger.timestamps,
+                    weight_trigger.samples_per_doc,
+                    weight_trigger.frequencies,
+                ),
+            )
+    return weight_trigger
 
-    (
-        weight_shelf_mean,
-        weight_shelf_std,
-        weight_plate_mean,
-        weight_plate_std,
-    ) = weight_trigger.get_moving_weight()
-
-    number_gondolas = len(weight_shelf_mean)
-    # reduce timestamp
-    timestamps = weight_trigger.get_agg_timestamps()
-    for i in range(number_gondolas):
-        timestamps[i] = timestamps[i][30:-29]
-
-    # sanity check
-    for i in range(number_gondolas):
-        timestamps_count = len(timestamps[i])
-        assert timestamps_count == weight_shelf_mean[i].shape[1]
-        assert timestamps_count == weight_shelf_std[i].shape[1]
-        assert timestamps_count == weight_plate_mean[i].shape[2]
-        assert timestamps_count == weight_plate_std[i].shape[2]
-
-    events = weight_trigger.detect_weight_events(
-        weight_shelf_mean,
-        weight_shelf_std,
-        weight_plate_mean,
-        timestamps,
-    )
-    events = weight_trigger.splitEvents(events)
-    events.sort(key=lambda pick_up_event: pick_up_event.triggerBegin)
 
-    # dictionary recording all receipts
-    # KEY: customer ID, VALUE: CustomerReceipt
-    receipts = {}
-    print("Capture {} events in the database {}".format(len(events), db_name))
-    print("==============================================================")
-    for event in events:
-        if VERBOSE:
-            print("----------------")
-            print("Event: ", event)
-
-        absolute_pos = event.get_event_coordinates()
-        targets = bookkeeper.get_targets_for_event(event)
-        # Initliaze a customer receipt for all new targets
-        for target_id in targets.keys():
-            if target_id not in receipts:
-                customer_receipt = CustomerReceipt(target_id)
-                receipts[target_id] = customer_receipt
+"""
+Function to detect and split the events of a database a fixed duration of recording at a
+time, with a memory use that does not grow with the length of the recording
+The documents of every chunk go through a WeightStream, which carries the last moving window
+of samples and the runs still active over to the next chunk, so the events are the ones of
+WeightTrigger.get_events. Only the split events are cached, by process.
+Input:
+    db_name: name of the database
+    data_source: DataSource of the test case
+    store: Store of the database
+    chunk_seconds: seconds of recording of every chunk
+    prefetch_depth, instrumentation: see process
+Returns:
+    EventTable, in the order of WeightTrigger.get_events
+"""
 
-        # No target for the event found at all
-        if len(targets) == 0:
-            continue
 
-        if ASSOCIATION_TYPE == CE_ASSOCIATION:
-            target_id, _ = associate_product_ce(absolute_pos, targets)
-        elif ASSOCIATION_TYPE == CLOSEST_ASSOCIATION:
-            target_id, _ = associate_product_closest(absolute_pos, targets)
-        else:
-            target_id, _ = associate_product_naive(absolute_pos, targets)
+def detect_events_chunked(
+    db_name,
+    data_source,
+    store,
+    chunk_seconds=CHUNK_SECONDS,
+    prefetch_depth=0,
+    instrumentation=NO_INSTRUMENTATION,
+):
+    if not chunk_seconds > 0:
+        raise ValueError("chunk_seconds must be positive, got %r" % chunk_seconds)
+    planogram = store.planogram
+    products_cache = store.products_cache
+
+    test_start_time = get_test_start_time(data_source, db_name)
+    weight_stream = WeightStream(
+        test_start_time,
+        (lambda x, y: get_product_ids_from_position_2d(x, y, planogram)),
+        (lambda x, y, z: get_product_ids_from_position_3d(x, y, z, planogram)),
+        lambda x: get_product_by_id(x, products_cache),
+        num_workers=WEIGHT_TRIGGER_WORKERS,
+        instrumentation=instrumentation,
+    )
+    event_tables = []
+    chunk = []
+    chunk_end = None
+    for plate_data in stream_plate_data(
+        data_source,
+        test_start_time,
+        prefetch_depth=prefetch_depth,
+        instrumentation=instrumentation,
+    ):
+        if chunk_end is None:
+            chunk_end = plate_data.timestamp + chunk_seconds
+        if plate_data.timestamp >= chunk_end:
+            weight_stream.add_plate_data(chunk)
+            event_tables.append(weight_stream.update())
+            chunk = []
+            # chunks are aligned on the first document, chunks without documents are skipped
+            chunk_end += (
+                np.floor((plate_data.timestamp - chunk_end) / chunk_seconds) + 1
+            ) * chunk_seconds
+        chunk.append(plate_data)
+    weight_stream.add_plate_data(chunk)
+    event_tables.append(weight_stream.flush())
+    instrumentation.count("chunks", len(event_tables))
+    return EventTable.concatenate(event_tables).sort_by_trigger_begin_and_shelf()
+
+
+class ReceiptResolver:
+    """
+    Receipts of a database, updated by batches of its events in a timely order
+    Resolving the events in several batches gives the same receipts as a single batch: the
+    pick up events of a shelf changed by a putback of an earlier batch are scored again
+    against the updated planogram, as they would be within a single batch.
+    store: Store of the database, its planogram is updated by putbacks
+    receipts: dict of customer ID -> CustomerReceipt
+    changed_shelves: set of (gondola ID, shelf ID) changed by putbacks
+    stage_cache: StageCache of the targets of the events, used while the target timeline of
+        the store has a cache key
+    """
 
-        isPutbackEvent = False
-        if event.deltaWeight > 0:
-            isPutbackEvent = True
-            # get all products pickedup by this target
-            if target_id not in receipts:
-                continue
-            customer_receipt = receipts[target_id]
-            purchase_list = (
-                customer_receipt.purchaseList
-            )  # productID -> (product_extendend, num_product)
-
-            # find most possible putback product_extendend whose weight is closest to the event weight
-            candidate_products = []
-            for item in purchase_list.values():
-                product_extendend, num_product = item
-                for count in range(1, num_product + 1):
-                    candidate_products.append((product_extendend, count))
-
-            if len(candidate_products) == 0:
-                continue
-            # item = (product_extendend, count)
-            candidate_products.sort(
-                key=lambda item: abs(item[0].weight * item[1] - event.deltaWeight)
-            )
-            product_extendend, putback_count = candidate_products[0]
+    def __init__(
+        self, store, instrumentation=NO_INSTRUMENTATION, stage_cache=NO_STAGE_CACHE
+    ):
+        self.store = store
+        self.instrumentation = instrumentation
+        self.stage_cache = stage_cache
+        self.receipts = {}
+        self.changed_shelves = set()
 
-            # If weight difference is too large, ignore this event
-            if abs(event.deltaWeight) < PUTBACK_JITTER_RATE * product_extendend.weight:
-                continue
+    """
+    Function to score and associate a batch of events and update the receipts
+    Input:
+        event_table: EventTable, in a timely order and after the events of the previous batches
+    Returns:
+        list of (event, customer ID, product_extended, quantity) purchases of the batch
+    """
 
-            # Put the product_extendend on the shelf will affect planogram
-            bookkeeper.add_product(
-                event.get_event_all_positions(bookkeeper), product_extendend
+    def resolve(self, event_table):
+        store = self.store
+        instrumentation = self.instrumentation
+        products_cache = store.products_cache
+        bookkeeper = store.bookkeeper
+        receipts = self.receipts
+        purchases = []
+        events = list(event_table)
+
+        # score all pick up events at once, putbacks invalidate the events of their shelves
+        with instrumentation.span("scoring"):
+            batch_score_calculator = BatchScoreCalculator(
+                [event for event in events if event.deltaWeight <= 0],
+                store.planogram,
+                products_cache,
+                store.product_ids_from_products_table,
+                catalog=store.product_catalog,
             )
-        else:
-            score_calculator = ScoreCalculator(
-                event, planogram, products_cache, product_ids_from_products_table
+            for gondola_id, shelf_id in self.changed_shelves:
+                batch_score_calculator.invalidate_shelf(gondola_id, shelf_id)
+        instrumentation.count("pickup_events", len(batch_score_calculator.events))
+
+        # associate all events to their closest targets at once
+        with instrumentation.span("target_lookup"):
+            event_locs = event_table.get_event_coordinates(store.plate_coordinates)
+            (
+                event_target_ids,
+                target_positions,
+                target_scores,
+                target_has_part,
+                has_target,
+            ) = self.__get_target_arrays(event_table, events)
+        with instrumentation.span("association"):
+            if ASSOCIATION_TYPE == CE_ASSOCIATION:
+                associate_product_array = associate_product_ce_array
+            elif ASSOCIATION_TYPE == CLOSEST_ASSOCIATION:
+                associate_product_array = associate_product_closest_array
+            else:
+                associate_product_array = associate_product_naive_array
+            event_target_idx = associate_product_array(
+                event_locs, target_positions, target_scores, target_has_part, has_target
             )
-            top_product_score = score_calculator.get_top_k(1)[0]
+        instrumentation.count("events", len(events))
+        instrumentation.count(
+            "targets_fetched", sum(len(target_ids) for target_ids in event_target_ids)
+        )
+
+        for event_idx, event in enumerate(events):
             if VERBOSE:
-                print("top 5 predicted products:")
-                for productScore in score_calculator.get_top_k(5):
-                    print(productScore)
+                print("----------------")
+                print("Event: ", event)
 
-            top_product_extended = get_product_by_id(
-                top_product_score.product.product.product_id.barcode, products_cache
-            )
+            target_ids = event_target_ids[event_idx]
+            if VERBOSE:
+                print(
+                    "Targets: Capture {} targets in this event".format(len(target_ids)),
+                    target_ids,
+                )
+            # Initliaze a customer receipt for all new targets
+            for target_id in target_ids:
+                if target_id not in receipts:
+                    customer_receipt = CustomerReceipt(target_id)
+                    receipts[target_id] = customer_receipt
+
+            # No target for the event found at all
+            if len(target_ids) == 0:
+                continue
 
-            product_extendend = top_product_extended
+            target_idx = event_target_idx[event_idx]
+            target_id = target_ids[target_idx] if target_idx >= 0 else None
+
+            isPutbackEvent = False
+            if event.deltaWeight > 0:
+                isPutbackEvent = True
+                # get all products pickedup by this target
+                if target_id not in receipts:
+                    continue
+                with instrumentation.span("putback"):
+                    customer_receipt = receipts[target_id]
+                    purchase_list = (
+                        customer_receipt.purchaseList
+                    )  # productID -> (product_extendend, num_product)
+
+                    # find most possible putback product_extendend whose weight is closest to the event weight
+                    candidate_products = []
+                    for item in purchase_list.values():
+                        product_extendend, num_product = item
+                        for count in range(1, num_product + 1):
+                            candidate_products.append((product_extendend, count))
+
+                    if len(candidate_products) == 0:
+                        continue
+                    # item = (product_extendend, count)
+                    candidate_products.sort(
+                        key=lambda item: abs(
+                            item[0].weight * item[1] - event.deltaWeight
+                        )
+                    )
+                    product, putback_count = candidate_products[0]
+
+                    # If weight difference is too large, ignore this event
+                    if abs(event.deltaWeight) < PUTBACK_JITTER_RATE * product.weight:
+                        continue
+
+                    # Put the product_extendend on the shelf will affect planogram
+                    product_extendend = get_product_by_id(
+                        product.product_id.barcode, products_cache
+                    )
+                    positions = event.get_event_all_positions()
+                    bookkeeper.add_product(positions, product_extendend)
+                    for position in positions:
+                        batch_score_calculator.invalidate_shelf(
+                            position.gondola, position.shelf
+                        )
+                        self.changed_shelves.add((position.gondola, position.shelf))
+            else:
+                with instrumentation.span("top_k"):
+                    top_product_score = batch_score_calculator.get_top_k(event, 1)[0]
+                    if VERBOSE:
+                        print("top 5 predicted products:")
+                        for productScore in batch_score_calculator.get_top_k(event, 5):
+                            print(productScore)
+
+                top_product_extended = get_product_by_id(
+                    top_product_score.product.product.product_id.barcode,
+                    products_cache,
+                )
 
-            # If deltaWeight is too small compared to the predicted product_extendend, ignore this event
-            if (
-                abs(event.deltaWeight)
-                < GRAB_FROM_SHELF_JITTER_RATE * product_extendend.product.weight
-            ):
-                continue
-        productID = product_extendend.product
-
-        ################################ Update receipt records ################################
-        # New customer, create a new receipt
-        if target_id not in receipts:
-            customer_receipt = CustomerReceipt(target_id)
-            receipts[target_id] = customer_receipt
-        # Existing customer, update receipt
-        else:
-            customer_receipt = receipts[target_id]
+                product_extendend = top_product_extended
 
-        if isPutbackEvent:
-            # Putback count from previous step
-            pred_quantity = putback_count
-        else:
-            # Predict quantity from delta weight
-            pred_quantity = max(
-                int(round(abs(event.deltaWeight / product_extendend.product.weight))),
-                1,
-            )
-            customer_receipt.purchase(product_extendend.product, pred_quantity)
+                # If deltaWeight is too small compared to the predicted product_extendend, ignore this event
+                if (
+                    abs(event.deltaWeight)
+                    < GRAB_FROM_SHELF_JITTER_RATE * product_extendend.product.weight
+                ):
+                    continue
+            productID = product_extendend.product
 
-        if VERBOSE:
-            print(
-                "Predicted: [%s][putback=%d] %s, weight=%dg, count=%d, thumbnail=%s"
-                % (
-                    product_extendend.product,
-                    isPutbackEvent,
-                    product_extendend.name,
-                    product_extendend.weight,
-                    pred_quantity,
-                    product_extendend.thumbnail,
-                )
-            )
-        else:
-            print(
-                "Predicted: [%s][putback=%d] %s, weight=%dg, count=%d"
-                % (
-                    product_extendend.product,
-                    isPutbackEvent,
-                    product_extendend.product.name,
-                    product_extendend.product.weight,
-                    pred_quantity,
+            ################################ Update receipt records ################################
+            # New customer, create a new receipt
+            if target_id not in receipts:
+                customer_receipt = CustomerReceipt(target_id)
+                receipts[target_id] = customer_receipt
+            # Existing customer, update receipt
+            else:
+                customer_receipt = receipts[target_id]
+
+            if isPutbackEvent:
+                # Putback count from previous step
+                pred_quantity = putback_count
+            else:
+                # Predict quantity from delta weight
+                pred_quantity = max(
+                    int(
+                        round(abs(event.deltaWeight / product_extendend.product.weight))
+                    ),
+                    1,
                 )
-            )
+                customer_receipt.purchase(product_extendend.product, pred_quantity)
+                purchases.append((event, target_id, product_extendend, pred_quantity))
 
-    ################ Display all receipts ################
-    if VERBOSE:
-        num_receipt = 0
-        if len(receipts) == 0:
-            print("No receipts!")
-            return {}
-
-        for id, customer_receipt in receipts.items():
-            print("============== Receipt {} ==============".format(num_receipt))
-            print("Customer ID: " + id)
-            print("Purchase List: ")
-            for _, entry in customer_receipt.purchaseList.items():
-                product_extendend, quantity = entry
+            if VERBOSE:
+                print(
+                    "Predicted: [%s][putback=%d] %s, weight=%dg, count=%d, thumbnail=%s"
+                    % (
+                        product_extendend.product,
+                        isPutbackEvent,
+                        product_extendend.name,
+                        product_extendend.weight,
+                        pred_quantity,
+                        product_extendend.thumbnail,
+                    )
+                )
+            else:
                 print(
-                    "*Name: "
-                    + product_extendend.name
-                    + ", Quantities: "
-                    + str(quantity),
-                    product_extendend.thumbnail,
-                    product_extendend.product,
+                    "Predicted: [%s][putback=%d] %s, weight=%dg, count=%d"
+                    % (
+                        product_extendend.product,
+                        isPutbackEvent,
+                        product_extendend.product.name,
+                        product_extendend.product.weight,
+                        pred_quantity,
+                    )
+                )
+
+        instrumentation.count("products_scored", batch_score_calculator.num_scores)
+        return purchases
+
+    # see TargetTimeline.get_target_arrays_for_events, cached by the events and the targets
+    def __get_target_arrays(self, event_table, events):
+        target_timeline = self.store.bookkeeper.target_timeline
+        cache_key = None
+        if target_timeline.cache_key is not None:
+            cache_key = get_cache_key(
+                "event_targets", target_timeline.cache_key, event_table.get_columns()
+            )
+        cached = self.stage_cache.load("event_targets", cache_key)
+        if cached is not None:
+            return (
+                cached["target_ids"],
+                cached["positions"],
+                cached["scores"],
+                cached["has_part"],
+                cached["has_target"],
+            )
+        target_arrays = self.store.bookkeeper.get_target_arrays_for_events(events)
+        self.stage_cache.save(
+            "event_targets",
+            cache_key,
+            dict(
+                zip(
+                    ("target_ids", "positions", "scores", "has_part", "has_target"),
+                    target_arrays,
                 )
-            num_receipt += 1
+            ),
+        )
+        return target_arrays
+
+
+"""
+Function to score and associate the events of a database and generate the receipts
+Input:
+    db_name: name of the database, for the report
+    store: Store of the database, its planogram is updated by putbacks
+    event_table: EventTable of the database
+    instrumentation: see process
+    stage_cache: StageCache of the targets of the events
+Returns:
+    dict of customer ID -> CustomerReceipt
+"""
+
+
+def build_receipts(
+    db_name,
+    store,
+    event_table,
+    instrumentation=NO_INSTRUMENTATION,
+    stage_cache=NO_STAGE_CACHE,
+):
+    # dictionary recording all receipts
+    # KEY: customer ID, VALUE: CustomerReceipt
+    receipt_resolver = ReceiptResolver(store, instrumentation, stage_cache)
+    print("Capture {} events in the database {}".format(len(event_table), db_name))
+    print("==============================================================")
+    receipt_resolver.resolve(event_table)
+    receipts = receipt_resolver.receipts
+    instrumentation.count("receipts", len(receipts))
+    print_receipts(receipts)
     return receipts
+
+
+# display all receipts when VERBOSE
+def print_receipts(receipts):
+    if not VERBOSE:
+        return
+    if len(receipts) == 0:
+        print("No receipts!")
+        return
+
+    for num_receipt, (id, customer_receipt) in enumerate(receipts.items()):
+        print("============== Receipt {} ==============".format(num_receipt))
+        print("Customer ID: " + id)
+        print("Purchase List: ")
+        for _, entry in customer_receipt.purchaseList.items():
+            product_extendend, quantity = entry
+            print(
+                "*Name: " + product_extendend.name + ", Quantities: " + str(quantity),
+                product_extendend.thumbnail,
+                product_extendend.product,
+            )
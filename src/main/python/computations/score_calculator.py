@@ -1,9 +1,25 @@
+import numpy as np
+
+from constants import (
+    ARRANGEMENT_CONTRIBUTION,
+    WEIGHT_CONTRIBUTION,
+    CANDIDATE_TYPE,
+    SHELF_CANDIDATES,
+    WEIGHT_CANDIDATES,
+    SHELF_AND_WEIGHT_CANDIDATES,
+    NUM_PLATE,
+)
 from data.pickup_event import PickUpEvent
+from data.product_catalog import ProductCatalog
 from data.product_score import ProductScore
 
-from utils.math_utils import area_under_two_gaussians
+from utils.math_utils import (
+    area_under_two_gaussians,
+    area_under_two_gaussians_same_std,
+    top_k_indices,
+)
 from utils.product_utils import (
-    get_product_by_id,
+    build_product_catalog,
     get_product_ids_from_position_2d,
     get_product_positions,
 )
@@ -11,41 +27,141 @@ from utils.product_utils import (
 sigmaForEventWeight = 10.0  # gram
 sigmaForProductWeight = 10.0  # gram
 
+# products further than this from the event weight get a weight score below 3e-5
+candidateWeightBand = 85.0  # gram
 
-class ScoreCalculator:
-    # [ProductScore]
-    productScoreRank: list
 
-    # productID -> ProductScore
+# weight probability of products for absolute event weights, element-wise
+def get_weight_scores(delta_weight_for_event, product_weights):
+    if sigmaForEventWeight == sigmaForProductWeight:
+        return area_under_two_gaussians_same_std(
+            delta_weight_for_event, product_weights, sigmaForEventWeight
+        )
+    return np.vectorize(area_under_two_gaussians)(
+        delta_weight_for_event,
+        sigmaForEventWeight,
+        product_weights,
+        sigmaForProductWeight,
+    )
+
+
+class ScoreCalculator:
+    # productID -> ProductScore, only built for the requested products
     productScoreDict: dict
 
+    # positions in the catalog of the scored products, sorted
+    candidates: np.ndarray
+
+    # scores of the candidates
+    arrangementScores: np.ndarray
+    weightScores: np.ndarray
+    totalScores: np.ndarray
+
+    catalog: ProductCatalog
     event: PickUpEvent
 
+    # number of product scores computed, the candidates of every calculation
+    num_scores: int
+
     def __init__(
-        self, event, planogram, products_cache, product_ids_from_products_table
+        self,
+        event,
+        planogram,
+        products_cache,
+        product_ids_from_products_table,
+        catalog=None,
+        candidate_type=CANDIDATE_TYPE,
     ):
-        self.productScoreRank = []
+        if catalog is None:
+            catalog = build_product_catalog(
+                products_cache, product_ids_from_products_table
+            )
         self.productScoreDict = {}
         self.event = event
         self.planogram = planogram
         self.products_cache = products_cache
+        self.catalog = catalog
+        self.candidate_type = candidate_type
+        self.num_scores = 0
 
-        for product_id in product_ids_from_products_table:
-            product = get_product_by_id(product_id, self.products_cache)
-            product_score = ProductScore(product)
-            self.productScoreRank.append(product_score)
-            self.productScoreDict[product_id] = product_score
-
-        self.__calculate_arrangement_score()
-        self.__calculate_weight_score()
-        self.productScoreRank.sort(key=lambda x: x.get_total_score(), reverse=True)
+        self.__calculate_scores(self.__get_candidates())
 
     def get_top_k(self, k):
-        return self.productScoreRank[:k]
+        top_k = top_k_indices(self.totalScores, k)
+        # fall back to the whole catalog when the pruned products could make it to the top k
+        if len(self.candidates) < len(self.catalog) and (
+            len(top_k) < k or self.totalScores[top_k[-1]] <= self.__pruned_score_bound()
+        ):
+            self.__calculate_scores(np.arange(len(self.catalog)))
+            top_k = top_k_indices(self.totalScores, k)
+        return [
+            self.get_score_by_product_id(self.catalog.product_ids[self.candidates[i]])
+            for i in top_k
+        ]
 
     def get_score_by_product_id(self, product_id):
+        if product_id not in self.productScoreDict:
+            catalog_idx = self.catalog.index[product_id]
+            product_score = ProductScore(self.catalog.products[catalog_idx])
+            i = np.searchsorted(self.candidates, catalog_idx)
+            if i < len(self.candidates) and self.candidates[i] == catalog_idx:
+                product_score.arrangementScore = float(self.arrangementScores[i])
+                product_score.weightScore = float(self.weightScores[i])
+            else:
+                # pruned product: not on the shelf of the event
+                product_score.weightScore = float(
+                    self.__get_weight_scores(self.catalog.weights[catalog_idx])
+                )
+            self.productScoreDict[product_id] = product_score
         return self.productScoreDict[product_id]
 
+    # products on the shelf of the event and/or with a weight close to the event weight
+    def __get_candidates(self):
+        on_shelf = self.catalog.get_indices(
+            get_product_ids_from_position_2d(
+                self.event.gondolaID, self.event.shelfID, self.planogram
+            )
+        )
+        delta_weight_for_event = abs(self.event.deltaWeight)
+        in_weight_band = self.catalog.get_weight_range_indices(
+            delta_weight_for_event - candidateWeightBand,
+            delta_weight_for_event + candidateWeightBand,
+        )
+        if self.candidate_type == SHELF_CANDIDATES:
+            candidates = on_shelf
+        elif self.candidate_type == WEIGHT_CANDIDATES:
+            candidates = in_weight_band
+        else:
+            candidates = np.union1d(on_shelf, in_weight_band)
+
+        # no candidate survives, score the whole catalog
+        if len(candidates) == 0:
+            candidates = np.arange(len(self.catalog))
+        return candidates
+
+    # highest total score that a product left out of the candidates can reach,
+    # only bounded when every product on the shelf is a candidate
+    def __pruned_score_bound(self):
+        if self.candidate_type != SHELF_AND_WEIGHT_CANDIDATES:
+            return -float("inf")
+        return WEIGHT_CONTRIBUTION * area_under_two_gaussians_same_std(
+            0.0, candidateWeightBand, max(sigmaForEventWeight, sigmaForProductWeight)
+        )
+
+    def __calculate_scores(self, candidates):
+        self.num_scores += len(candidates)
+        self.candidates = candidates
+        self.productScoreDict = {}
+        self.arrangementScores = np.zeros(len(candidates))
+        self.__calculate_arrangement_score()
+        self.weightScores = self.__get_weight_scores(
+            self.catalog.weights[self.candidates]
+        )
+        self.totalScores = (
+            ARRANGEMENT_CONTRIBUTION * self.arrangementScores
+            + WEIGHT_CONTRIBUTION * self.weightScores
+        )
+
     # arrangement probability (with different weight sensed on different plate)
     def __calculate_arrangement_score(self):
         delta_weights = self.event.deltaWeights
@@ -65,6 +181,10 @@ class ScoreCalculator:
             self.event.gondolaID, self.event.shelfID, self.planogram
         )
         for productID in product_ids_on_the_shelf:
+            catalog_idx = self.catalog.index[productID]
+            i = np.searchsorted(self.candidates, catalog_idx)
+            if i == len(self.candidates) or self.candidates[i] != catalog_idx:
+                continue
             positions = get_product_positions(productID, self.products_cache)
             for position in positions:
                 if (
@@ -72,19 +192,154 @@ class ScoreCalculator:
                     or position.shelf != self.event.shelfID
                 ):
                     continue
-                self.productScoreDict[productID].arrangementScore += prob_per_plate[
-                    position.plate - 1
-                ]
+                self.arrangementScores[i] += prob_per_plate[position.plate - 1]
 
-    def __calculate_weight_score(self):
-        delta_weight_for_event = abs(self.event.deltaWeight)
-        for productScore in self.productScoreRank:
-            product_weight = get_product_by_id(
-                productScore.product.get_barcode(), self.products_cache
-            ).product.weight
-            productScore.weightScore = area_under_two_gaussians(
-                delta_weight_for_event,
-                sigmaForEventWeight,
-                product_weight,
-                sigmaForProductWeight,
+    def __get_weight_scores(self, product_weights):
+        return get_weight_scores(abs(self.event.deltaWeight), product_weights)
+
+
+class BatchScoreCalculator:
+    """
+    Scores a list of pick up events against the whole catalog at once
+    events × plates × products arrangement scores and events × products weight scores are
+    computed as matrix operations, and only the top k products of every event are kept.
+    Putbacks change the planogram: invalidate_shelf() marks the events of a shelf as stale,
+    stale events are scored again one by one with ScoreCalculator.
+    """
+
+    events: list
+
+    # positions in the catalog of the top k products of every event, [event, k]
+    topKCandidates: np.ndarray
+    topKArrangementScores: np.ndarray
+    topKWeightScores: np.ndarray
+
+    # number of product scores computed, by the batch and by the events scored again
+    num_scores: int
+
+    def __init__(
+        self,
+        events,
+        planogram,
+        products_cache,
+        product_ids_from_products_table,
+        catalog=None,
+        k=5,
+        batch_size=256,
+    ):
+        if catalog is None:
+            catalog = build_product_catalog(
+                products_cache, product_ids_from_products_table
             )
+        self.events = list(events)
+        self.planogram = planogram
+        self.products_cache = products_cache
+        self.product_ids_from_products_table = product_ids_from_products_table
+        self.catalog = catalog
+        self.k = k
+        self.batch_size = batch_size
+
+        self.event_index = {id(event): i for i, event in enumerate(self.events)}
+        self.gondola_ids = np.array([event.gondolaID for event in self.events])
+        self.shelf_ids = np.array([event.shelfID for event in self.events])
+        self.is_stale = np.zeros(len(self.events), dtype=bool)
+        self.num_scores = 0
+        self.__calculate_scores()
+
+    def get_top_k(self, event, k):
+        i = self.event_index[id(event)]
+        if self.is_stale[i] or k > self.k:
+            score_calculator = ScoreCalculator(
+                event,
+                self.planogram,
+                self.products_cache,
+                self.product_ids_from_products_table,
+                catalog=self.catalog,
+            )
+            product_scores = score_calculator.get_top_k(k)
+            self.num_scores += score_calculator.num_scores
+            return product_scores
+
+        product_scores = []
+        for j in range(min(k, len(self.catalog))):
+            product_score = ProductScore(
+                self.catalog.products[self.topKCandidates[i, j]]
+            )
+            product_score.arrangementScore = float(self.topKArrangementScores[i, j])
+            product_score.weightScore = float(self.topKWeightScores[i, j])
+            product_scores.append(product_score)
+        return product_scores
+
+    # the planogram of a shelf changed, its events have to be scored again
+    def invalidate_shelf(self, gondola_id, shelf_id):
+        self.is_stale |= (self.gondola_ids == gondola_id) & (self.shelf_ids == shelf_id)
+
+    def __calculate_scores(self):
+        num_events = len(self.events)
+        k = min(self.k, len(self.catalog))
+        self.topKCandidates = np.zeros((num_events, k), dtype=np.intp)
+        self.topKArrangementScores = np.zeros((num_events, k))
+        self.topKWeightScores = np.zeros((num_events, k))
+        if num_events == 0:
+            return
+
+        self.num_scores += num_events * len(self.catalog)
+        prob_per_plate = self.__get_prob_per_plate()  # [event, plate]
+        event_weights = np.abs([event.deltaWeight for event in self.events])
+        shelf_placements = {}
+        for begin in range(0, num_events, self.batch_size):
+            end = min(begin + self.batch_size, num_events)
+
+            arrangement_scores = np.zeros((end - begin, len(self.catalog)))
+            shelves = set(zip(self.gondola_ids[begin:end], self.shelf_ids[begin:end]))
+            for gondola_id, shelf_id in shelves:
+                if (gondola_id, shelf_id) not in shelf_placements:
+                    shelf_placements[gondola_id, shelf_id] = self.__get_placement(
+                        gondola_id, shelf_id
+                    )
+                columns, placement = shelf_placements[gondola_id, shelf_id]
+                rows = np.flatnonzero(
+                    (self.gondola_ids[begin:end] == gondola_id)
+                    & (self.shelf_ids[begin:end] == shelf_id)
+                )
+                arrangement_scores[np.ix_(rows, columns)] = (
+                    prob_per_plate[begin + rows] @ placement
+                )
+
+            weight_scores = get_weight_scores(
+                event_weights[begin:end, None], self.catalog.weights[None, :]
+            )
+            total_scores = (
+                ARRANGEMENT_CONTRIBUTION * arrangement_scores
+                + WEIGHT_CONTRIBUTION * weight_scores
+            )
+            for row in range(end - begin):
+                top_k = top_k_indices(total_scores[row], k)
+                self.topKCandidates[begin + row] = top_k
+                self.topKArrangementScores[begin + row] = arrangement_scores[row, top_k]
+                self.topKWeightScores[begin + row] = weight_scores[row, top_k]
+
+    # arrangement probability of every plate, [event, plate]
+    def __get_prob_per_plate(self):
+        delta_weights = np.array(
+            [np.asarray(event.deltaWeights, dtype=np.float64) for event in self.events]
+        )
+        # summed in plate order, the same as sum() on a single event
+        overall_deltas = np.cumsum(delta_weights, axis=1)[:, -1:]
+        is_zero = overall_deltas == 0
+        return np.where(
+            is_zero,
+            1 / delta_weights.shape[1],
+            delta_weights / np.where(is_zero, 1, overall_deltas),
+        )
+
+    # positions in the catalog of the products on a shelf, with their [plate, product] placement
+    def __get_placement(self, gondola_id, shelf_id):
+        product_ids_on_the_shelf, placement = self.planogram.get_shelf_placement(
+            gondola_id, shelf_id
+        )
+        columns = np.array(
+            [self.catalog.index[product_id] for product_id in product_ids_on_the_shelf],
+            dtype=np.intp,
+        )
+        return columns, placement.astype(np.float64)
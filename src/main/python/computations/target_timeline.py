@@ -0,0 +1,324 @@
+import numpy as np
+
+from constants import INCH_TO_METER, CE_ASSOCIATION
+from data.coordinates import Coordinates
+from data.target import Target
+
+# body parts of a target, in the order of the body part columns
+HEAD = 0
+LEFT_HAND = 1
+RIGHT_HAND = 2
+NUM_BODY_PARTS = 3
+
+TARGETS_PROJECTION = {"timestamp": 1, "document.targets": 1}
+
+
+class TargetTimeline:
+    """
+    Target snapshots of a database, loaded into columns sorted by timestamp
+    Snapshots can be added while a recording is tailed with extend(), and the snapshots no
+    event will read again released with drop_before()
+    Snapshot (document) columns:
+        doc_timestamps: [doc]
+        doc_has_targets: [doc], False when the snapshot has no target list
+        doc_row_begin: [doc + 1], first row of every snapshot
+    Row columns, one row per target per snapshot:
+        target_codes: [row], position of the target id in target_ids
+        valid_entrance: [row]
+        positions: [row, body part, xyz] in meter
+        scores: [row, body part]
+        has_part: [row, body part], False when the body part was not detected
+    cache_key: key of the snapshots in the stage cache, None when they are not cached or
+        once they are extended
+    """
+
+    target_ids: list
+
+    # array columns, saved to and loaded from the stage cache with target_ids
+    COLUMNS = (
+        "doc_timestamps",
+        "doc_has_targets",
+        "doc_row_begin",
+        "target_codes",
+        "valid_entrance",
+        "positions",
+        "scores",
+        "has_part",
+    )
+
+    def __init__(self, target_docs=()):
+        self.cache_key = None
+        self.target_ids = []
+        self.codes_by_id = {}
+        self.doc_timestamps = np.zeros(0)
+        self.doc_has_targets = np.zeros(0, dtype=bool)
+        self.doc_row_begin = np.zeros(1, dtype=np.intp)
+        self.target_codes = np.zeros(0, dtype=np.intp)
+        self.valid_entrance = np.zeros(0, dtype=bool)
+        self.positions = np.zeros((0, NUM_BODY_PARTS, 3))
+        self.scores = np.zeros((0, NUM_BODY_PARTS))
+        self.has_part = np.zeros((0, NUM_BODY_PARTS), dtype=bool)
+        self.extend(target_docs)
+
+    @classmethod
+    def from_columns(cls, columns, cache_key=None):
+        target_timeline = cls()
+        target_timeline.target_ids = list(columns["target_ids"])
+        target_timeline.codes_by_id = {
+            target_id: code for code, target_id in enumerate(target_timeline.target_ids)
+        }
+        for column in cls.COLUMNS:
+            setattr(target_timeline, column, columns[column])
+        target_timeline.cache_key = cache_key
+        return target_timeline
+
+    # dict of column name -> array, and target_ids
+    def get_columns(self):
+        columns = {column: getattr(self, column) for column in self.COLUMNS}
+        columns["target_ids"] = list(self.target_ids)
+        return columns
+
+    def __len__(self):
+        return len(self.doc_timestamps)
+
+    # add target snapshots, the columns stay sorted by timestamp, keeping the loading order on
+    # ties, as if all the snapshots had been loaded at once
+    def extend(self, target_docs):
+        codes_by_id = self.codes_by_id
+        doc_timestamps = []
+        doc_has_targets = []
+        doc_num_rows = []
+        target_codes = []
+        valid_entrance = []
+        positions = []
+        scores = []
+        has_part = []
+
+        for target_doc in target_docs:
+            targets = target_doc["document"].get("targets", {})
+            doc_timestamps.append(target_doc["timestamp"])
+            doc_has_targets.append("targets" in targets)
+            target_list = targets.get("targets", [])
+            doc_num_rows.append(len(target_list))
+            for target in target_list:
+                target_id = target["target_id"]["id"]
+                if target_id not in codes_by_id:
+                    codes_by_id[target_id] = len(self.target_ids)
+                    self.target_ids.append(target_id)
+                target_codes.append(codes_by_id[target_id])
+                valid_entrance.append(
+                    target["target_state"] == "TARGETSTATE_VALID_ENTRANCE"
+                )
+
+                body_parts = [target.get("head")]
+                if CE_ASSOCIATION and "l_wrist" in target and "r_wrist" in target:
+                    body_parts += [target["l_wrist"], target["r_wrist"]]
+                body_parts += [None] * (NUM_BODY_PARTS - len(body_parts))
+                for body_part in body_parts:
+                    if body_part is None or len(body_part["point"]) == 0:
+                        positions.append((np.nan, np.nan, np.nan))
+                        scores.append(0.0)
+                        has_part.append(False)
+                        continue
+                    point = body_part["point"]
+                    positions.append(
+                        (
+                            point["x"] * INCH_TO_METER,
+                            point["y"] * INCH_TO_METER,
+                            point["z"] * INCH_TO_METER,
+                        )
+                    )
+                    scores.append(body_part["score"])
+                    has_part.append(True)
+
+        if len(doc_timestamps) == 0:
+            return
+        self.cache_key = None
+
+        # sort the snapshots in a timely order, keeping the loading order on ties
+        doc_timestamps = np.concatenate(
+            [self.doc_timestamps, np.array(doc_timestamps, dtype=np.float64)]
+        )
+        doc_order = np.argsort(doc_timestamps, kind="stable")
+        doc_num_rows = np.concatenate(
+            [np.diff(self.doc_row_begin), np.array(doc_num_rows, dtype=np.intp)]
+        )
+        doc_row_begin = np.cumsum(doc_num_rows) - doc_num_rows
+        # rows of the snapshots in their sorted order, without a loop over the snapshots
+        sorted_num_rows = doc_num_rows[doc_order]
+        sorted_row_begin = np.cumsum(sorted_num_rows) - sorted_num_rows
+        row_order = np.repeat(
+            doc_row_begin[doc_order] - sorted_row_begin, sorted_num_rows
+        ) + np.arange(sorted_num_rows.sum(), dtype=np.intp)
+
+        self.doc_timestamps = doc_timestamps[doc_order]
+        self.doc_has_targets = np.concatenate(
+            [self.doc_has_targets, np.array(doc_has_targets, dtype=bool)]
+        )[doc_order]
+        self.doc_row_begin = np.zeros(len(doc_order) + 1, dtype=np.intp)
+        np.cumsum(doc_num_rows[doc_order], out=self.doc_row_begin[1:])
+
+        self.target_codes = np.concatenate(
+            [self.target_codes, np.array(target_codes, dtype=np.intp)]
+        )[row_order]
+        self.valid_entrance = np.concatenate(
+            [self.valid_entrance, np.array(valid_entrance, dtype=bool)]
+        )[row_order]
+        self.positions = np.concatenate(
+            [
+                self.positions,
+                np.array(positions, dtype=np.float64).reshape(-1, NUM_BODY_PARTS, 3),
+            ]
+        )[row_order]
+        self.scores = np.concatenate(
+            [
+                self.scores,
+                np.array(scores, dtype=np.float64).reshape(-1, NUM_BODY_PARTS),
+            ]
+        )[row_order]
+        self.has_part = np.concatenate(
+            [
+                self.has_part,
+                np.array(has_part, dtype=bool).reshape(-1, NUM_BODY_PARTS),
+            ]
+        )[row_order]
+
+    # release the snapshots before a timestamp, events triggered from then on read the same
+    # snapshots as before
+    def drop_before(self, timestamp):
+        num_docs = np.searchsorted(self.doc_timestamps, timestamp, "left")
+        if num_docs == 0:
+            return
+        self.cache_key = None
+        num_rows = self.doc_row_begin[num_docs]
+        self.doc_timestamps = self.doc_timestamps[num_docs:]
+        self.doc_has_targets = self.doc_has_targets[num_docs:]
+        self.doc_row_begin = self.doc_row_begin[num_docs:] - num_rows
+        self.target_codes = self.target_codes[num_rows:]
+        self.valid_entrance = self.valid_entrance[num_rows:]
+        self.positions = self.positions[num_rows:]
+        self.scores = self.scores[num_rows:]
+        self.has_part = self.has_part[num_rows:]
+
+    """
+    Function to get the rows of the latest snapshot of every target during an event
+    Snapshots from triggerBegin to triggerEnd are read in a timely order, and the reading stops
+    after the first snapshot past the half of the window or past the peak time.
+    Input:
+        event
+    Output:
+        ndarray of rows, one per target, ordered by first appearance in the window
+    """
+
+    def get_target_rows_for_event(self, event):
+        doc_begin = np.searchsorted(self.doc_timestamps, event.triggerBegin, "left")
+        doc_end = np.searchsorted(self.doc_timestamps, event.triggerEnd, "left")
+        num_timestamps = doc_end - doc_begin
+        if num_timestamps <= 0:
+            return np.zeros(0, dtype=np.intp)
+
+        is_stop = self.doc_has_targets[doc_begin:doc_end] & (
+            (np.arange(num_timestamps) > num_timestamps / 2)
+            | (self.doc_timestamps[doc_begin:doc_end] > event.peakTime)
+        )
+        stops = np.flatnonzero(is_stop)
+        doc_last = doc_begin + (stops[0] if len(stops) else num_timestamps - 1)
+
+        row_begin = self.doc_row_begin[doc_begin]
+        row_end = self.doc_row_begin[doc_last + 1]
+        codes = self.target_codes[row_begin:row_end]
+        _, first_rows = np.unique(codes, return_index=True)
+        _, last_rows_reversed = np.unique(codes[::-1], return_index=True)
+        last_rows = len(codes) - 1 - last_rows_reversed
+        return row_begin + last_rows[np.argsort(first_rows, kind="stable")]
+
+    """
+    Function to get the latest body parts of the targets of an event as arrays
+    Input:
+        event
+    Output:
+        target_ids: [target]
+        positions: ndarray [target, body part, xyz]
+        scores: ndarray [target, body part]
+        has_part: ndarray [target, body part]
+    """
+
+    def get_target_arrays_for_event(self, event):
+        rows = self.get_target_rows_for_event(event)
+        return (
+            [self.target_ids[code] for code in self.target_codes[rows]],
+            self.positions[rows],
+            self.scores[rows],
+            self.has_part[rows],
+        )
+
+    """
+    Function to get the latest body parts of the targets of many events, padded to the
+    highest number of targets
+    Input:
+        events
+    Output:
+        target_ids: [event][target]
+        positions: ndarray [event, target, body part, xyz]
+        scores: ndarray [event, target, body part]
+        has_part: ndarray [event, target, body part]
+        has_target: ndarray [event, target], False for padding
+    """
+
+    def get_target_arrays_for_events(self, events):
+        rows_per_event = [self.get_target_rows_for_event(event) for event in events]
+        max_targets = max([len(rows) for rows in rows_per_event] + [0])
+        rows = np.zeros((len(rows_per_event), max_targets), dtype=np.intp)
+        has_target = np.zeros((len(rows_per_event), max_targets), dtype=bool)
+        for i, event_rows in enumerate(rows_per_event):
+            rows[i, : len(event_rows)] = event_rows
+            has_target[i, : len(event_rows)] = True
+        target_ids = [
+            [self.target_ids[code] for code in self.target_codes[event_rows]]
+            for event_rows in rows_per_event
+        ]
+        if max_targets == 0:
+            return (
+                target_ids,
+                np.zeros(rows.shape + (NUM_BODY_PARTS, 3)),
+                np.zeros(rows.shape + (NUM_BODY_PARTS,)),
+                np.zeros(rows.shape + (NUM_BODY_PARTS,), dtype=bool),
+                has_target,
+            )
+        return (
+            target_ids,
+            self.positions[rows],
+            self.scores[rows],
+            self.has_part[rows] & has_target[..., None],
+            has_target,
+        )
+
+    """
+    Function to get lastest targets for an event
+    Input:
+        event
+    Output:
+        Dict[target_id, Target]: all the in-store target during this event period
+    """
+
+    def get_targets_for_event(self, event):
+        targets = {}
+        for row in self.get_target_rows_for_event(event):
+            target_id = self.target_ids[self.target_codes[row]]
+            body_parts = [None] * NUM_BODY_PARTS
+            for part in range(NUM_BODY_PARTS):
+                if not self.has_part[row, part]:
+                    continue
+                x, y, z = self.positions[row, part]
+                body_parts[part] = {
+                    "position": Coordinates(float(x), float(y), float(z)),
+                    "score": float(self.scores[row, part]),
+                }
+            targets[target_id] = Target(
+                target_id,
+                body_parts[HEAD],
+                body_parts[LEFT_HAND],
+                body_parts[RIGHT_HAND],
+                bool(self.valid_entrance[row]),
+            )
+        return targets
@@ -0,0 +1,389 @@
+import numpy as np
+
+from computations.weight_trigger import (
+    DEFAULT_THRESHOLDS,
+    DEFAULT_WINDOW_SIZE,
+    TIMESTAMP_GAP_TOLERANCE,
+    WeightTrigger,
+)
+from constants import NUM_GONDOLA, PLATE_SAMPLE_FREQUENCY
+from data.event_table import EventTable
+from utils.instrumentation_utils import NO_INSTRUMENTATION
+from utils.math_utils import find_active_runs, rolling_mean_std, segment_argmax
+
+
+class GondolaWeightStream:
+    """
+    Moving weight and event detection of one gondola, updated while its plate data documents
+    arrive in a timely order. The events are the same as the ones of
+    WeightTrigger.detect_weight_events_for_gondola over the whole recording.
+    gondola_id
+    window_size, thresholds: see WeightTrigger
+    samples: [shelf, plate, time] plate samples from the start of the block of the next
+        moving window, see rolling_mean_std, i.e. the last window of samples is carried over
+    sample_timestamps: [time] timestamp of every sample of samples
+    sample_offset: index of the first sample of samples since the first sample of the gondola
+    num_windows: number of moving windows computed so far
+    pending_document: (timestamp, [shelf, plate, time] samples) of the last document, the
+        timestamps of its samples are known once the next document arrives
+    Runs of active windows still open at the last window, per shelf:
+        run_begin: [shelf] first window of the run, -1 when the shelf is not active
+        begin_shelf_mean, begin_plate_mean, begin_timestamp: moving weight at run_begin
+        peak_std, peak_window, peak_timestamp: highest moving std of the run
+    """
+
+    def __init__(
+        self, gondola_id, window_size=DEFAULT_WINDOW_SIZE, thresholds=None, num_plate=12
+    ):
+        self.gondola_id = gondola_id
+        self.window_size = window_size
+        self.thresholds = DEFAULT_THRESHOLDS if thresholds is None else thresholds
+        self.num_plate = num_plate
+        self.frequency = PLATE_SAMPLE_FREQUENCY
+        self.samples = None
+        self.sample_timestamps = np.zeros(0)
+        self.sample_offset = 0
+        self.num_windows = 0
+        self.pending_document = None
+        # first sample of every row, the reference of rolling_mean_std over the whole recording
+        self.shelf_reference = None
+        self.plate_reference = None
+        self.run_begin = None
+
+    def __repr__(self):
+        return "GondolaWeightStream(%d, %d windows)" % (
+            self.gondola_id,
+            self.num_windows,
+        )
+
+    # add a [shelf, plate, time] document cropped by WeightTrigger.adapt_np_plate
+    def add_document(self, timestamp, samples, frequency=None):
+        if self.samples is None:
+            self.__start(samples, frequency)
+        if self.pending_document is not None:
+            self.__append_samples(*self.pending_document, timestamp)
+        self.pending_document = (timestamp, samples)
+
+    # events of the runs closed by the documents added since the last update
+    def update(self):
+        window_size = self.window_size
+        if self.samples is None or self.samples.shape[-1] < window_size:
+            return EventTable.from_events([], self.num_plate)
+        head = window_size // 2
+        shelf_samples = self.samples.sum(axis=1)  # [shelf, time]
+        if self.shelf_reference is None:
+            self.shelf_reference = shelf_samples[:, 0]
+        shelf_mean, shelf_std = rolling_mean_std(
+            shelf_samples, window_size, self.shelf_reference
+        )
+        plate_mean, _ = rolling_mean_std(
+            self.samples, window_size, self.plate_reference
+        )
+        # windows of samples already computed by the previous updates are skipped
+        first = self.num_windows - self.sample_offset
+        num_new = shelf_mean.shape[1] - first
+        if num_new <= 0:
+            return EventTable.from_events([], self.num_plate)
+        timestamps = self.sample_timestamps[
+            first + head : first + head + num_new
+        ]  # timestamps of the window centers
+        events = self.__detect(
+            shelf_mean[:, first:],
+            shelf_std[:, first:],
+            plate_mean[:, :, first:],
+            timestamps,
+        )
+        self.num_windows += num_new
+
+        # carry over the samples from the start of the block of the next window
+        carry_begin = (
+            self.num_windows // window_size
+        ) * window_size - self.sample_offset
+        self.samples = self.samples[:, :, carry_begin:].copy()
+        self.sample_timestamps = self.sample_timestamps[carry_begin:]
+        self.sample_offset += carry_begin
+        return events
+
+    # events of the last document and of the runs still open at the end of the recording
+    def flush(self):
+        if self.pending_document is not None:
+            self.__append_samples(*self.pending_document)
+            self.pending_document = None
+        events = self.update()
+        if self.run_begin is None:
+            return events
+        is_open = self.run_begin >= 0
+        closed = self.__make_events(
+            np.flatnonzero(is_open),
+            self.run_begin[is_open],
+            self.begin_shelf_mean[is_open],
+            self.begin_plate_mean[is_open],
+            self.begin_timestamp[is_open],
+            self.peak_window[is_open],
+            self.peak_timestamp[is_open],
+            np.full(np.count_nonzero(is_open), self.num_windows - 1),
+            self.last_shelf_mean[is_open],
+            self.last_plate_mean[is_open],
+            np.full(np.count_nonzero(is_open), self.last_timestamp),
+        )
+        self.run_begin[:] = -1
+        return EventTable.concatenate([events, closed], self.num_plate)
+
+    # lowest timestamp of the events still to come, the begin of the open runs or the center
+    # of the next window; horizon: timestamp of the latest document of the store
+    def get_watermark(self, horizon):
+        watermark = horizon
+        if self.run_begin is not None and (self.run_begin >= 0).any():
+            watermark = min(watermark, self.begin_timestamp[self.run_begin >= 0].min())
+        next_center = self.num_windows + self.window_size // 2 - self.sample_offset
+        if next_center < len(self.sample_timestamps):
+            watermark = min(watermark, self.sample_timestamps[next_center])
+        elif self.pending_document is not None:
+            watermark = min(watermark, self.pending_document[0])
+        return watermark
+
+    def __start(self, samples, frequency):
+        num_shelf, num_plate = samples.shape[:2]
+        if frequency:
+            self.frequency = frequency
+        self.samples = np.zeros((num_shelf, num_plate, 0), dtype=samples.dtype)
+        self.plate_reference = samples[:, :, 0]
+        self.run_begin = np.full(num_shelf, -1, dtype=np.intp)
+        self.begin_shelf_mean = np.zeros(num_shelf)
+        self.begin_plate_mean = np.zeros((num_shelf, num_plate))
+        self.begin_timestamp = np.zeros(num_shelf)
+        self.peak_std = np.zeros(num_shelf)
+        self.peak_window = np.zeros(num_shelf, dtype=np.intp)
+        self.peak_timestamp = np.zeros(num_shelf)
+        self.last_shelf_mean = np.zeros(num_shelf)
+        self.last_plate_mean = np.zeros((num_shelf, num_plate))
+        self.last_timestamp = 0.0
+
+    # samples of a document are evenly spread until the next document,
+    # as in WeightTrigger.get_sample_steps
+    def __append_samples(self, timestamp, samples, next_timestamp=None):
+        num_doc_samples = samples.shape[-1]
+        nominal_step = 1 / self.frequency
+        sample_step = nominal_step
+        if next_timestamp is not None:
+            doc_duration = next_timestamp - timestamp
+            if not doc_duration > (
+                TIMESTAMP_GAP_TOLERANCE * nominal_step * num_doc_samples
+            ):
+                sample_step = doc_duration / num_doc_samples
+        self.samples = np.concatenate([self.samples, samples], axis=-1)
+        self.sample_timestamps = np.concatenate(
+            [
+                self.sample_timestamps,
+                timestamp + sample_step * np.arange(num_doc_samples),
+            ]
+        )
+
+    # runs of active windows of new moving statistics, continuing the open runs
+    def __detect(self, shelf_mean, shelf_std, plate_mean, timestamps):
+        first_window = self.num_windows
+        is_active = shelf_std > self.thresholds.get("std_shelf")
+        shelf_ids, begins, ends = find_active_runs(is_active)
+        peaks = segment_argmax(shelf_std, shelf_ids, begins, ends)
+        peak_std = shelf_std[shelf_ids, peaks]
+
+        # runs starting at the first new window continue the open runs of their shelves
+        continues = (begins == 0) & (self.run_begin[shelf_ids] >= 0)
+        # the first maximum of a run wins, as with segment_argmax
+        carried_peak = continues & (self.peak_std[shelf_ids] >= peak_std)
+        n_begins = np.where(continues, self.run_begin[shelf_ids], first_window + begins)
+        begin_shelf_mean = np.where(
+            continues, self.begin_shelf_mean[shelf_ids], shelf_mean[shelf_ids, begins]
+        )
+        begin_plate_mean = np.where(
+            continues[:, None],
+            self.begin_plate_mean[shelf_ids],
+            plate_mean[shelf_ids, :, begins],
+        )
+        begin_timestamp = np.where(
+            continues, self.begin_timestamp[shelf_ids], timestamps[begins]
+        )
+        peak_std = np.where(carried_peak, self.peak_std[shelf_ids], peak_std)
+        n_peaks = np.where(
+            carried_peak, self.peak_window[shelf_ids], first_window + peaks
+        )
+        peak_timestamp = np.where(
+            carried_peak, self.peak_timestamp[shelf_ids], timestamps[peaks]
+        )
+
+        # open runs ended by the last window of the previous update
+        stopped = np.flatnonzero((self.run_begin >= 0) & ~is_active[:, 0])
+        stopped_events = self.__make_events(
+            stopped,
+            self.run_begin[stopped],
+            self.begin_shelf_mean[stopped],
+            self.begin_plate_mean[stopped],
+            self.begin_timestamp[stopped],
+            self.peak_window[stopped],
+            self.peak_timestamp[stopped],
+            np.full(len(stopped), first_window - 1),
+            self.last_shelf_mean[stopped],
+            self.last_plate_mean[stopped],
+            np.full(len(stopped), self.last_timestamp),
+        )
+        is_closed = ends < shelf_mean.shape[1] - 1
+        closed_events = self.__make_events(
+            shelf_ids[is_closed],
+            n_begins[is_closed],
+            begin_shelf_mean[is_closed],
+            begin_plate_mean[is_closed],
+            begin_timestamp[is_closed],
+            n_peaks[is_closed],
+            peak_timestamp[is_closed],
+            first_window + ends[is_closed],
+            shelf_mean[shelf_ids[is_closed], ends[is_closed]],
+            plate_mean[shelf_ids[is_closed], :, ends[is_closed]],
+            timestamps[ends[is_closed]],
+        )
+
+        # runs reaching the last window stay open
+        is_open = ~is_closed
+        open_shelves = shelf_ids[is_open]
+        self.run_begin[:] = -1
+        self.run_begin[open_shelves] = n_begins[is_open]
+        self.begin_shelf_mean[open_shelves] = begin_shelf_mean[is_open]
+        self.begin_plate_mean[open_shelves] = begin_plate_mean[is_open]
+        self.begin_timestamp[open_shelves] = begin_timestamp[is_open]
+        self.peak_std[open_shelves] = peak_std[is_open]
+        self.peak_window[open_shelves] = n_peaks[is_open]
+        self.peak_timestamp[open_shelves] = peak_timestamp[is_open]
+        self.last_shelf_mean = shelf_mean[:, -1]
+        self.last_plate_mean = plate_mean[:, :, -1]
+        self.last_timestamp = timestamps[-1]
+        return EventTable.concatenate([stopped_events, closed_events], self.num_plate)
+
+    # events of closed runs, the runs too short or without a weight change are dropped
+    # as in WeightTrigger.detect_weight_events_for_gondola
+    def __make_events(
+        self,
+        shelf_ids,
+        n_begins,
+        begin_shelf_mean,
+        begin_plate_mean,
+        begin_timestamp,
+        n_peaks,
+        peak_timestamp,
+        n_ends,
+        end_shelf_mean,
+        end_plate_mean,
+        end_timestamp,
+    ):
+        lengths = n_ends - n_begins + 1
+        delta_ws = end_shelf_mean - begin_shelf_mean
+        is_event = (lengths >= self.thresholds.get("min_event_length")) & (
+            np.abs(delta_ws) > self.thresholds.get("mean_shelf")
+        )
+        plates = (
+            end_plate_mean[:, : self.num_plate] - begin_plate_mean[:, : self.num_plate]
+        )  # [event, plate]
+        return EventTable(
+            begin_timestamp[is_event],
+            end_timestamp[is_event],
+            peak_timestamp[is_event],
+            n_begins[is_event],
+            n_ends[is_event],
+            delta_ws[is_event],
+            np.full(np.count_nonzero(is_event), self.gondola_id),
+            shelf_ids[is_event] + 1,
+            plates[is_event].reshape(-1, self.num_plate),
+        )
+
+
+class WeightStream:
+    """
+    Events of the plate data of a store, detected and split while the documents arrive
+    The moving statistics, runs of active windows and splits are the ones of WeightTrigger
+    over the whole recording, so a replayed recording gives the same events as batch mode.
+    weight_trigger: WeightTrigger without plate data, crops the documents and splits the
+        events with the same code as batch mode
+    gondolas: [GondolaWeightStream]
+    horizon: timestamp of the latest document, -inf before the first one
+    """
+
+    def __init__(
+        self,
+        test_start_time,
+        get_product_id_from_position_2d,
+        get_product_id_from_position_3d,
+        get_product_by_id,
+        window_size=DEFAULT_WINDOW_SIZE,
+        thresholds=None,
+        number_gondolas=NUM_GONDOLA,
+        num_workers=1,
+        instrumentation=NO_INSTRUMENTATION,
+    ):
+        self.test_start_time = test_start_time
+        self.instrumentation = instrumentation
+        self.weight_trigger = WeightTrigger(
+            test_start_time,
+            [],
+            get_product_id_from_position_2d,
+            get_product_id_from_position_3d,
+            get_product_by_id,
+            window_size=window_size,
+            num_workers=num_workers,
+        )
+        self.gondolas = [
+            GondolaWeightStream(gondola_idx + 1, window_size, thresholds)
+            for gondola_idx in range(number_gondolas)
+        ]
+        self.horizon = -np.inf
+
+    def __repr__(self):
+        return "WeightStream(%s)" % ", ".join(
+            repr(gondola) for gondola in self.gondolas
+        )
+
+    # add PlateData in a timely order, documents before the test start time are skipped
+    def add_plate_data(self, plate_data):
+        num_docs = 0
+        num_samples = 0
+        for item in plate_data:
+            if item.timestamp < self.test_start_time:
+                continue
+            gondola_id = item.plate_id.gondola_id
+            self.gondolas[gondola_id - 1].add_document(
+                item.timestamp,
+                self.weight_trigger.adapt_np_plate(gondola_id, item.data),
+                item.frequency,
+            )
+            self.horizon = max(self.horizon, item.timestamp)
+            num_docs += 1
+            num_samples += item.data.shape[0]
+        self.instrumentation.count("plate_docs", num_docs)
+        self.instrumentation.count("samples", num_samples)
+
+    # split events of the runs closed since the last update, per gondola
+    def update(self):
+        return self.__get_events(lambda gondola: gondola.update())
+
+    # split events of the remaining runs, at the end of the recording
+    def flush(self):
+        return self.__get_events(lambda gondola: gondola.flush())
+
+    # lowest timestamp of the events still to come, see GondolaWeightStream.get_watermark
+    def get_watermark(self):
+        return min(gondola.get_watermark(self.horizon) for gondola in self.gondolas)
+
+    def __get_events(self, get_gondola_events):
+        instrumentation = self.instrumentation
+
+        def get_events_for_gondola(gondola):
+            with instrumentation.span("detection"):
+                events = get_gondola_events(gondola)
+            with instrumentation.span("splitting"):
+                event_table = EventTable.from_events(
+                    self.weight_trigger.splitEvents(events)
+                )
+            instrumentation.count("detected_events", len(events))
+            instrumentation.count("split_events", len(event_table))
+            return event_table
+
+        return EventTable.concatenate(
+            self.weight_trigger.map_gondolas(get_events_for_gondola, self.gondolas)
+        )
@@ -1,8 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 
+from constants import NUM_GONDOLA, PLATE_SAMPLE_FREQUENCY, VERBOSE
+from data.event_table import EventTable
 from data.pickup_event import PickUpEvent
 
-from utils.coordinate_utils import init_nd_array, rolling_window
+from utils.instrumentation_utils import NO_INSTRUMENTATION
+from utils.math_utils import find_active_runs, rolling_mean_std, segment_argmax
+from utils.stage_cache_utils import NO_STAGE_CACHE, get_cache_key
+
+# a document is followed by a gap when the next one arrives this many nominal periods later
+TIMESTAMP_GAP_TOLERANCE = 1.5
+# samples of a moving window
+DEFAULT_WINDOW_SIZE = 60
+# event detection thresholds, in gram for the weights and in samples for the lengths
+DEFAULT_THRESHOLDS = {
+    "std_shelf": 20,
+    "mean_shelf": 10,
+    "mean_plate": 5,
+    "min_event_length": 30,
+}
+
+
+# copy of an array with room for at least min_size entries on its last axis, at least doubled
+def grow_last_axis(a, min_size):
+    grown = np.empty(a.shape[:-1] + (max(min_size, 2 * a.shape[-1]),), dtype=a.dtype)
+    grown[..., : a.shape[-1]] = a
+    return grown
 
 
 class WeightTrigger:
@@ -23,85 +48,197 @@ class WeightTrigger:
         get_product_id_from_position_2d,
         get_product_id_from_position_3d,
         get_product_by_id,
-        get_3d_coordinates_for_plate,
+        window_size=DEFAULT_WINDOW_SIZE,
+        num_workers=1,
+        agg_weight=None,
+        plate_doc_counts=None,
+        instrumentation=NO_INSTRUMENTATION,
+        stage_cache=NO_STAGE_CACHE,
+        cache_key=None,
     ):
         self.plate_data = plate_data
+        self.instrumentation = instrumentation
+        # the moving stats and detected events of every gondola are cached by the key of the
+        # aggregated plate data, nothing is cached when it is None
+        self.stage_cache = stage_cache
+        self.cache_key = cache_key
+        self.window_size = window_size
+        self.num_workers = num_workers
+        # expected number of documents of every gondola, to size the aggregated tensors
+        self.plate_doc_counts = plate_doc_counts or [0] * NUM_GONDOLA
         self.test_start_time = test_start_time
         self.get_product_id_from_position_2d = get_product_id_from_position_2d
         self.get_product_id_from_position_3d = get_product_id_from_position_3d
         self.get_product_by_id = get_product_by_id
-        self.get_3d_coordinates_for_plate = get_3d_coordinates_for_plate
+        # previously aggregated plate data, e.g. from the stage cache
+        if agg_weight is None:
+            with instrumentation.span("aggregation"):
+                agg_weight = self.get_agg_weight()
         (
             self.agg_plate_data,
             self.agg_shelf_data,
             self.timestamps,
-        ) = self.get_agg_weight()
+            self.samples_per_doc,
+            self.frequencies,
+        ) = agg_weight
 
     # sliding window detect events
     # concatenate the data set , and use sliding window (60 data points per window)
     # moving average weight, can remove noise and reduce the false trigger caused by shake or unstable during an event
 
     def get_agg_weight(self, number_gondolas=5):
+        # the documents are streamed once, each one is written in place into the tensor of its
+        # gondola instead of being re-copied by np.append, tensors are allocated for the
+        # expected number of documents and grown when more arrive
         agg_plate_data = [None] * number_gondolas
         agg_shelf_data = [None] * number_gondolas
-        timestamps = init_nd_array(number_gondolas)
-
+        # document timestamps and number of samples per document
+        timestamps = [np.empty(0) for _ in range(number_gondolas)]
+        samples_per_doc = [np.empty(0, dtype=np.intp) for _ in range(number_gondolas)]
+        frequencies = [PLATE_SAMPLE_FREQUENCY] * number_gondolas
+        num_samples = [0] * number_gondolas
+        num_docs = [0] * number_gondolas
         for item in self.plate_data:
-            gondola_id = item.plate_id.gondola_id
             # seconds since epoch
             if item.timestamp < self.test_start_time:
                 continue
-            np_shelf = (
-                self.adapt_np_plate(gondola_id, item.data).sum(axis=2).transpose()
-            )  # [shelf, time]
-            np_plate = self.adapt_np_plate(gondola_id, item.data).transpose(
-                1, 2, 0
-            )  # [shelf,plate,time]
-            if agg_plate_data[gondola_id - 1] is not None:
-                agg_plate_data[gondola_id - 1] = np.append(
-                    agg_plate_data[gondola_id - 1], np_plate, axis=2
+            gondola_id = item.plate_id.gondola_id
+            gondola_idx = gondola_id - 1
+            doc_samples = item.data.shape[0]
+            if agg_plate_data[gondola_idx] is None:
+                expected_docs = max(self.plate_doc_counts[gondola_idx], 1)
+                num_shelf, num_plate = item.data[:, 1:13, 1:13].shape[1:]
+                agg_plate_data[gondola_idx] = np.empty(
+                    (num_shelf, num_plate, expected_docs * doc_samples),
+                    dtype=item.data.dtype,
+                )  # [shelf, plate, time]
+                timestamps[gondola_idx] = np.empty(expected_docs)
+                samples_per_doc[gondola_idx] = np.empty(expected_docs, dtype=np.intp)
+                if item.frequency:
+                    frequencies[gondola_idx] = item.frequency
+
+            begin = num_samples[gondola_idx]
+            end = begin + doc_samples
+            doc_idx = num_docs[gondola_idx]
+            if end > agg_plate_data[gondola_idx].shape[-1]:
+                agg_plate_data[gondola_idx] = grow_last_axis(
+                    agg_plate_data[gondola_idx], end
                 )
-                agg_shelf_data[gondola_id - 1] = np.append(
-                    agg_shelf_data[gondola_id - 1], np_shelf, axis=1
+            if doc_idx == len(timestamps[gondola_idx]):
+                timestamps[gondola_idx] = grow_last_axis(
+                    timestamps[gondola_idx], doc_idx + 1
+                )
+                samples_per_doc[gondola_idx] = grow_last_axis(
+                    samples_per_doc[gondola_idx], doc_idx + 1
                 )
-            else:
-                agg_plate_data[gondola_id - 1] = np_plate
-                agg_shelf_data[gondola_id - 1] = np_shelf
 
-            timestamps[gondola_id - 1].append(item.timestamp)
+            # crop, NaN handling and plate mask written in place
+            self.adapt_np_plate(
+                gondola_id, item.data, out=agg_plate_data[gondola_idx][:, :, begin:end]
+            )
+            timestamps[gondola_idx][doc_idx] = item.timestamp
+            samples_per_doc[gondola_idx][doc_idx] = doc_samples
+            num_samples[gondola_idx] = end
+            num_docs[gondola_idx] = doc_idx + 1
+
+        for gondola_idx in range(number_gondolas):
+            timestamps[gondola_idx] = timestamps[gondola_idx][: num_docs[gondola_idx]]
+            samples_per_doc[gondola_idx] = samples_per_doc[gondola_idx][
+                : num_docs[gondola_idx]
+            ]
+            if agg_plate_data[gondola_idx] is None:
+                continue
+            if agg_plate_data[gondola_idx].shape[-1] != num_samples[gondola_idx]:
+                agg_plate_data[gondola_idx] = np.ascontiguousarray(
+                    agg_plate_data[gondola_idx][:, :, : num_samples[gondola_idx]]
+                )
+            agg_shelf_data[gondola_idx] = agg_plate_data[gondola_idx].sum(
+                axis=1
+            )  # [shelf, time]
 
-        return agg_plate_data, agg_shelf_data, timestamps
+        self.instrumentation.count("plate_docs", sum(num_docs))
+        self.instrumentation.count("samples", sum(num_samples))
 
-    def adapt_np_plate(self, gondola_id, item):
-        # replace all NaN elements to 0
+        return agg_plate_data, agg_shelf_data, timestamps, samples_per_doc, frequencies
+
+    # apply func to the arguments of every gondola, in worker threads when num_workers > 1
+    # numpy releases the GIL in the heavy array operations of the gondola pipelines
+    def map_gondolas(self, func, *gondola_args):
+        if self.num_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+                return list(executor.map(func, *gondola_args))
+        return list(map(func, *gondola_args))
+
+    def adapt_np_plate(self, gondola_id, item, out=None):
+        # crop the [time, shelf, plate] document into out[shelf, plate, time]
         # remove first line, which is always NaN elements
+        cropped = item[:, 1:13, 1:13].transpose(1, 2, 0)
+        if out is None:
+            out = np.empty(cropped.shape, dtype=item.dtype)
+        np.copyto(out, cropped)
+        # replace all NaN elements to 0
+        np.nan_to_num(out, copy=False, nan=0)
         if gondola_id == 2 or gondola_id == 4 or gondola_id == 5:
-            np.nan_to_num(item, copy=True, nan=0)[:, 1:13, 1:13][:, :, 9:12] = 0
-        return np.nan_to_num(item, copy=True, nan=0)[:, 1:13, 1:13]
+            out[:, 9:12, :] = 0
+        return out
 
     def rolling_window(self, a, window):
         shape = a.shape[:-1] + (a.shape[-1] - window + 1, window)
         strides = a.strides + (a.strides[-1],)
         return np.lib.stride_tricks.as_strided(a, shape=shape, strides=strides)
 
-    def get_agg_timestamps(self, number_gondolas=5):
-        agg_timestamps = init_nd_array(number_gondolas)
-        for gondola_id in range(number_gondolas):
-            for i, date_time in enumerate(self.timestamps[gondola_id]):
-                if i < len(self.timestamps[gondola_id]) - 1:
-                    next_date_time = self.timestamps[gondola_id][i + 1]
-                    time_delta = (next_date_time - date_time) / 12
-                    agg_timestamps[gondola_id] += [
-                        date_time + time_delta * j for j in range(0, 12)
-                    ]
-                else:
-                    time_delta = 1 / 60
-                    agg_timestamps[gondola_id] += [
-                        date_time + time_delta * j for j in range(0, 12)
-                    ]
-        return agg_timestamps
+    # timestamp of every sample, samples of a document are evenly spread until the next document
+    # the timestamps are trimmed to the centers of the moving windows of get_moving_weight
+    def get_agg_timestamps(self, number_gondolas=5, window_size=None):
+        return [
+            self.get_agg_timestamps_for_gondola(gondola_idx, window_size)
+            for gondola_idx in range(number_gondolas)
+        ]
+
+    def get_agg_timestamps_for_gondola(self, gondola_idx, window_size=None):
+        if window_size is None:
+            window_size = self.window_size
+        head = window_size // 2
+        tail = window_size - 1 - head
+        doc_timestamps = self.timestamps[gondola_idx]
+        samples_per_doc = self.samples_per_doc[gondola_idx]
+        sample_steps = self.get_sample_steps(gondola_idx)
+        doc_offsets = np.cumsum(samples_per_doc) - samples_per_doc
+        doc_ids = np.repeat(np.arange(len(doc_timestamps)), samples_per_doc)
+        sample_ids = np.arange(len(doc_ids)) - doc_offsets[doc_ids]
+        sample_timestamps = doc_timestamps[doc_ids] + sample_steps[doc_ids] * sample_ids
+        return sample_timestamps[head : max(len(sample_timestamps) - tail, head)]
+
+    # time between two samples of every document of a gondola,
+    # the last document and documents followed by a gap use the sample frequency
+    def get_sample_steps(self, gondola_idx):
+        doc_timestamps = self.timestamps[gondola_idx]
+        samples_per_doc = self.samples_per_doc[gondola_idx]
+        nominal_step = 1 / self.frequencies[gondola_idx]
+        sample_steps = np.full(len(doc_timestamps), nominal_step)
+        if len(doc_timestamps) < 2:
+            return sample_steps
+
+        doc_durations = np.diff(doc_timestamps)
+        is_gap = doc_durations > (
+            TIMESTAMP_GAP_TOLERANCE * nominal_step * samples_per_doc[:-1]
+        )
+        sample_steps[:-1] = np.where(
+            is_gap, nominal_step, doc_durations / samples_per_doc[:-1]
+        )
+        if VERBOSE and is_gap.any():
+            print(
+                "Gondola {}: {} gaps in plate data, {:.1f}s missing".format(
+                    gondola_idx + 1,
+                    np.count_nonzero(is_gap),
+                    (doc_durations - samples_per_doc[:-1] * nominal_step)[is_gap].sum(),
+                )
+            )
+        return sample_steps
 
-    def get_moving_weight(self, num_gondola=5, window_size=60):
+    def get_moving_weight(self, num_gondola=5, window_size=None):
+        if window_size is None:
+            window_size = self.window_size
         moving_weight_plate_mean = []
         moving_weight_plate_std = []
         moving_weight_shelf_mean = []
@@ -109,30 +246,16 @@ class WeightTrigger:
         for gondola_id in range(num_gondola):
             if self.agg_shelf_data[gondola_id] is None:
                 continue
-            moving_weight_shelf_mean.append(
-                np.mean(
-                    rolling_window(self.agg_shelf_data[gondola_id], window_size),
-                    -1,
-                )
-            )
-            moving_weight_shelf_std.append(
-                np.std(
-                    rolling_window(self.agg_shelf_data[gondola_id], window_size),
-                    -1,
-                )
-            )
-            moving_weight_plate_mean.append(
-                np.mean(
-                    rolling_window(self.agg_plate_data[gondola_id], window_size),
-                    -1,
-                )
+            shelf_mean, shelf_std = rolling_mean_std(
+                self.agg_shelf_data[gondola_id], window_size
             )
-            moving_weight_plate_std.append(
-                np.std(
-                    rolling_window(self.agg_plate_data[gondola_id], window_size),
-                    -1,
-                )
+            plate_mean, plate_std = rolling_mean_std(
+                self.agg_plate_data[gondola_id], window_size
             )
+            moving_weight_shelf_mean.append(shelf_mean)
+            moving_weight_shelf_std.append(shelf_std)
+            moving_weight_plate_mean.append(plate_mean)
+            moving_weight_plate_std.append(plate_std)
         return (
             moving_weight_shelf_mean,
             moving_weight_shelf_std,
@@ -159,6 +282,32 @@ class WeightTrigger:
         timestamps,  # timestamps: [gondola, timestamp]
         num_plate=12,
         thresholds=None,
+    ):
+        gondola_events = []
+        num_gondola = len(weight_shelf_mean)
+        for gondola_idx in range(num_gondola):
+            gondola_events.append(
+                self.detect_weight_events_for_gondola(
+                    gondola_idx + 1,
+                    weight_shelf_mean[gondola_idx],
+                    weight_shelf_std[gondola_idx],
+                    weight_plate_mean[gondola_idx],
+                    timestamps[gondola_idx],
+                    num_plate,
+                    thresholds,
+                )
+            )
+        return EventTable.concatenate(gondola_events, num_plate)
+
+    def detect_weight_events_for_gondola(
+        self,
+        gondola_id,
+        shelf_mean,
+        shelf_std,
+        plate_mean,
+        gondola_timestamps,
+        num_plate=12,
+        thresholds=None,
     ):
         # the lightest product is: {'_id': ObjectId('5e30c1c0e3a947a97b665757'), 'product_id': {'barcode_type':
         # 'UPC', 'id': '041420027161'}, 'metadata': {'name': 'TROLLI SBC ALL STAR MIX', 'thumbnail':
@@ -166,76 +315,127 @@ class WeightTrigger:
         # .jpg?v=1565210393', 'price': 1, 'weight': 24}}
 
         if thresholds is None:
-            thresholds = {
-                "std_shelf": 20,
-                "mean_shelf": 10,
-                "mean_plate": 5,
-                "min_event_length": 30,
-            }
-        events = []
-        num_gondola = len(weight_shelf_mean)
-        for gondola_idx in range(num_gondola):
-            num_shelf = weight_shelf_mean[gondola_idx].shape[0]
-            for shelf_idx in range(num_shelf):
-                # find a continuous range that variance change is above threshold
-                var_is_active = np.array(
-                    weight_shelf_std[gondola_idx][shelf_idx]
-                ) > thresholds.get("std_shelf")
-                i = 0
-                whole_length = len(var_is_active)
-                while i < whole_length:
-                    if not var_is_active[i]:
-                        i += 1
-                        continue
-                    n_begin = i
-                    n_end = i
-                    n_peak = i
-                    maxStd = weight_shelf_std[gondola_idx][shelf_idx][n_begin]
-                    while n_end + 1 < whole_length and var_is_active[n_end + 1]:
-                        n_end += 1
-                        if weight_shelf_std[gondola_idx][shelf_idx][n_end] > maxStd:
-                            maxStd = weight_shelf_std[gondola_idx][shelf_idx][n_end]
-                            n_peak = n_end
-                    i = n_end + 1
-
-                    w_begin = weight_shelf_mean[gondola_idx][shelf_idx][n_begin]
-                    w_end = weight_shelf_mean[gondola_idx][shelf_idx][n_end]
-                    delta_w = w_end - w_begin
-                    length = n_end - n_begin + 1
-
-                    if length < thresholds.get("min_event_length"):
-                        continue
-
-                    if abs(delta_w) > thresholds.get("mean_shelf"):
-                        trigger_begin = timestamps[gondola_idx][n_begin]
-                        trigger_end = timestamps[gondola_idx][n_end]
-                        peakTime = timestamps[gondola_idx][n_peak]
-                        plates = [0] * num_plate
-                        for plate_id in range(num_plate):
-                            plates[plate_id] = (
-                                weight_plate_mean[gondola_idx][shelf_idx][plate_id][
-                                    n_end
-                                ]
-                                - weight_plate_mean[gondola_idx][shelf_idx][plate_id][
-                                    n_begin
-                                ]
-                            )
-
-                        event = PickUpEvent(
-                            trigger_begin,
-                            trigger_end,
-                            peakTime,
-                            n_begin,
-                            n_end,
-                            delta_w,
-                            gondola_idx + 1,
-                            shelf_idx + 1,
-                            plates,
-                            self.get_3d_coordinates_for_plate,
-                        )
-
-                        events.append(event)
-        return events
+            thresholds = DEFAULT_THRESHOLDS
+        shelf_mean = np.asarray(shelf_mean)
+        shelf_std = np.asarray(shelf_std)
+        plate_mean = np.asarray(plate_mean)
+        gondola_timestamps = np.asarray(gondola_timestamps)
+
+        # find all continuous ranges that variance change is above threshold, for every shelf at once
+        shelf_ids, n_begins, n_ends = find_active_runs(
+            shelf_std > thresholds.get("std_shelf")
+        )
+        lengths = n_ends - n_begins + 1
+        delta_ws = shelf_mean[shelf_ids, n_ends] - shelf_mean[shelf_ids, n_begins]
+        is_event = (lengths >= thresholds.get("min_event_length")) & (
+            np.abs(delta_ws) > thresholds.get("mean_shelf")
+        )
+        shelf_ids = shelf_ids[is_event]
+        n_begins = n_begins[is_event]
+        n_ends = n_ends[is_event]
+        delta_ws = delta_ws[is_event]
+
+        n_peaks = segment_argmax(shelf_std, shelf_ids, n_begins, n_ends)
+        plates = (
+            plate_mean[shelf_ids, :num_plate, n_ends]
+            - plate_mean[shelf_ids, :num_plate, n_begins]
+        )  # [event, plate]
+        return EventTable(
+            gondola_timestamps[n_begins],
+            gondola_timestamps[n_ends],
+            gondola_timestamps[n_peaks],
+            n_begins,
+            n_ends,
+            delta_ws,
+            np.full(len(shelf_ids), gondola_id),
+            shelf_ids + 1,
+            plates,
+        )
+
+    # full per gondola pipeline: moving weight, detection and split of every gondola,
+    # merged in a timely order
+    def get_events(self, number_gondolas=5, window_size=None, thresholds=None):
+        gondola_ids = [
+            gondola_idx + 1
+            for gondola_idx in range(number_gondolas)
+            if self.agg_shelf_data[gondola_idx] is not None
+        ]
+        gondola_events = self.map_gondolas(
+            lambda gondola_id: self.get_events_for_gondola(
+                gondola_id, window_size, thresholds
+            ),
+            gondola_ids,
+        )
+        return EventTable.concatenate(gondola_events).sort_by_trigger_begin()
+
+    def get_events_for_gondola(self, gondola_id, window_size=None, thresholds=None):
+        if window_size is None:
+            window_size = self.window_size
+        instrumentation = self.instrumentation
+        stage_cache = self.stage_cache
+        moving_stats_key = None
+        events_key = None
+        if self.cache_key is not None:
+            moving_stats_key = get_cache_key(
+                "moving_stats", self.cache_key, gondola_id, window_size
+            )
+            events_key = get_cache_key(
+                "detected_events",
+                moving_stats_key,
+                DEFAULT_THRESHOLDS if thresholds is None else thresholds,
+            )
+
+        # the moving stats are only needed when the detected events are not cached
+        columns = stage_cache.load("detected_events", events_key)
+        if columns is not None:
+            events = EventTable.from_columns(columns)
+        else:
+            moving_stats = stage_cache.load("moving_stats", moving_stats_key)
+            if moving_stats is None:
+                with instrumentation.span("moving_stats"):
+                    shelf_mean, shelf_std = rolling_mean_std(
+                        self.agg_shelf_data[gondola_id - 1], window_size
+                    )
+                    plate_mean, _ = rolling_mean_std(
+                        self.agg_plate_data[gondola_id - 1], window_size
+                    )
+                    timestamps = self.get_agg_timestamps_for_gondola(
+                        gondola_id - 1, window_size
+                    )
+                stage_cache.save(
+                    "moving_stats",
+                    moving_stats_key,
+                    {
+                        "shelf_mean": shelf_mean,
+                        "shelf_std": shelf_std,
+                        "plate_mean": plate_mean,
+                        "timestamps": timestamps,
+                    },
+                )
+            else:
+                shelf_mean = moving_stats["shelf_mean"]
+                shelf_std = moving_stats["shelf_std"]
+                plate_mean = moving_stats["plate_mean"]
+                timestamps = moving_stats["timestamps"]
+
+            # sanity check
+            assert len(timestamps) == shelf_mean.shape[1] == plate_mean.shape[2]
+
+            with instrumentation.span("detection"):
+                events = self.detect_weight_events_for_gondola(
+                    gondola_id,
+                    shelf_mean,
+                    shelf_std,
+                    plate_mean,
+                    timestamps,
+                    thresholds=thresholds,
+                )
+            stage_cache.save("detected_events", events_key, events.get_columns())
+        with instrumentation.span("splitting"):
+            event_table = EventTable.from_events(self.splitEvents(events))
+        instrumentation.count("detected_events", len(events))
+        instrumentation.count("split_events", len(event_table))
+        return event_table
 
     # events
     def splitEvents(self, pick_up_events):
@@ -328,7 +528,6 @@ class WeightTrigger:
                     gondola_id,
                     shelf_id,
                     delta_weights,
-                    self.get_3d_coordinates_for_plate,
                 )
                 splitted_events.append(splitted_event)
         return splitted_events
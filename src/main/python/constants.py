@@ -4,6 +4,7 @@ NUM_SHELF = 6
 NUM_PLATE = 12
 BODY_THRESH = 0.8
 THRESHOLD = 0.2
+PLATE_SAMPLE_FREQUENCY = 60
 
 VERBOSE = 0
 DEBUG = 0
@@ -14,5 +15,10 @@ CE_ASSOCIATION = 1
 CLOSEST_ASSOCIATION = 2
 ASSOCIATION_TYPE = CLOSEST_ASSOCIATION
 
+SHELF_CANDIDATES = 0
+WEIGHT_CANDIDATES = 1
+SHELF_AND_WEIGHT_CANDIDATES = 2
+CANDIDATE_TYPE = SHELF_AND_WEIGHT_CANDIDATES
+
 ARRANGEMENT_CONTRIBUTION = 0.8
 WEIGHT_CONTRIBUTION = 1 - ARRANGEMENT_CONTRIBUTION
@@ -1,8 +1,14 @@
+import binascii
 from base64 import b64decode
 from typing import NamedTuple
 
 import numpy as np
 
+try:
+    import zstandard
+except ImportError:  # only needed for zstd encoded arrays, e.g. depth frames
+    zstandard = None
+
 
 class ProductId(NamedTuple):
     """Unique id of a product"""
@@ -173,9 +179,51 @@ class PlateData(NamedTuple):
                 vals["data"],
                 vals["shape"],
                 vals["type"],
+                vals.get("encoding"),
             ),
         )
 
+    @classmethod
+    def from_dicts(cls, recorded_list):
+        """Returns decoded PlateData recordings, in the same order
+
+        Blobs with the same shape, type and encoding are decoded together into one
+        contiguous [docs, time, shelf, plate] array, the data of every recording is a
+        view of it.
+
+        Args:
+            recorded_list (list): The dicts of mongo docs
+        """
+        groups = {}
+        for i, recorded in enumerate(recorded_list):
+            vals = recorded["document"]["plate_data"]["values"]
+            key = (tuple(vals["shape"]), vals["type"], vals.get("encoding"))
+            groups.setdefault(key, []).append(i)
+
+        data = [None] * len(recorded_list)
+        for (shape, enc_type, encoding), indices in groups.items():
+            batch = NumpyRecordCodec.decode_batch(
+                [
+                    recorded_list[i]["document"]["plate_data"]["values"]["data"]
+                    for i in indices
+                ],
+                shape,
+                enc_type,
+                encoding,
+            )
+            for j, i in enumerate(indices):
+                data[i] = batch[j]
+
+        return [
+            cls(
+                plate_id=PlateId.from_dict(recorded),
+                frequency=recorded["document"]["plate_data"]["freq_samp"],
+                timestamp=recorded["timestamp"],
+                data=data[i],
+            )
+            for i, recorded in enumerate(recorded_list)
+        ]
+
 
 class DepthFrame(NamedTuple):
     """DepthFrame np array of depth data with metadata"""
@@ -300,15 +348,79 @@ class NumpyRecordCodec:
     # Converts numpy types to Recorded DataArray types
     TYPE_ENCODER = {v: k for k, v in TYPE_DECODER.items()}
 
+    # Encodings applied to the byte array after the datatype encoding
+    NO_ENCODINGS = {None, "", "none", "ENCODING_NONE"}
+    ZSTD_ENCODINGS = {"zstd", "ENCODING_ZSTD"}
+
     @classmethod
-    def decode(cls, data, shape, enc_type):
+    def decode(cls, data, shape, enc_type, encoding=None):
         """Returns a numpy array decoded from a recorded DataArray
 
         Args:
             data (str): base64 encoded byte array
             shape (list): shape of the byte array
             enc_type (str): the underlying datatype encoded
+            encoding (str): the additional encoding of the byte array, e.g. zstd
         """
-        type_ = cls.TYPE_DECODER[enc_type]
-        array = np.frombuffer(b64decode(data), dtype=type_)
+        type_ = np.dtype(cls.TYPE_DECODER[enc_type])
+        size = int(np.prod(shape)) * type_.itemsize
+        array = np.frombuffer(cls.decode_bytes(data, encoding, size), dtype=type_)
         return array.reshape(shape)
+
+    @classmethod
+    def decode_batch(cls, datas, shape, enc_type, encoding=None):
+        """Returns a [docs, *shape] numpy array decoded from recorded DataArrays
+        of the same shape, type and encoding
+
+        Without additional encoding, blobs that are a whole number of base64 quanta
+        are joined and decoded by a single call, the decoded bytes are copied once into
+        a bytearray backing the array; otherwise every blob is decoded into its row of a
+        preallocated array. The array is writable either way.
+
+        Args:
+            datas (list): base64 encoded byte arrays
+            shape (list): shape of every byte array
+            enc_type (str): the underlying datatype encoded
+            encoding (str): the additional encoding of the byte arrays, e.g. zstd
+        """
+        type_ = np.dtype(cls.TYPE_DECODER[enc_type])
+        shape = (len(datas),) + tuple(shape)
+        doc_size = int(np.prod(shape[1:])) * type_.itemsize
+        if (
+            encoding in cls.NO_ENCODINGS
+            and doc_size % 3 == 0
+            and all(len(data) * 3 == doc_size * 4 for data in datas)
+        ):
+            # no padding inside the joined text, a single decode for the whole batch
+            if datas and isinstance(datas[0], bytes):
+                joined = b"".join(datas)
+            else:
+                joined = "".join(datas)
+            buffer = bytearray(binascii.a2b_base64(joined))
+            return np.frombuffer(buffer, dtype=type_).reshape(shape)
+
+        array = np.empty(shape, dtype=type_)
+        rows = array.reshape(len(datas), -1).view(np.uint8)
+        for i, data in enumerate(datas):
+            rows[i] = np.frombuffer(
+                cls.decode_bytes(data, encoding, doc_size), dtype=np.uint8
+            )
+        return array
+
+    @classmethod
+    def decode_bytes(cls, data, encoding=None, size=0):
+        """Returns the raw byte array of a recorded DataArray
+
+        Args:
+            data (str): base64 encoded byte array
+            encoding (str): the additional encoding of the byte array, e.g. zstd
+            size (int): size of the raw byte array, when the zstd frame does not store it
+        """
+        raw = binascii.a2b_base64(data)
+        if encoding in cls.NO_ENCODINGS:
+            return raw
+        if encoding in cls.ZSTD_ENCODINGS:
+            if zstandard is None:
+                raise ImportError("zstandard is required to decode zstd encoded data")
+            return zstandard.ZstdDecompressor().decompress(raw, max_output_size=size)
+        raise ValueError("Unknown DataArray encoding: {}".format(encoding))
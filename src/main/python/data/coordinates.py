@@ -1,4 +1,6 @@
 class Coordinates:
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, x, y, z):
         self.x = x
         self.y = y
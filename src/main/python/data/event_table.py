@@ -0,0 +1,193 @@
+import numpy as np
+
+from constants import NUM_PLATE
+from data.pickup_event import PickUpEvent
+from data.position import Position
+
+
+class EventTable:
+    """
+    Pick up events stored as typed columns, one row per event
+    trigger_begin, trigger_end, peak_time: float64 [event], timestamps
+    n_begin, n_end: intp [event]
+    delta_weight: float64 [event] in gram
+    gondola_id, shelf_id: intp [event]
+    delta_weights: float64 [event, plate] in gram
+    Iterating the table gives EventView rows with the attributes of PickUpEvent
+    """
+
+    __slots__ = (
+        "trigger_begin",
+        "trigger_end",
+        "peak_time",
+        "n_begin",
+        "n_end",
+        "delta_weight",
+        "gondola_id",
+        "shelf_id",
+        "delta_weights",
+    )
+
+    def __init__(
+        self,
+        trigger_begin,
+        trigger_end,
+        peak_time,
+        n_begin,
+        n_end,
+        delta_weight,
+        gondola_id,
+        shelf_id,
+        delta_weights,
+    ):
+        self.trigger_begin = np.asarray(trigger_begin, dtype=np.float64)
+        self.trigger_end = np.asarray(trigger_end, dtype=np.float64)
+        self.peak_time = np.asarray(peak_time, dtype=np.float64)
+        self.n_begin = np.asarray(n_begin, dtype=np.intp)
+        self.n_end = np.asarray(n_end, dtype=np.intp)
+        self.delta_weight = np.asarray(delta_weight, dtype=np.float64)
+        self.gondola_id = np.asarray(gondola_id, dtype=np.intp)
+        self.shelf_id = np.asarray(shelf_id, dtype=np.intp)
+        delta_weights = np.asarray(delta_weights, dtype=np.float64)
+        # an empty table keeps the number of plates of its [event, plate] delta weights
+        num_plate = delta_weights.shape[-1] if delta_weights.ndim == 2 else -1
+        self.delta_weights = delta_weights.reshape(len(self.trigger_begin), num_plate)
+
+    @classmethod
+    def from_events(cls, events, num_plate=NUM_PLATE):
+        events = list(events)
+        delta_weights = np.zeros((len(events), num_plate))
+        for i, event in enumerate(events):
+            delta_weights[i] = event.deltaWeights
+        return cls(
+            [event.triggerBegin for event in events],
+            [event.triggerEnd for event in events],
+            [event.peakTime for event in events],
+            [event.nBegin for event in events],
+            [event.nEnd for event in events],
+            [event.deltaWeight for event in events],
+            [event.gondolaID for event in events],
+            [event.shelfID for event in events],
+            delta_weights,
+        )
+
+    @classmethod
+    def concatenate(cls, tables, num_plate=NUM_PLATE):
+        tables = list(tables)
+        if len(tables) == 0:
+            return cls.from_events([], num_plate)
+        return cls(
+            *[
+                np.concatenate([getattr(table, column) for table in tables])
+                for column in cls.__slots__
+            ]
+        )
+
+    @classmethod
+    def from_columns(cls, columns):
+        return cls(*[columns[column] for column in cls.__slots__])
+
+    # dict of column name -> array, e.g. to save the table to the stage cache
+    def get_columns(self):
+        return {column: getattr(self, column) for column in self.__slots__}
+
+    def __len__(self):
+        return len(self.trigger_begin)
+
+    def __getitem__(self, i):
+        if isinstance(i, (slice, np.ndarray, list)):
+            return EventTable(*[getattr(self, column)[i] for column in self.__slots__])
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("event index out of range")
+        return EventView(self, i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield EventView(self, i)
+
+    def __repr__(self):
+        return "EventTable(%d events)" % len(self)
+
+    # the events sorted in a timely order, events starting at the same time keep their order
+    def sort_by_trigger_begin(self):
+        return self[np.argsort(self.trigger_begin, kind="stable")]
+
+    # the events in the order of WeightTrigger.get_events: by begin, then by gondola and shelf,
+    # the splits of an event keep their order
+    def sort_by_trigger_begin_and_shelf(self):
+        return self[np.lexsort((self.shelf_id, self.gondola_id, self.trigger_begin))]
+
+    # plate with the greatest absolute weight change of every event, 1-based,
+    # the first one on ties and plate 1 when no plate changed
+    def get_most_possible_plate_ids(self):
+        if self.delta_weights.shape[1] == 0:
+            return np.ones(len(self), dtype=np.intp)
+        return np.argmax(np.abs(self.delta_weights), axis=1) + 1
+
+    # [event, xyz] coordinates of the most possible plate of every event,
+    # plate_coordinates: see build_plate_coordinates
+    def get_event_coordinates(self, plate_coordinates):
+        return plate_coordinates[
+            self.gondola_id - 1,
+            self.shelf_id - 1,
+            self.get_most_possible_plate_ids() - 1,
+        ]
+
+
+class EventView:
+    """
+    A row of an EventTable, read-only and with the attributes and methods of PickUpEvent
+    """
+
+    __slots__ = ("table", "index")
+
+    def __init__(self, table, index):
+        self.table = table
+        self.index = index
+
+    @property
+    def triggerBegin(self):
+        return self.table.trigger_begin[self.index]
+
+    @property
+    def triggerEnd(self):
+        return self.table.trigger_end[self.index]
+
+    @property
+    def peakTime(self):
+        return self.table.peak_time[self.index]
+
+    @property
+    def nBegin(self):
+        return int(self.table.n_begin[self.index])
+
+    @property
+    def nEnd(self):
+        return int(self.table.n_end[self.index])
+
+    @property
+    def deltaWeight(self):
+        return self.table.delta_weight[self.index]
+
+    @property
+    def gondolaID(self):
+        return int(self.table.gondola_id[self.index])
+
+    @property
+    def shelfID(self):
+        return int(self.table.shelf_id[self.index])
+
+    @property
+    def deltaWeights(self):
+        return self.table.delta_weights[self.index]
+
+    def get_event_most_possible_position(self):
+        plate_id = int(np.argmax(np.abs(self.deltaWeights))) + 1
+        return Position(self.gondolaID, self.shelfID, plate_id)
+
+    get_event_all_positions = PickUpEvent.get_event_all_positions
+    get_event_coordinates = PickUpEvent.get_event_coordinates
+    __repr__ = PickUpEvent.__repr__
+    __str__ = PickUpEvent.__str__
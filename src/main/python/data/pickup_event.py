@@ -2,10 +2,23 @@ from datetime import datetime
 
 import numpy as np
 from constants import THRESHOLD
+from data.coordinates import Coordinates
 from data.position import Position
 
 
 class PickUpEvent:
+    __slots__ = (
+        "triggerBegin",
+        "triggerEnd",
+        "peakTime",
+        "nBegin",
+        "nEnd",
+        "deltaWeight",
+        "gondolaID",
+        "shelfID",
+        "deltaWeights",
+    )
+
     triggerBegin: float  # timestamp
     triggerEnd: float  # timestamp
     peakTime: float  # timestamp for the time with highest weight variance
@@ -14,7 +27,7 @@ class PickUpEvent:
     deltaWeight: np.float
     gondolaID: int
     shelfID: int
-    deltaWeights: list
+    deltaWeights: np.ndarray  # [plate]
 
     def __init__(
         self,
@@ -27,7 +40,6 @@ class PickUpEvent:
         gondola_id,
         shelf_id,
         delta_weights,
-        get_3d_coordinates_for_plate,
     ):
         self.triggerBegin = trigger_begin
         self.triggerEnd = trigger_end
@@ -37,8 +49,7 @@ class PickUpEvent:
         self.deltaWeight = delta_weight
         self.gondolaID = gondola_id
         self.shelfID = shelf_id
-        self.deltaWeights = delta_weights
-        self.get_3d_coordinates_for_plate = get_3d_coordinates_for_plate
+        self.deltaWeights = np.asarray(delta_weights, dtype=np.float64)
 
     # for one event, return its most possible gondola/shelf/plate
     def get_event_most_possible_position(self):
@@ -64,12 +75,13 @@ class PickUpEvent:
                 )
         return possible_positions
 
-    def get_event_coordinates(self):
+    # plate_coordinates: see build_plate_coordinates
+    def get_event_coordinates(self, plate_coordinates):
         position = self.get_event_most_possible_position()
-        coordinates = self.get_3d_coordinates_for_plate(
-            position.gondola, position.shelf, position.plate
-        )
-        return coordinates
+        x, y, z = plate_coordinates[
+            position.gondola - 1, position.shelf - 1, position.plate - 1
+        ]
+        return Coordinates(float(x), float(y), float(z))
 
     def __repr__(self):
         return str(self)
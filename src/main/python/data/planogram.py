@@ -0,0 +1,104 @@
+import numpy as np
+
+from constants import NUM_GONDOLA, NUM_SHELF, NUM_PLATE
+
+
+class Planogram:
+    """
+    Products placed on every plate of the store
+    placement: bool ndarray [gondola, shelf, plate, product], True when the product is on the plate
+    product_ids: [barcode], the product of every placement column
+    index: barcode -> placement column
+    plates: object ndarray [gondola, shelf, plate] of product id sets, None for empty plates
+    shelves: object ndarray [gondola, shelf] of the product id sets of whole shelves
+    planogram[gondola - 1][shelf - 1][plate - 1] is the product id set of a plate, as with the
+    former object ndarray planogram
+    """
+
+    product_ids: list
+    index: dict
+    plates: np.ndarray
+    shelves: np.ndarray
+
+    def __init__(
+        self,
+        product_ids=(),
+        num_gondola=NUM_GONDOLA,
+        num_shelf=NUM_SHELF,
+        num_plate=NUM_PLATE,
+    ):
+        self.product_ids = list(product_ids)
+        self.index = {product_id: i for i, product_id in enumerate(self.product_ids)}
+        # columns beyond len(product_ids) are spare capacity for products added later
+        self._placement = np.zeros(
+            (num_gondola, num_shelf, num_plate, max(len(self.product_ids), 1)),
+            dtype=bool,
+        )
+        self.plates = np.empty((num_gondola, num_shelf, num_plate), dtype=object)
+        self.shelves = np.empty((num_gondola, num_shelf), dtype=object)
+        for gondola_idx in range(num_gondola):
+            for shelf_idx in range(num_shelf):
+                self.shelves[gondola_idx, shelf_idx] = set()
+
+    def __getitem__(self, gondola_idx):
+        return self.plates[gondola_idx]
+
+    def __repr__(self):
+        return "Planogram(%d products)" % len(self.product_ids)
+
+    @property
+    def placement(self):
+        return self._placement[..., : len(self.product_ids)]
+
+    # independent copy, later add_product calls on one do not change the other
+    def copy(self):
+        num_gondola, num_shelf, num_plate = self.plates.shape
+        planogram = Planogram((), num_gondola, num_shelf, num_plate)
+        planogram.product_ids = list(self.product_ids)
+        planogram.index = dict(self.index)
+        planogram._placement = self._placement.copy()
+        for position, product_ids in np.ndenumerate(self.plates):
+            if product_ids is not None:
+                planogram.plates[position] = set(product_ids)
+        for position, product_ids in np.ndenumerate(self.shelves):
+            planogram.shelves[position] = set(product_ids)
+        return planogram
+
+    def add_product(self, gondola_id, shelf_id, plate_id, product_id):
+        column = self.__get_column(product_id)
+        self._placement[gondola_id - 1, shelf_id - 1, plate_id - 1, column] = True
+        if self.plates[gondola_id - 1, shelf_id - 1, plate_id - 1] is None:
+            self.plates[gondola_id - 1, shelf_id - 1, plate_id - 1] = set()
+        self.plates[gondola_id - 1, shelf_id - 1, plate_id - 1].add(product_id)
+        self.shelves[gondola_id - 1, shelf_id - 1].add(product_id)
+
+    def contains(self, gondola_id, shelf_id, plate_id, product_id):
+        column = self.index.get(product_id)
+        if column is None:
+            return False
+        return bool(self._placement[gondola_id - 1, shelf_id - 1, plate_id - 1, column])
+
+    # product ids of a whole shelf, kept up to date by add_product, not to be modified
+    def get_product_ids_2d(self, gondola_id, shelf_id):
+        return self.shelves[gondola_id - 1, shelf_id - 1]
+
+    # product ids of a plate, None for an empty plate
+    def get_product_ids_3d(self, gondola_id, shelf_id, plate_id):
+        return self.plates[gondola_id - 1, shelf_id - 1, plate_id - 1]
+
+    # product ids of a shelf with their bool [plate, product] placement on the shelf
+    def get_shelf_placement(self, gondola_id, shelf_id):
+        product_ids = list(self.shelves[gondola_id - 1, shelf_id - 1])
+        columns = [self.index[product_id] for product_id in product_ids]
+        return product_ids, self._placement[gondola_id - 1, shelf_id - 1][:, columns]
+
+    def __get_column(self, product_id):
+        if product_id not in self.index:
+            column = len(self.product_ids)
+            if column == self._placement.shape[-1]:
+                grown = np.zeros(self._placement.shape[:-1] + (2 * column,), dtype=bool)
+                grown[..., :column] = self._placement
+                self._placement = grown
+            self.product_ids.append(product_id)
+            self.index[product_id] = column
+        return self.index[product_id]
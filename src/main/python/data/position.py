@@ -1,4 +1,6 @@
 class Position:
+    __slots__ = ("gondola", "shelf", "plate")
+
     gondola: int
     shelf: int
     plate: int
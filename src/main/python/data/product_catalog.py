@@ -0,0 +1,47 @@
+import numpy as np
+
+
+class ProductCatalog:
+    """
+    Products of the store in a fixed order, with their weights as an array
+    products: [ProductExtended]
+    product_ids: [barcode]
+    weights: ndarray [product] in gram
+    index: barcode -> position in the catalog
+    weight_order: positions in the catalog sorted by weight
+    """
+
+    product_ids: list
+    products: list
+    weights: np.ndarray
+    index: dict
+    weight_order: np.ndarray
+
+    def __init__(self, products):
+        self.products = list(products)
+        self.product_ids = [product.get_barcode() for product in self.products]
+        self.weights = np.array(
+            [product.product.weight for product in self.products], dtype=np.float64
+        )
+        self.index = {product_id: i for i, product_id in enumerate(self.product_ids)}
+
+        self.weight_order = np.argsort(self.weights, kind="stable")
+        self._sorted_weights = self.weights[self.weight_order]
+
+    def __len__(self):
+        return len(self.products)
+
+    def __repr__(self):
+        return "ProductCatalog(%d products)" % len(self)
+
+    # positions in the catalog of products, sorted
+    def get_indices(self, product_ids):
+        return np.array(
+            sorted(self.index[product_id] for product_id in product_ids), dtype=np.intp
+        )
+
+    # positions in the catalog of the products weighing between low and high gram, sorted
+    def get_weight_range_indices(self, low, high):
+        begin = np.searchsorted(self._sorted_weights, low, side="left")
+        end = np.searchsorted(self._sorted_weights, high, side="right")
+        return np.sort(self.weight_order[begin:end])
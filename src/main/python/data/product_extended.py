@@ -9,6 +9,8 @@ from cpsdriver.codec import Product
 
 
 class ProductExtended:
+    __slots__ = ("product", "positions")
+
     positions: list
     product: Product
 
@@ -21,6 +23,10 @@ class ProductExtended:
     def __repr__(self):
         return str(self)
 
+    @property
+    def weight(self):
+        return self.product.weight
+
     def get_barcode(self):
         return self.product.product_id.barcode
 
@@ -2,6 +2,8 @@ from constants import ARRANGEMENT_CONTRIBUTION, WEIGHT_CONTRIBUTION
 
 
 class ProductScore:
+    __slots__ = ("product", "arrangementScore", "weightScore")
+
     arrangementScore: float
     weightScore: float
     product: str
@@ -1,4 +1,6 @@
 class Target:
+    __slots__ = ("id", "head", "left_hand", "right_hand", "valid_entrance")
+
     def __init__(self, id, head, left_hand=None, right_hand=None, valid_entrance=True):
         self.head = head
         self.id = id
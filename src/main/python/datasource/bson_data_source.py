@@ -0,0 +1,307 @@
+import gzip
+import os
+import struct
+import threading
+
+import bson
+import numpy as np
+from bson.raw_bson import RawBSONDocument
+
+from constants import NUM_GONDOLA
+from datasource.data_source import DataSource, PLATE_DATA_BATCH_SIZE, match_filter
+
+# first bytes of a mongodump --archive file
+ARCHIVE_MAGIC = b"\x6d\xe2\x99\x81"
+GZIP_MAGIC = b"\x1f\x8b"
+# length of the empty document ending a block of an archive
+ARCHIVE_TERMINATOR = -1
+# top level fields kept by the index of a collection, to sort and filter without decoding
+INDEX_FIELDS = ("timestamp", "gondola_id", "camera_id")
+
+
+class BsonCollectionIndex:
+    """
+    Location and top level fields of the documents of a collection in a dump file,
+    in file order
+    path: dump file, gzip compressed or not
+    offsets, lengths: [doc] position and size in bytes of every document in the
+        uncompressed file
+    fields: name -> [doc] values of the INDEX_FIELDS, None for missing fields
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.offsets = []
+        self.lengths = []
+        self.fields = {name: [] for name in INDEX_FIELDS}
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def add(self, offset, raw):
+        self.offsets.append(offset)
+        self.lengths.append(len(raw))
+        # only the top level of a raw document is decoded, nested documents stay raw bytes
+        doc = RawBSONDocument(raw)
+        for name in INDEX_FIELDS:
+            self.fields[name].append(doc.get(name))
+
+    # [doc] float64 timestamps, NaN for documents without one
+    def get_timestamps(self):
+        return np.array(
+            [np.nan if t is None else t for t in self.fields["timestamp"]],
+            dtype=np.float64,
+        )
+
+    # documents decoded one at a time, in the order of the document indices
+    def iter_documents(self, indices=None):
+        if indices is None:
+            indices = range(len(self))
+        if len(indices) == 0:
+            return
+        with open_dump_file(self.path) as f:
+            for i in indices:
+                f.seek(self.offsets[i])
+                yield bson.decode(f.read(self.lengths[i]))
+
+
+class BsonDataSource(DataSource):
+    """
+    Documents of a test case streamed from a mongodump, without a database server
+    path: mongodump directory of the database, with a <collection>.bson or <collection>.bson.gz
+        file per collection, or mongodump --archive file, gzip compressed or not
+    db_name: database of the archive, only needed when it holds more than one
+    The documents of a collection are located by a first pass over its file that only decodes
+    their top level fields, then decoded one at a time when they are streamed, so the dump
+    never has to fit in memory. Gzip compressed files are read sequentially when their
+    documents are already in a timely order, otherwise every backwards seek decompresses the
+    file from its start: decompress them first.
+    """
+
+    def __init__(self, path, db_name=None):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self.db_name = db_name
+        # collection -> BsonCollectionIndex, built on first use
+        self._indexes = {}
+        self._archive_indexed = False
+        # collections can be streamed from several threads, a file is indexed once
+        self._index_lock = threading.Lock()
+
+    def __repr__(self):
+        return "BsonDataSource(%s)" % self.path
+
+    @classmethod
+    def from_dump_dir(cls, dump_dir, db_name):
+        db_dir = os.path.join(dump_dir, db_name)
+        if os.path.isdir(db_dir):
+            return cls(db_dir)
+        for extension in (".archive", ".archive.gz"):
+            archive = os.path.join(dump_dir, db_name + extension)
+            if os.path.exists(archive):
+                return cls(archive, db_name)
+        raise FileNotFoundError("no dump of %s in %s" % (db_name, dump_dir))
+
+    def get_products(self):
+        return self.__get_index("products").iter_documents()
+
+    def get_planogram(self):
+        return self.__get_index("planogram").iter_documents()
+
+    def get_targets(self, start_time=0):
+        targets_index = self.__get_targets_index()
+        return targets_index.iter_documents(
+            get_sorted_indices(targets_index.get_timestamps(), start_time)
+        )
+
+    def get_plate_data(self, start_time=0, batch_size=PLATE_DATA_BATCH_SIZE):
+        plate_index = self.__get_index("plate_data")
+        return plate_index.iter_documents(
+            get_sorted_indices(plate_index.get_timestamps(), start_time)
+        )
+
+    def get_plate_data_start_time(self):
+        timestamps = self.__get_index("plate_data").get_timestamps()
+        if len(timestamps) == 0:
+            return None
+        return float(np.nanmin(timestamps))
+
+    def get_plate_data_fingerprint(self):
+        return get_fingerprint(self.__get_index("plate_data").get_timestamps())
+
+    def get_targets_fingerprint(self):
+        return get_fingerprint(self.__get_targets_index().get_timestamps())
+
+    def get_plate_doc_counts(self, start_time, number_gondolas=NUM_GONDOLA):
+        plate_index = self.__get_index("plate_data")
+        doc_counts = [0] * number_gondolas
+        for gondola_id, timestamp in zip(
+            plate_index.fields["gondola_id"], plate_index.fields["timestamp"]
+        ):
+            if timestamp is None or timestamp < start_time:
+                continue
+            if gondola_id is not None and 1 <= gondola_id <= number_gondolas:
+                doc_counts[gondola_id - 1] += 1
+        return doc_counts
+
+    def find_frames(self, filter):
+        frame_index = self.__get_index("frame_message")
+        if all(key in INDEX_FIELDS for key in (filter or {})):
+            # filtered on the index, only the matching frames are decoded
+            return frame_index.iter_documents(
+                [
+                    i
+                    for i in range(len(frame_index))
+                    if match_filter(
+                        {name: frame_index.fields[name][i] for name in filter or {}},
+                        filter,
+                    )
+                ]
+            )
+        return (
+            doc for doc in frame_index.iter_documents() if match_filter(doc, filter)
+        )
+
+    def __get_targets_index(self):
+        targets_index = self.__get_index("full_targets")
+        if len(targets_index) == 0:
+            targets_index = self.__get_index("targets")
+        return targets_index
+
+    def __get_index(self, collection):
+        with self._index_lock:
+            return self.__build_index(collection)
+
+    def __build_index(self, collection):
+        if os.path.isdir(self.path):
+            if collection not in self._indexes:
+                self._indexes[collection] = index_collection_file(self.path, collection)
+        elif not self._archive_indexed:
+            self._indexes = index_archive(self.path, self.db_name)
+            self._archive_indexed = True
+        if collection not in self._indexes:
+            # as with mongo, a missing collection is empty
+            self._indexes[collection] = BsonCollectionIndex(self.path)
+        return self._indexes[collection]
+
+
+# indices of the documents from start_time on, in a timely order, keeping the file order on ties
+def get_sorted_indices(timestamps, start_time):
+    order = np.argsort(timestamps, kind="stable")
+    return order[timestamps[order] >= start_time]
+
+
+# count and min and max timestamps of the documents of a collection, see DataSource
+def get_fingerprint(timestamps):
+    if len(timestamps) == 0:
+        return {"count": 0, "min_timestamp": None, "max_timestamp": None}
+    return {
+        "count": len(timestamps),
+        "min_timestamp": float(np.nanmin(timestamps)),
+        "max_timestamp": float(np.nanmax(timestamps)),
+    }
+
+
+def open_dump_file(path):
+    with open(path, "rb") as f:
+        is_gzip = f.read(2) == GZIP_MAGIC
+    if is_gzip:
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+"""
+Function to read the next document of a BSON stream without decoding it
+Input:
+    f: binary file
+Returns:
+    offset, raw document bytes
+    ARCHIVE_TERMINATOR at the end of a block of an archive, None at the end of the file
+"""
+
+
+def read_raw_document(f):
+    offset = f.tell()
+    head = f.read(4)
+    if len(head) == 0:
+        return None
+    if len(head) < 4:
+        raise ValueError("truncated BSON document at offset %d" % offset)
+    (length,) = struct.unpack("<i", head)
+    if length == ARCHIVE_TERMINATOR:
+        return ARCHIVE_TERMINATOR
+    body = f.read(length - 4)
+    if len(body) < length - 4:
+        raise ValueError("truncated BSON document at offset %d" % offset)
+    return offset, head + body
+
+
+# index of the <collection>.bson[.gz] file of a mongodump directory, empty when missing
+def index_collection_file(dump_dir, collection):
+    for extension in (".bson", ".bson.gz"):
+        path = os.path.join(dump_dir, collection + extension)
+        if os.path.exists(path):
+            break
+    else:
+        return BsonCollectionIndex(None)
+
+    index = BsonCollectionIndex(path)
+    with open_dump_file(path) as f:
+        while True:
+            document = read_raw_document(f)
+            if document is None:
+                break
+            if document == ARCHIVE_TERMINATOR:
+                raise ValueError("%s is an archive, not a BSON file" % path)
+            index.add(*document)
+    return index
+
+
+"""
+Function to index the collections of a database in a mongodump --archive file
+An archive is a prelude (header and collection metadata documents) followed by blocks of the
+collections, every block is a namespace header document and documents of its collection, the
+prelude and every block end with ARCHIVE_TERMINATOR
+Input:
+    path: archive file, gzip compressed or not
+    db_name: database to index, None when the archive holds a single database
+Returns:
+    dict of collection -> BsonCollectionIndex
+"""
+
+
+def index_archive(path, db_name=None):
+    indexes = {}
+    db_names = set()
+    with open_dump_file(path) as f:
+        if f.read(4) != ARCHIVE_MAGIC:
+            raise ValueError("%s is not a mongodump archive" % path)
+        while read_raw_document(f) not in (ARCHIVE_TERMINATOR, None):
+            pass
+
+        while True:
+            header = read_raw_document(f)
+            if header is None:
+                break
+            if header == ARCHIVE_TERMINATOR:
+                raise ValueError("empty block header in %s" % path)
+            header = bson.decode(header[1])
+            db_names.add(header["db"])
+            index = None
+            if db_name is None or header["db"] == db_name:
+                index = indexes.setdefault(
+                    (header["db"], header["collection"]), BsonCollectionIndex(path)
+                )
+            while True:
+                document = read_raw_document(f)
+                if document is None or document == ARCHIVE_TERMINATOR:
+                    break
+                if index is not None:
+                    index.add(*document)
+
+    if db_name is None and len(db_names) > 1:
+        raise ValueError(
+            "%s holds the databases %s, choose one" % (path, sorted(db_names))
+        )
+    return {collection: index for (_, collection), index in indexes.items()}
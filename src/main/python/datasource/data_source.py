@@ -0,0 +1,96 @@
+from constants import NUM_GONDOLA
+from datasource.tail import PollingTail
+
+# documents of plate_data fetched at once
+PLATE_DATA_BATCH_SIZE = 1000
+
+
+class DataSource:
+    """
+    Documents of the collections of a test case, as recorded by the store
+    Backends stream the documents of products, planogram, targets, plate_data and
+    frame_message, plate_data in a timely order. Documents are dicts, backends may leave out
+    the fields that cashier.process does not read.
+    """
+
+    # products documents
+    def get_products(self):
+        raise NotImplementedError
+
+    # planogram documents, the facings of the products
+    def get_planogram(self):
+        raise NotImplementedError
+
+    # targets documents from start_time (seconds since epoch) on, in a timely order,
+    # from full_targets when it is not empty
+    def get_targets(self, start_time=0):
+        raise NotImplementedError
+
+    # plate_data documents from start_time (seconds since epoch) on, in a timely order
+    def get_plate_data(self, start_time=0, batch_size=PLATE_DATA_BATCH_SIZE):
+        raise NotImplementedError
+
+    # timestamp of the first plate_data document, None when there is none
+    def get_plate_data_start_time(self):
+        raise NotImplementedError
+
+    # dict with the count and the min and max timestamps of the plate_data documents,
+    # it changes when documents are added or removed
+    def get_plate_data_fingerprint(self):
+        raise NotImplementedError
+
+    # same as get_plate_data_fingerprint, for the targets documents of get_targets
+    def get_targets_fingerprint(self):
+        raise NotImplementedError
+
+    # number of plate_data documents of every gondola from start_time on,
+    # None when the backend can not count them cheaply
+    def get_plate_doc_counts(self, start_time, number_gondolas=NUM_GONDOLA):
+        raise NotImplementedError
+
+    # frame_message documents matching a query filter, see match_filter
+    def find_frames(self, filter):
+        raise NotImplementedError
+
+    # Tail of the plate_data documents from start_time on, polled for the new documents
+    def tail_plate_data(self, start_time=0, batch_size=PLATE_DATA_BATCH_SIZE):
+        return PollingTail(
+            lambda tail_start_time: self.get_plate_data(tail_start_time, batch_size),
+            start_time,
+        )
+
+    # Tail of the targets documents from start_time on, polled for the new documents
+    def tail_targets(self, start_time=0):
+        return PollingTail(self.get_targets, start_time)
+
+
+QUERY_OPERATORS = {
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+}
+
+"""
+Function to evaluate a mongo query filter on a document, for backends without a query engine
+Only equality and $gt, $gte, $lt, $lte conditions on top level fields are supported
+Input:
+    doc: document, or dict of its top level fields
+    filter: query filter, None matches every document
+Returns:
+    True when the document matches
+"""
+
+
+def match_filter(doc, filter):
+    for key, condition in (filter or {}).items():
+        value = doc.get(key)
+        if isinstance(condition, dict):
+            for operator, operand in condition.items():
+                if operator not in QUERY_OPERATORS:
+                    raise ValueError("unsupported query operator: %s" % operator)
+                if not QUERY_OPERATORS[operator](value, operand):
+                    return False
+        elif value != condition:
+            return False
+    return True
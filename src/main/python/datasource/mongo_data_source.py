@@ -0,0 +1,182 @@
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+
+from computations.target_timeline import TARGETS_PROJECTION
+from constants import NUM_GONDOLA
+from datasource.data_source import DataSource, PLATE_DATA_BATCH_SIZE
+from datasource.tail import PollingTail
+
+MONGO_URI = "mongodb://localhost:27017"
+
+# the only fields of a plate_data document read by PlateData.from_dict
+PLATE_DATA_PROJECTION = {
+    "timestamp": 1,
+    "gondola_id": 1,
+    "shelf_index": 1,
+    "plate_index": 1,
+    "document.plate_data.freq_samp": 1,
+    "document.plate_data.values": 1,
+}
+
+
+class MongoDataSource(DataSource):
+    """
+    Documents of a test case restored in a mongo database
+    Filters, projections and sorts run on the server, plate_data documents before the start
+    time are never fetched. The plate_data and targets collections are indexed by timestamp
+    before they are first read, so their timestamp sorts are not blocking sorts, which fail
+    past 32MB on mongo 4.2
+    db: pymongo Database of the test case
+    use_change_streams: tail the collections with change streams instead of polling them,
+        change streams need a replica set, the tails fall back to polling without one
+    """
+
+    def __init__(self, db, use_change_streams=False):
+        self.db = db
+        self.use_change_streams = use_change_streams
+        # names of the collections whose timestamp index was ensured
+        self.indexed_collections = set()
+
+    @classmethod
+    def from_uri(cls, db_name, uri=MONGO_URI, use_change_streams=False):
+        return cls(MongoClient(uri)[db_name], use_change_streams)
+
+    def get_products(self):
+        return self.db["products"].find()
+
+    def get_planogram(self):
+        return self.db["planogram"].find()
+
+    def get_targets(self, start_time=0):
+        return self.__get_indexed(self.__get_targets_collection()).find(
+            {"timestamp": {"$gte": start_time}},
+            TARGETS_PROJECTION,
+            sort=[("timestamp", 1)],
+        )
+
+    def get_plate_data(self, start_time=0, batch_size=PLATE_DATA_BATCH_SIZE):
+        return self.__get_indexed(self.db["plate_data"]).find(
+            {"timestamp": {"$gte": start_time}},
+            PLATE_DATA_PROJECTION,
+            sort=[("timestamp", 1)],
+            batch_size=batch_size,
+        )
+
+    def get_plate_data_start_time(self):
+        first_doc = self.__get_indexed(self.db["plate_data"]).find_one(
+            {}, {"timestamp": 1}, sort=[("timestamp", 1)]
+        )
+        return None if first_doc is None else first_doc["timestamp"]
+
+    def get_plate_data_fingerprint(self):
+        return get_fingerprint(self.__get_indexed(self.db["plate_data"]))
+
+    def get_targets_fingerprint(self):
+        return get_fingerprint(self.__get_indexed(self.__get_targets_collection()))
+
+    def get_plate_doc_counts(self, start_time, number_gondolas=NUM_GONDOLA):
+        doc_counts = [0] * number_gondolas
+        pipeline = [
+            {"$match": {"timestamp": {"$gte": start_time}}},
+            {"$group": {"_id": "$gondola_id", "count": {"$sum": 1}}},
+        ]
+        for group in self.db["plate_data"].aggregate(pipeline):
+            if group["_id"] is not None and 1 <= group["_id"] <= number_gondolas:
+                doc_counts[group["_id"] - 1] = group["count"]
+        return doc_counts
+
+    def find_frames(self, filter):
+        return self.db["frame_message"].find(filter)
+
+    def tail_plate_data(self, start_time=0, batch_size=PLATE_DATA_BATCH_SIZE):
+        polling_tail = super().tail_plate_data(start_time, batch_size)
+        return self.__watch(self.db["plate_data"], polling_tail)
+
+    def tail_targets(self, start_time=0):
+        return self.__watch(
+            self.__get_targets_collection(), super().tail_targets(start_time)
+        )
+
+    def __get_targets_collection(self):
+        targets_collection = self.db["full_targets"]
+        if targets_collection.estimated_document_count() == 0:
+            targets_collection = self.db["targets"]
+        return targets_collection
+
+    # the collection, with a timestamp index created the first time it is read
+    def __get_indexed(self, collection):
+        if collection.name in self.indexed_collections:
+            return collection
+        try:
+            collection.create_index([("timestamp", 1)])
+        except OperationFailure as e:
+            print(
+                "!!!WARNING: no timestamp index on %s, sorting it may fail: %s"
+                % (collection.name, e)
+            )
+        self.indexed_collections.add(collection.name)
+        return collection
+
+    def __watch(self, collection, polling_tail):
+        if not self.use_change_streams:
+            return polling_tail
+        try:
+            change_stream = collection.watch([{"$match": {"operationType": "insert"}}])
+        except OperationFailure as e:
+            print(
+                "!!!WARNING: no change stream on %s, polling it: %s"
+                % (collection.name, e)
+            )
+            return polling_tail
+        return ChangeStreamTail(change_stream, polling_tail)
+
+
+# count and min and max timestamps of the documents of a collection
+def get_fingerprint(collection):
+    count = collection.count_documents({})
+    if count == 0:
+        return {"count": 0, "min_timestamp": None, "max_timestamp": None}
+    projection = {"timestamp": 1}
+    first_doc = collection.find_one({}, projection, sort=[("timestamp", 1)])
+    last_doc = collection.find_one({}, projection, sort=[("timestamp", -1)])
+    return {
+        "count": count,
+        "min_timestamp": first_doc["timestamp"],
+        "max_timestamp": last_doc["timestamp"],
+    }
+
+
+class ChangeStreamTail:
+    """
+    Tail of a collection following its inserts with a change stream
+    The documents already in the collection are read by a first poll of polling_tail, the
+    stream is opened before it so no insert is missed, and the inserts the first poll already
+    read are skipped. Inserts are returned in their order, which the recorder keeps timely.
+    change_stream: pymongo ChangeStream of the inserts of the collection
+    polling_tail: PollingTail of the collection, for the documents inserted before
+    """
+
+    def __init__(self, change_stream, polling_tail):
+        self.change_stream = change_stream
+        self.polling_tail = polling_tail
+        self.caught_up = False
+
+    # documents inserted since the last poll, at most max_docs
+    def poll(self, max_docs=None):
+        if not self.caught_up:
+            docs = self.polling_tail.poll(max_docs)
+            if max_docs is None or len(docs) < max_docs:
+                self.caught_up = True
+            return docs
+        docs = []
+        while max_docs is None or len(docs) < max_docs:
+            change = self.change_stream.try_next()
+            if change is None:
+                break
+            doc = change["fullDocument"]
+            if not self.polling_tail.is_read(doc):
+                docs.append(doc)
+        return docs
+
+    def close(self):
+        self.change_stream.close()
@@ -0,0 +1,65 @@
+"""
+Function to get the identity of a document, its _id or, for documents without one, its
+timestamp and plate
+"""
+
+
+def get_document_key(doc):
+    if "_id" in doc:
+        return doc["_id"]
+    return (
+        doc["timestamp"],
+        doc.get("gondola_id"),
+        doc.get("shelf_index"),
+        doc.get("plate_index"),
+    )
+
+
+class PollingTail:
+    """
+    Tail of a collection polled with a timestamp cursor
+    Every poll queries the documents from the timestamp of the latest document read on and
+    skips the ones of that timestamp already read, so the documents inserted in a timely order
+    are all read once. Documents inserted later with an older timestamp are missed.
+    query: function of a start time (seconds since epoch) returning the documents from that
+        time on, in a timely order
+    start_time: timestamp of the first document to read
+    last_timestamp: timestamp of the latest document read, None before the first one
+    last_keys: keys of the documents read with last_timestamp, see get_document_key
+    """
+
+    def __init__(self, query, start_time=0):
+        self.query = query
+        self.start_time = start_time
+        self.last_timestamp = None
+        self.last_keys = set()
+
+    # documents inserted since the last poll, at most max_docs, in a timely order
+    def poll(self, max_docs=None):
+        docs = []
+        if self.last_timestamp is None:
+            query_start_time = self.start_time
+        else:
+            query_start_time = self.last_timestamp
+        for doc in self.query(query_start_time):
+            if self.is_read(doc):
+                continue
+            if max_docs is not None and len(docs) == max_docs:
+                break
+            docs.append(doc)
+            if doc["timestamp"] != self.last_timestamp:
+                self.last_timestamp = doc["timestamp"]
+                self.last_keys = set()
+            self.last_keys.add(get_document_key(doc))
+        return docs
+
+    # whether a document was returned by a poll, or is older than the documents returned
+    def is_read(self, doc):
+        if self.last_timestamp is None:
+            return doc["timestamp"] < self.start_time
+        if doc["timestamp"] == self.last_timestamp:
+            return get_document_key(doc) in self.last_keys
+        return doc["timestamp"] < self.last_timestamp
+
+    def close(self):
+        pass
@@ -1,8 +1,14 @@
 # Code for Evaluation
+import argparse
 import json
+import multiprocessing
+import os
+import time
 
-from cashier import process
+from cashier import open_data_source, process
 from constants import DEBUG, VERBOSE
+from utils.instrumentation_utils import Instrumentation, NO_INSTRUMENTATION
+from utils.prefetch_utils import PREFETCH_DEPTH
 
 """
 Groundtruth file contains pickup event and putback event separately.
@@ -46,7 +52,16 @@ Metrics:
 """
 
 
-def evaluate_inventory(dbs, gt_path):
+def evaluate_inventory(
+    dbs,
+    gt_path,
+    num_workers=1,
+    report_dir=None,
+    dump_dir=None,
+    chunk_seconds=None,
+    prefetch_depth=PREFETCH_DEPTH,
+    use_stage_cache=True,
+):
     # Load JSON groundtruth
     with open(gt_path) as f:
         gt_data = json.load(f)
@@ -57,92 +72,64 @@ def evaluate_inventory(dbs, gt_path):
         # with open('gt_final.json', 'w') as outfile:
         #     json.dump(gt_data, outfile)
 
-    # Metrics
+    # Find groundtruth entry for every database
+    gt_entries = [find_gt_entry(gt_list, i, dbs[i]) for i in range(len(dbs))]
+
+    # Databases are independent, each worker process opens its own data source
+    if num_workers > 1:
+        with multiprocessing.get_context("spawn").Pool(num_workers) as pool:
+            db_results = pool.starmap(
+                evaluate_database,
+                [
+                    (
+                        db_name,
+                        gt_entry,
+                        report_dir,
+                        dump_dir,
+                        chunk_seconds,
+                        prefetch_depth,
+                        use_stage_cache,
+                    )
+                    for db_name, gt_entry in zip(dbs, gt_entries)
+                ],
+            )
+    else:
+        db_results = [
+            evaluate_database(
+                db_name,
+                gt_entry,
+                report_dir,
+                dump_dir,
+                chunk_seconds,
+                prefetch_depth,
+                use_stage_cache,
+            )
+            for db_name, gt_entry in zip(dbs, gt_entries)
+        ]
+
+    # Metrics, merged in the order of the databases
     tp, fp, tn, fn = 0, 0, 0, 0
     overall_num_preds, overall_num_gt = 0, 0
-    for i in range(len(dbs)):
-        print("\n\nEvaluating database: ", dbs[i])
-        # Metrics per database
-        db_tp, db_fp, db_tn, db_fn = 0, 0, 0, 0
-        db_pred_counts, db_gt_counts = 0, 0
-
-        ########## Generate Prediction ##########
-        db_name = dbs[i]
-        receipts = process(db_name)
-
-        ########## Evaluate Ground truth ##########
-        gt_entry = gt_list[i]
-        # Find groundtruth entry for this database
-        tmp_i = 0
-        while gt_entry["dataset"] != db_name:
-            tmp_i += 1
-            gt_entry = gt_list[tmp_i]
-            assert tmp_i < len(gt_list)
-        assert gt_entry["dataset"] == db_name
-        event_list = gt_entry["events"]
-        for event in event_list:
-            gt_products = event["observation"]["products"]
-            gt_customerID = event["observation"]["target_id"]
-            # Find the corresponding customer receipts
-            if gt_customerID in receipts:
-                # Find the corresponding products on the receipt
-                customer_receipt = receipts[gt_customerID]
-                for gt_product in gt_products:
-                    gt_productID = gt_product["id"]
-                    for productID, entry in customer_receipt.purchaseList.items():
-                        if gt_productID == productID:
-                            product, quantity = entry
-                            if quantity > 0:
-                                db_tp += 1
-                                customer_receipt.purchaseList[productID] = (
-                                    product,
-                                    quantity - 1,
-                                )  # entry = (product, quantity)
-                    db_gt_counts += 1
-            else:
-                # No such customer
-                for gt_product in gt_products:
-                    db_gt_counts += 1
-
-        # Print False Items
-
-        num_receipt = 0
-        for id, customer_receipt in receipts.items():
-            if VERBOSE:
-                print(
-                    "============== False Receipt {} ==============".format(num_receipt)
-                )
-                print("Customer ID: " + id)
-                print("Purchase List: ")
-            for _, entry in customer_receipt.purchaseList.items():
-                product, quantity = entry
-                if quantity != 0:
-                    if VERBOSE:
-                        print(
-                            "*Name: " + product.name + ", Quantities: " + str(quantity),
-                            product.thumbnail,
-                        )
-                    db_fp += quantity
-            num_receipt += 1
-
-        db_fn = db_gt_counts - db_tp
-        db_pred_counts = db_tp + db_fp
-        overall_num_preds += db_pred_counts
-        overall_num_gt += db_gt_counts
-        tp += db_tp
-        fp += db_fp
-        fn += db_fn
-
-        # Display DB Evaluation
-        print(
-            "Database: {}, Correct Items on Receipts: {}/{}, Total GT items: {}".format(
-                db_name, db_tp, db_pred_counts, db_gt_counts
-            )
-        )
+    for db_result in db_results:
+        overall_num_preds += db_result["pred_counts"]
+        overall_num_gt += db_result["gt_counts"]
+        tp += db_result["tp"]
+        fp += db_result["fp"]
+        fn += db_result["fn"]
 
     print("\n================== Evaluation Summary ==================")
     print("Databases: ", dbs)
     print("Ground truth version: ", gt_path)
+    for db_result in db_results:
+        print(
+            "Database: {}, TP: {}, FP: {}, FN: {}, Time: {:.1f}s".format(
+                db_result["db_name"],
+                db_result["tp"],
+                db_result["fp"],
+                db_result["fn"],
+                db_result["seconds"],
+            )
+        )
     precision = 0.0 if tp + fp == 0 else tp * 100.0 / (tp + fp)
     print("Overall precision is: {:.1f}%".format(precision))
     recall = 0.0 if tp + fn == 0 else tp * 100.0 / (tp + fn)
@@ -154,6 +141,128 @@ def evaluate_inventory(dbs, gt_path):
     print("Overall F1 is: {:.1f}%".format(f1))
 
 
+def find_gt_entry(gt_list, i, db_name):
+    gt_entry = gt_list[i]
+    tmp_i = 0
+    while gt_entry["dataset"] != db_name:
+        tmp_i += 1
+        gt_entry = gt_list[tmp_i]
+        assert tmp_i < len(gt_list)
+    assert gt_entry["dataset"] == db_name
+    return gt_entry
+
+
+"""
+Evaluate the receipts of one database against its groundtruth entry
+The instrumentation report of the database is written to report_dir/<db_name>.json when
+report_dir is set, the database is read from its mongodump in dump_dir when it is set and
+its plate data is processed chunk_seconds of recording at a time when it is set, see
+cashier.process for prefetch_depth and use_stage_cache
+Returns:
+    dict with the database name, TP/FP/FN, prediction and groundtruth counts, and the
+    processing time in seconds
+"""
+
+
+def evaluate_database(
+    db_name,
+    gt_entry,
+    report_dir=None,
+    dump_dir=None,
+    chunk_seconds=None,
+    prefetch_depth=PREFETCH_DEPTH,
+    use_stage_cache=True,
+):
+    print("\n\nEvaluating database: ", db_name)
+    start_time = time.time()
+    # Metrics per database
+    db_tp, db_fp, db_tn, db_fn = 0, 0, 0, 0
+    db_pred_counts, db_gt_counts = 0, 0
+
+    ########## Generate Prediction ##########
+    instrumentation = NO_INSTRUMENTATION
+    if report_dir is not None:
+        instrumentation = Instrumentation(trace_memory=True)
+    data_source = open_data_source(db_name, dump_dir)
+    receipts = process(
+        db_name,
+        data_source,
+        instrumentation=instrumentation,
+        chunk_seconds=chunk_seconds,
+        prefetch_depth=prefetch_depth,
+        use_stage_cache=use_stage_cache,
+    )
+    if report_dir is not None:
+        os.makedirs(report_dir, exist_ok=True)
+        instrumentation.save_report(os.path.join(report_dir, db_name + ".json"))
+        if VERBOSE:
+            print(instrumentation.format_report())
+
+    ########## Evaluate Ground truth ##########
+    event_list = gt_entry["events"]
+    for event in event_list:
+        gt_products = event["observation"]["products"]
+        gt_customerID = event["observation"]["target_id"]
+        # Find the corresponding customer receipts
+        if gt_customerID in receipts:
+            # Find the corresponding products on the receipt
+            customer_receipt = receipts[gt_customerID]
+            for gt_product in gt_products:
+                gt_productID = gt_product["id"]
+                for productID, entry in customer_receipt.purchaseList.items():
+                    if gt_productID == productID:
+                        product, quantity = entry
+                        if quantity > 0:
+                            db_tp += 1
+                            customer_receipt.purchaseList[productID] = (
+                                product,
+                                quantity - 1,
+                            )  # entry = (product, quantity)
+                db_gt_counts += 1
+        else:
+            # No such customer
+            for gt_product in gt_products:
+                db_gt_counts += 1
+
+    # Print False Items
+
+    num_receipt = 0
+    for id, customer_receipt in receipts.items():
+        if VERBOSE:
+            print("============== False Receipt {} ==============".format(num_receipt))
+            print("Customer ID: " + id)
+            print("Purchase List: ")
+        for _, entry in customer_receipt.purchaseList.items():
+            product, quantity = entry
+            if quantity != 0:
+                if VERBOSE:
+                    print(
+                        "*Name: " + product.name + ", Quantities: " + str(quantity),
+                        product.thumbnail,
+                    )
+                db_fp += quantity
+        num_receipt += 1
+
+    db_fn = db_gt_counts - db_tp
+    db_pred_counts = db_tp + db_fp
+
+    # Display DB Evaluation
+    print(
+        "Database: {}, Correct Items on Receipts: {}/{}, Total GT items: {}".format(
+            db_name, db_tp, db_pred_counts, db_gt_counts
+        )
+    )
+    return {
+        "db_name": db_name,
+        "tp": db_tp,
+        "fp": db_fp,
+        "fn": db_fn,
+        "pred_counts": db_pred_counts,
+        "gt_counts": db_gt_counts,
+        "seconds": time.time() - start_time,
+    }
+
+
 if __name__ == "__main__":
     # dbs =['cps-test-01', 'cps-test-2'] + ['cps-test-'+str(i) for i in range(4, 13)]
     dbs = ["cps-test-2"]
@@ -161,4 +270,50 @@ if __name__ == "__main__":
     # dbs += ['ALL-SIMPLE-CHIP-1', 'TEAM-PEI-1', 'TEAM-PEI-JD-1', 'TEAM-8-1']
     # dbs = ['BASELINE-1','BASELINE-2','BASELINE-3', 'BASELINE-4', 'BASELINE-5', 'BASELINE-6', 'BASELINE-7','BASELINE-8','BASELINE-10','BASELINE-11', 'BASELINE-12', 'BASELINE-13', 'BASELINE-14', 'BASELINE-16', 'BASELINE-20', 'BASELINE-22', 'BASELINE-23', 'BASELINE-25']
     gt_path = "src/main/resources/ground_truth/v14.json"  # list of ground truth W.R.T the previous databases
-    evaluate_inventory(dbs, gt_path)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="number of databases evaluated in parallel worker processes",
+    )
+    parser.add_argument(
+        "--report-dir",
+        default=None,
+        help="directory of the stage timing and memory reports of every database",
+    )
+    parser.add_argument(
+        "--dump-dir",
+        default=None,
+        help="directory of the mongodumps of the databases, read without a mongo server",
+    )
+    parser.add_argument(
+        "--chunk-seconds",
+        type=float,
+        default=None,
+        help="process the plate data this many seconds of recording at a time, "
+        "with a memory use that does not grow with the recording",
+    )
+    parser.add_argument(
+        "--prefetch-depth",
+        type=int,
+        default=PREFETCH_DEPTH,
+        help="batches of plate data read and decoded ahead of the processing in "
+        "background threads, 0 to read them in the main thread",
+    )
+    parser.add_argument(
+        "--no-stage-cache",
+        action="store_true",
+        help="compute every stage, the cached stages are neither loaded nor saved",
+    )
+    args = parser.parse_args()
+    evaluate_inventory(
+        dbs,
+        gt_path,
+        num_workers=args.workers,
+        report_dir=args.report_dir,
+        dump_dir=args.dump_dir,
+        chunk_seconds=args.chunk_seconds,
+        prefetch_depth=args.prefetch_depth,
+        use_stage_cache=not args.no_stage_cache,
+    )
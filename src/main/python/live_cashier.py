@@ -0,0 +1,257 @@
+# Live cashier: receipts updated while a test case is being recorded
+import argparse
+import time
+
+import numpy as np
+
+from cashier import ReceiptResolver, load_store, open_data_source, print_receipts
+from computations.target_timeline import TargetTimeline
+from computations.weight_stream import WeightStream
+from cpsdriver.codec import PlateData
+from data.event_table import EventTable
+from datasource.data_source import PLATE_DATA_BATCH_SIZE
+from utils.instrumentation_utils import NO_INSTRUMENTATION
+from utils.product_utils import (
+    get_product_by_id,
+    get_product_ids_from_position_2d,
+    get_product_ids_from_position_3d,
+)
+from utils.time_utils import get_test_start_time
+
+# recording seconds an event waits for the events that begin before it, at most
+MAX_LATENCY = 5.0
+# wall clock seconds between two polls of the data source when it has no new documents
+POLL_INTERVAL = 0.5
+
+
+class ReceiptUpdate:
+    """
+    Products added to the receipt of a customer by an event
+    customerID (String): target ID of the customer
+    product: product_extended added to the receipt
+    quantity (int): number of products added
+    timestamp: end of the event, seconds since epoch
+    latency: recording seconds between the end of the event and the update
+    """
+
+    __slots__ = ("customerID", "product", "quantity", "timestamp", "latency")
+
+    def __init__(self, customer_id, product, quantity, timestamp, latency):
+        self.customerID = customer_id
+        self.product = product
+        self.quantity = quantity
+        self.timestamp = timestamp
+        self.latency = latency
+
+    def __repr__(self):
+        return "ReceiptUpdate(%s, +%d %s, %.1fs late)" % (
+            self.customerID,
+            self.quantity,
+            self.product.product.name,
+            self.latency,
+        )
+
+
+class LiveCashier:
+    """
+    Receipts of a test case updated while its plate_data and targets documents arrive
+    The events are detected by a WeightStream and resolved in the order of batch mode: an
+    event is resolved once no event beginning before it can still be detected (the watermark
+    of the weight stream is past its begin) and once the target snapshots until its end
+    arrived. Events are not held more than max_latency recording seconds for the events
+    beginning before them, so a replayed recording gives the receipts of cashier.process as
+    long as no event lasts longer than that.
+    db_name: name of the database
+    store: Store of the database, its target timeline is extended with the targets documents
+        and its planogram updated by putbacks
+    receipt_resolver: ReceiptResolver, with the receipts
+    weight_stream: WeightStream, splits the events with the planogram of the start of the
+        test case, as batch mode does
+    plate_tail, targets_tail: tails of the plate_data and targets documents
+    pending_events: EventTable of the events waiting to be resolved, in the order of batch mode
+    target_horizon: timestamp of the latest target snapshot, -inf before the first one
+    """
+
+    def __init__(
+        self,
+        db_name,
+        data_source,
+        max_latency=MAX_LATENCY,
+        batch_size=PLATE_DATA_BATCH_SIZE,
+        instrumentation=NO_INSTRUMENTATION,
+    ):
+        self.db_name = db_name
+        self.max_latency = max_latency
+        self.batch_size = batch_size
+        self.instrumentation = instrumentation
+        self.store = load_store(data_source, instrumentation, TargetTimeline())
+        self.receipt_resolver = ReceiptResolver(self.store, instrumentation)
+
+        planogram = self.store.planogram.copy()
+        products_cache = self.store.products_cache
+        test_start_time = get_test_start_time(data_source, db_name)
+        self.weight_stream = WeightStream(
+            test_start_time,
+            (lambda x, y: get_product_ids_from_position_2d(x, y, planogram)),
+            (lambda x, y, z: get_product_ids_from_position_3d(x, y, z, planogram)),
+            lambda x: get_product_by_id(x, products_cache),
+            instrumentation=instrumentation,
+        )
+        self.plate_tail = data_source.tail_plate_data(test_start_time, batch_size)
+        self.targets_tail = data_source.tail_targets()
+        self.pending_events = EventTable.from_events([])
+        self.target_horizon = -np.inf
+
+    @property
+    def receipts(self):
+        return self.receipt_resolver.receipts
+
+    """
+    Function to read the new documents and resolve the events that are ready
+    Returns:
+        number of documents read, [ReceiptUpdate]
+    """
+
+    def poll(self):
+        instrumentation = self.instrumentation
+        with instrumentation.span("poll"):
+            target_docs = self.targets_tail.poll(self.batch_size)
+            plate_docs = self.plate_tail.poll(self.batch_size)
+        if len(target_docs) > 0:
+            with instrumentation.span("targets"):
+                self.store.bookkeeper.target_timeline.extend(target_docs)
+            self.target_horizon = max(
+                self.target_horizon, max(doc["timestamp"] for doc in target_docs)
+            )
+        with instrumentation.span("events"):
+            self.weight_stream.add_plate_data(PlateData.from_dicts(plate_docs))
+            self.__add_events(self.weight_stream.update())
+        receipt_updates = self.__resolve_ready_events()
+        return len(target_docs) + len(plate_docs), receipt_updates
+
+    """
+    Function to resolve all the remaining events, at the end of the recording
+    Returns:
+        [ReceiptUpdate]
+    """
+
+    def close(self):
+        with self.instrumentation.span("events"):
+            self.__add_events(self.weight_stream.flush())
+        receipt_updates = self.__resolve_ready_events(flush=True)
+        self.plate_tail.close()
+        self.targets_tail.close()
+        self.instrumentation.count("receipts", len(self.receipts))
+        return receipt_updates
+
+    """
+    Function to poll the data source until the recording stops, pushing the receipt updates
+    Input:
+        on_update: function called with every ReceiptUpdate
+        poll_interval: wall clock seconds between polls when there is no new document
+        idle_timeout: wall clock seconds without new documents after which the recording is
+            over, None to poll until interrupted
+    Returns:
+        dict of customer ID -> CustomerReceipt
+    """
+
+    def run(self, on_update=print, poll_interval=POLL_INTERVAL, idle_timeout=None):
+        last_read_time = time.monotonic()
+        try:
+            while True:
+                num_docs, receipt_updates = self.poll()
+                for receipt_update in receipt_updates:
+                    on_update(receipt_update)
+                if num_docs > 0:
+                    last_read_time = time.monotonic()
+                    continue
+                if (
+                    idle_timeout is not None
+                    and time.monotonic() - last_read_time >= idle_timeout
+                ):
+                    break
+                time.sleep(poll_interval)
+        except KeyboardInterrupt:
+            pass
+        for receipt_update in self.close():
+            on_update(receipt_update)
+        return self.receipts
+
+    # add detected events, the pending events stay in the order of batch mode: by begin,
+    # then by gondola and shelf, keeping the order of the splits of an event
+    def __add_events(self, event_table):
+        if len(event_table) == 0:
+            return
+        self.pending_events = EventTable.concatenate(
+            [self.pending_events, event_table]
+        ).sort_by_trigger_begin_and_shelf()
+
+    # resolve the longest run of pending events ready to be resolved
+    def __resolve_ready_events(self, flush=False):
+        pending = self.pending_events
+        horizon = self.weight_stream.horizon
+        watermark = self.weight_stream.get_watermark()
+        if flush:
+            num_ready = len(pending)
+        else:
+            event_watermark = max(watermark, horizon - self.max_latency)
+            target_watermark = max(self.target_horizon, horizon - self.max_latency)
+            is_ready = (pending.trigger_begin < event_watermark) & (
+                pending.trigger_end <= target_watermark
+            )
+            num_ready = len(pending) if is_ready.all() else int(np.argmin(is_ready))
+        if num_ready == 0:
+            return []
+
+        ready_events = pending[:num_ready]
+        self.pending_events = pending[num_ready:]
+        with self.instrumentation.span("receipts"):
+            purchases = self.receipt_resolver.resolve(ready_events)
+        if not flush:
+            # later events begin after the watermark or after the pending events
+            self.store.bookkeeper.target_timeline.drop_before(
+                min([watermark] + list(self.pending_events.trigger_begin[:1]))
+            )
+        return [
+            ReceiptUpdate(
+                customer_id,
+                product,
+                quantity,
+                event.triggerEnd,
+                max(horizon - event.triggerEnd, 0.0),
+            )
+            for event, customer_id, product, quantity in purchases
+        ]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Print the receipt updates of a test case while it is recorded"
+    )
+    parser.add_argument("db_name")
+    parser.add_argument(
+        "--dump-dir",
+        default=None,
+        help="replay the mongodump of the database from this directory",
+    )
+    parser.add_argument(
+        "--change-streams",
+        action="store_true",
+        help="follow the inserts with change streams, needs a replica set",
+    )
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL)
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=None,
+        help="stop after this many seconds without new documents",
+    )
+    parser.add_argument("--max-latency", type=float, default=MAX_LATENCY)
+    args = parser.parse_args()
+
+    data_source = open_data_source(args.db_name, args.dump_dir, args.change_streams)
+    live_cashier = LiveCashier(args.db_name, data_source, max_latency=args.max_latency)
+    receipts = live_cashier.run(
+        poll_interval=args.poll_interval, idle_timeout=args.idle_timeout
+    )
+    print_receipts(receipts)
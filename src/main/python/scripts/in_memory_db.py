@@ -0,0 +1,89 @@
+from datasource.data_source import match_filter
+
+
+class InMemoryDatabase:
+    """
+    A database held in memory, with the subset of the pymongo Database and Collection
+    interface used by cashier.process, e.g. to run it on a SyntheticStore
+    collections: collection name -> [document]
+    """
+
+    def __init__(self, collections):
+        self.collections = {
+            name: InMemoryCollection(name, docs) for name, docs in collections.items()
+        }
+
+    def __getitem__(self, name):
+        # as with mongo, a missing collection is empty
+        if name not in self.collections:
+            self.collections[name] = InMemoryCollection(name, [])
+        return self.collections[name]
+
+    def __repr__(self):
+        return "InMemoryDatabase(%s)" % ", ".join(self.collections)
+
+
+class InMemoryCollection:
+    """
+    Documents of a collection, queried with equality and $gt, $gte, $lt, $lte filters on top
+    level fields, sorted on top level fields and aggregated with $match and $group by a field
+    Projections are accepted and ignored, the documents are returned as they are stored
+    name: name of the collection
+    """
+
+    def __init__(self, name, docs):
+        self.name = name
+        self.docs = list(docs)
+
+    def __len__(self):
+        return len(self.docs)
+
+    # the documents are sorted when they are queried, an index changes nothing
+    def create_index(self, keys, **kwargs):
+        return "_".join("%s_%s" % (key, direction) for key, direction in keys)
+
+    def find(self, filter=None, projection=None, sort=None, **kwargs):
+        docs = [doc for doc in self.docs if match_filter(doc, filter)]
+        for key, direction in reversed(sort or []):
+            docs.sort(key=lambda doc: doc.get(key), reverse=direction < 0)
+        return iter(docs)
+
+    def find_one(self, filter=None, projection=None, sort=None, **kwargs):
+        return next(self.find(filter, projection, sort), None)
+
+    def count_documents(self, filter):
+        return sum(1 for doc in self.docs if match_filter(doc, filter))
+
+    def estimated_document_count(self):
+        return len(self.docs)
+
+    def aggregate(self, pipeline):
+        docs = self.docs
+        for stage in pipeline:
+            if "$match" in stage:
+                docs = [doc for doc in docs if match_filter(doc, stage["$match"])]
+            elif "$group" in stage:
+                docs = group(docs, stage["$group"])
+            else:
+                raise ValueError("unsupported aggregation stage: %s" % list(stage))
+        return iter(docs)
+
+
+# {"_id": "$field", name: {"$sum": 1}} groups, the only accumulator is a count
+def group(docs, spec):
+    key = spec["_id"]
+    if not (isinstance(key, str) and key.startswith("$")):
+        raise ValueError("unsupported group key: %s" % key)
+    accumulators = {name: value for name, value in spec.items() if name != "_id"}
+    for name, accumulator in accumulators.items():
+        if accumulator != {"$sum": 1}:
+            raise ValueError("unsupported accumulator: %s" % name)
+
+    counts = {}
+    for doc in docs:
+        group_key = doc.get(key[1:])
+        counts[group_key] = counts.get(group_key, 0) + 1
+    return [
+        dict({"_id": group_key}, **{name: count for name in accumulators})
+        for group_key, count in counts.items()
+    ]
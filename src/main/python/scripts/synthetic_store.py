@@ -0,0 +1,481 @@
+import base64
+import bisect
+
+import numpy as np
+
+from constants import (
+    INCH_TO_METER,
+    NUM_GONDOLA,
+    NUM_PLATE,
+    NUM_SHELF,
+    PLATE_SAMPLE_FREQUENCY,
+)
+from utils.coordinate_utils import build_plate_coordinates
+from utils.store_meta_utils import load_store_meta
+
+# samples of every plate_data document, as recorded by the store
+PLATE_DOC_SAMPLES = 12
+# [time, shelf + 1, plate + 1] layout of a plate_data document, the first row and column are NaN
+PLATE_DOC_SHAPE = (PLATE_DOC_SAMPLES, 13, 13)
+TARGET_FREQUENCY = 10
+# plates 10 to 12 of these gondolas are masked by WeightTrigger.adapt_np_plate
+GONDOLAS_WITH_MASKED_PLATES = (2, 4, 5)
+NUM_UNMASKED_PLATE = 9
+
+
+class SyntheticStore:
+    """
+    A synthetic test case, with the documents of every collection of a database
+    collections: collection name -> [document], the collections read by cashier.process
+    ground_truth: [dict] the actions of the shoppers in a timely order, with timestamp,
+        target_id, product_id, quantity, putback, gondola_id, shelf_id and plate_id
+    """
+
+    def __init__(self, collections, ground_truth):
+        self.collections = collections
+        self.ground_truth = ground_truth
+
+    def __repr__(self):
+        return "SyntheticStore(%s)" % ", ".join(
+            "%s=%d" % (name, len(docs)) for name, docs in self.collections.items()
+        )
+
+    # barcode -> number of items every target leaves the store with
+    def get_expected_receipts(self):
+        receipts = {}
+        for action in self.ground_truth:
+            items = receipts.setdefault(action["target_id"], {})
+            quantity = -action["quantity"] if action["putback"] else action["quantity"]
+            items[action["product_id"]] = items.get(action["product_id"], 0) + quantity
+        return {
+            target_id: {
+                product_id: quantity
+                for product_id, quantity in items.items()
+                if quantity > 0
+            }
+            for target_id, items in receipts.items()
+        }
+
+
+"""
+Function to generate a synthetic test case
+Shoppers walk between the plates of the store and pick up products, now and then putting one
+back to the plate it came from. Plate weights are encoded as the store records them: float32
+[time, shelf, plate] blobs in base64, PLATE_DOC_SAMPLES samples per document.
+Actions of a shelf never overlap, so every action is an isolated weight event.
+Input:
+    num_gondolas, num_shelves, num_plates: size of the store, at most the size of the store meta
+    num_products: number of products, products beyond the facings of the store are not placed
+    num_shoppers: number of targets
+    duration: seconds of recording
+    pick_rate: actions per second of every shopper
+    putback_rate: probability that an action puts back a product the shopper holds
+    frequency: plate samples per second
+    seed: seed of the random generator
+Returns:
+    SyntheticStore
+"""
+
+
+def generate_store(
+    num_gondolas=NUM_GONDOLA,
+    num_shelves=NUM_SHELF,
+    num_plates=NUM_PLATE,
+    num_products=200,
+    num_shoppers=4,
+    duration=120.0,
+    pick_rate=0.1,
+    putback_rate=0.2,
+    frequency=PLATE_SAMPLE_FREQUENCY,
+    start_time=1577836800.0,
+    seed=0,
+):
+    if not (
+        1 <= num_gondolas <= NUM_GONDOLA
+        and 1 <= num_shelves <= NUM_SHELF
+        and 1 <= num_plates <= NUM_PLATE
+    ):
+        raise ValueError("the store is larger than the store meta")
+    rng = np.random.default_rng(seed)
+
+    products = generate_products(num_products, rng)
+    facings = generate_facings(products, num_gondolas, num_shelves, num_plates, rng)
+    plate_coordinates = build_plate_coordinates(*load_store_meta())
+
+    # units on every plate of every facing at the start of the recording
+    stock = {
+        (facing_idx, plate_id): int(rng.integers(2, 8))
+        for facing_idx, facing in enumerate(facings)
+        for plate_id in facing["plate_ids"]
+    }
+    actions = generate_actions(
+        facings,
+        dict(stock),
+        products,
+        num_shoppers,
+        duration,
+        pick_rate,
+        putback_rate,
+        rng,
+    )
+    for action in actions:
+        action["timestamp"] += start_time
+        facing = facings[action["facing_idx"]]
+        action["plate_location"] = plate_coordinates[
+            facing["gondola_id"] - 1, facing["shelf_id"] - 1, action["plate_id"] - 1
+        ]
+
+    collections = {
+        "products": [
+            {
+                "product_id": {"barcode_type": "UPC", "id": product["barcode"]},
+                "metadata": {
+                    "name": product["name"],
+                    "thumbnail": "",
+                    "price": product["price"],
+                    "weight": product["weight"],
+                },
+            }
+            for product in products
+        ],
+        "planogram": [
+            {
+                "planogram_product_id": {
+                    "barcode_type": "UPC",
+                    "id": products[facing["product_idx"]]["barcode"],
+                },
+                "plate_ids": [
+                    {
+                        "shelf_id": {
+                            "gondola_id": {"id": facing["gondola_id"]},
+                            "shelf_index": facing["shelf_id"],
+                        },
+                        "plate_index": plate_id,
+                    }
+                    for plate_id in facing["plate_ids"]
+                ],
+                "global_coordinates": {},
+            }
+            for facing in facings
+        ],
+        "plate_data": generate_plate_docs(
+            facings,
+            stock,
+            products,
+            actions,
+            num_gondolas,
+            duration,
+            frequency,
+            start_time,
+            rng,
+        ),
+        "targets": generate_target_docs(
+            actions, num_shoppers, duration, start_time, rng
+        ),
+        "full_targets": [],
+        "frame_message": [],
+    }
+    ground_truth = [
+        {
+            "timestamp": action["timestamp"],
+            "target_id": action["target_id"],
+            "product_id": products[facings[action["facing_idx"]]["product_idx"]][
+                "barcode"
+            ],
+            "quantity": action["quantity"],
+            "putback": int(action["putback"]),
+            "gondola_id": facings[action["facing_idx"]]["gondola_id"],
+            "shelf_id": facings[action["facing_idx"]]["shelf_id"],
+            "plate_id": action["plate_id"],
+        }
+        for action in actions
+    ]
+    return SyntheticStore(collections, ground_truth)
+
+
+def generate_products(num_products, rng):
+    return [
+        {
+            "barcode": "%012d" % (100000000000 + product_idx * 7919),
+            "name": "Synthetic product %d" % product_idx,
+            "price": float(rng.integers(1, 20)) - 0.01,
+            "weight": float(rng.integers(20, 1200)),
+        }
+        for product_idx in range(num_products)
+    ]
+
+
+# facings of 1 to 3 neighbouring plates, every facing holds one product
+def generate_facings(products, num_gondolas, num_shelves, num_plates, rng):
+    facings = []
+    for gondola_id in range(1, num_gondolas + 1):
+        gondola_plates = num_plates
+        if gondola_id in GONDOLAS_WITH_MASKED_PLATES:
+            gondola_plates = min(num_plates, NUM_UNMASKED_PLATE)
+        for shelf_id in range(1, num_shelves + 1):
+            plate_id = 1
+            while plate_id <= gondola_plates:
+                width = min(int(rng.integers(1, 4)), gondola_plates - plate_id + 1)
+                facings.append(
+                    {
+                        "gondola_id": gondola_id,
+                        "shelf_id": shelf_id,
+                        "plate_ids": list(range(plate_id, plate_id + width)),
+                        "product_idx": len(facings) % len(products),
+                    }
+                )
+                plate_id += width
+    return facings
+
+
+# pick ups and putbacks of every shopper, consuming stock, a shelf is busy for EVENT_GAP seconds
+# around an action so that the weight events of a shelf never merge
+ACTION_DURATION = (0.6, 1.5)
+EVENT_GAP = 4.0
+
+
+def generate_actions(
+    facings,
+    stock,
+    products,
+    num_shoppers,
+    duration,
+    pick_rate,
+    putback_rate,
+    rng,
+):
+    shelf_busy = {}
+    actions = []
+    for shopper_idx in range(num_shoppers):
+        target_id = "shopper-%d" % shopper_idx
+        # facing index, plate id of the products held by the shopper
+        basket = []
+        time = float(rng.uniform(2.0, 10.0))
+        while True:
+            time += EVENT_GAP + rng.exponential(1 / pick_rate)
+            action_duration = float(rng.uniform(*ACTION_DURATION))
+            if time + action_duration > duration - 2.0:
+                break
+
+            putback = len(basket) > 0 and rng.uniform() < putback_rate
+            if putback:
+                facing_idx, plate_id = basket.pop(int(rng.integers(len(basket))))
+                quantity = 1
+            else:
+                facing_idx = int(rng.integers(len(facings)))
+                plate_id = int(rng.choice(facings[facing_idx]["plate_ids"]))
+                quantity = 1 if rng.uniform() < 0.85 else 2
+                if stock[facing_idx, plate_id] < quantity:
+                    continue
+
+            facing = facings[facing_idx]
+            shelf = (facing["gondola_id"], facing["shelf_id"])
+            busy_times = shelf_busy.setdefault(shelf, [])
+            i = bisect.bisect(busy_times, (time,))
+            if (i > 0 and busy_times[i - 1][1] > time) or (
+                i < len(busy_times) and busy_times[i][0] < time + action_duration
+            ):
+                # another shopper is at this shelf, the product stays where it is
+                if putback:
+                    basket.append((facing_idx, plate_id))
+                continue
+            busy_times.insert(i, (time - EVENT_GAP, time + action_duration + EVENT_GAP))
+
+            if putback:
+                stock[facing_idx, plate_id] += quantity
+            else:
+                stock[facing_idx, plate_id] -= quantity
+                basket += [(facing_idx, plate_id)] * quantity
+            actions.append(
+                {
+                    "timestamp": time,
+                    "duration": action_duration,
+                    "target_id": target_id,
+                    "shopper_idx": shopper_idx,
+                    "facing_idx": facing_idx,
+                    "plate_id": plate_id,
+                    "quantity": quantity,
+                    "putback": putback,
+                    "delta_weight": (1 if putback else -1)
+                    * quantity
+                    * products[facing["product_idx"]]["weight"],
+                }
+            )
+    actions.sort(key=lambda action: action["timestamp"])
+    return actions
+
+
+"""
+Function to generate the plate_data documents of the store
+The weight of a plate is its tare plus the products on it, with sensor noise. While a hand is on
+a plate the weight shakes and ramps to its new value.
+Input:
+    stock: (facing index, plate id) -> units on the plate at the start of the recording
+Returns:
+    [plate_data document] in a timely order
+"""
+
+PLATE_TARE = (300.0, 700.0)
+PLATE_NOISE = 1.5
+
+
+def generate_plate_docs(
+    facings,
+    stock,
+    products,
+    actions,
+    num_gondolas,
+    duration,
+    frequency,
+    start_time,
+    rng,
+):
+    num_docs = int(duration * frequency) // PLATE_DOC_SAMPLES
+    num_samples = num_docs * PLATE_DOC_SAMPLES
+    # samples [gondola, time, shelf, plate], the first row and column of a document are NaN
+    weights = np.full((num_gondolas,) + (num_samples,) + PLATE_DOC_SHAPE[1:], np.nan)
+    shelves = slice(1, NUM_SHELF + 1)
+    plates = slice(1, NUM_PLATE + 1)
+    weights[:, :, shelves, plates] = rng.uniform(
+        *PLATE_TARE, size=(num_gondolas, 1, NUM_SHELF, NUM_PLATE)
+    )
+
+    for (facing_idx, plate_id), units in stock.items():
+        facing = facings[facing_idx]
+        weights[facing["gondola_id"] - 1, :, facing["shelf_id"], plate_id] += (
+            units * products[facing["product_idx"]]["weight"]
+        )
+
+    sample_times = start_time + np.arange(num_samples) / frequency
+    for action in actions:
+        facing = facings[action["facing_idx"]]
+        gondola_idx = facing["gondola_id"] - 1
+        begin, end = np.searchsorted(
+            sample_times,
+            [action["timestamp"], action["timestamp"] + action["duration"]],
+        )
+        plate_weights = weights[gondola_idx, :, facing["shelf_id"], action["plate_id"]]
+        ramp = np.linspace(0, 1, end - begin, endpoint=False)
+        plate_weights[begin:end] += action["delta_weight"] * ramp + rng.normal(
+            0, 0.3 * abs(action["delta_weight"]) + 20.0, size=end - begin
+        )
+        plate_weights[end:] += action["delta_weight"]
+
+    weights[:, :, shelves, plates] += rng.normal(
+        0, PLATE_NOISE, size=(num_gondolas, num_samples, NUM_SHELF, NUM_PLATE)
+    )
+    weights = weights.astype(np.float32)
+
+    plate_docs = []
+    for doc_idx in range(num_docs):
+        samples = slice(doc_idx * PLATE_DOC_SAMPLES, (doc_idx + 1) * PLATE_DOC_SAMPLES)
+        for gondola_idx in range(num_gondolas):
+            plate_docs.append(
+                {
+                    "timestamp": float(sample_times[samples.start])
+                    + float(rng.uniform(0, 0.002)),
+                    "gondola_id": gondola_idx + 1,
+                    "shelf_index": 0,
+                    "plate_index": 0,
+                    "document": {
+                        "plate_data": {
+                            "freq_samp": float(frequency),
+                            "values": {
+                                "data": base64.b64encode(
+                                    weights[gondola_idx, samples].tobytes()
+                                ).decode("ascii"),
+                                "shape": list(PLATE_DOC_SHAPE),
+                                "type": "DATATYPE_FLOAT32",
+                            },
+                        }
+                    },
+                }
+            )
+    return plate_docs
+
+
+"""
+Function to generate the targets documents of the shoppers
+A shopper stands by the plate of every action and walks straight to the next one, the hands
+rest by the body unless they reach for a plate.
+Input:
+    actions: see generate_actions, with the plate location of every action in meter
+Returns:
+    [targets document] in a timely order, positions in inch
+"""
+
+HEAD_HEIGHT = 1.6
+HAND_DROP = 0.7
+REACH_TIME = 0.8
+BODY_SCORE = 0.95
+
+
+def generate_target_docs(actions, num_shoppers, duration, start_time, rng):
+    num_docs = int(duration * TARGET_FREQUENCY)
+    doc_times = start_time + np.arange(num_docs) / TARGET_FREQUENCY
+    # [shopper, time, xyz] in meter
+    heads = np.empty((num_shoppers, num_docs, 3))
+    hands = np.empty((num_shoppers, num_docs, 3))
+    for shopper_idx in range(num_shoppers):
+        shopper_actions = [
+            action for action in actions if action["shopper_idx"] == shopper_idx
+        ]
+        # waypoints: entrance, the plate of every action, exit
+        entrance = np.array([rng.uniform(-1.0, 1.0), rng.uniform(-2.0, -1.0), 0.0])
+        way_times = [start_time]
+        way_points = [entrance]
+        for action in shopper_actions:
+            way_times += [
+                action["timestamp"] - REACH_TIME,
+                action["timestamp"] + action["duration"] + REACH_TIME,
+            ]
+            way_points += [action["plate_location"]] * 2
+        way_times.append(start_time + duration)
+        way_points.append(entrance)
+        way_points = np.array(way_points)
+
+        for axis in range(3):
+            heads[shopper_idx, :, axis] = np.interp(
+                doc_times, way_times, way_points[:, axis]
+            )
+        heads[shopper_idx, :, 2] = HEAD_HEIGHT
+        hands[shopper_idx] = heads[shopper_idx]
+        hands[shopper_idx, :, 2] -= HAND_DROP
+        for action in shopper_actions:
+            begin, end = np.searchsorted(
+                doc_times,
+                [action["timestamp"], action["timestamp"] + action["duration"]],
+            )
+            hands[shopper_idx, begin:end] = action["plate_location"]
+
+    heads += rng.normal(0, 0.02, size=heads.shape)
+    hands += rng.normal(0, 0.02, size=hands.shape)
+    heads /= INCH_TO_METER
+    hands /= INCH_TO_METER
+
+    def body_part(point):
+        return {
+            "point": {"x": float(point[0]), "y": float(point[1]), "z": float(point[2])},
+            "score": BODY_SCORE,
+        }
+
+    return [
+        {
+            "timestamp": float(doc_times[doc_idx]),
+            "document": {
+                "targets": {
+                    "targets": [
+                        {
+                            "target_id": {"id": "shopper-%d" % shopper_idx},
+                            "target_state": "TARGETSTATE_VALID_ENTRANCE",
+                            "head": body_part(heads[shopper_idx, doc_idx]),
+                            "l_wrist": body_part(hands[shopper_idx, doc_idx]),
+                            "r_wrist": body_part(hands[shopper_idx, doc_idx]),
+                        }
+                        for shopper_idx in range(num_shoppers)
+                    ]
+                }
+            },
+        }
+        for doc_idx in range(num_docs)
+    ]
@@ -1,5 +1,6 @@
 import numpy as np
 
+from constants import NUM_GONDOLA, NUM_SHELF, NUM_PLATE
 from data.coordinates import Coordinates
 
 
@@ -72,3 +73,83 @@ def get_3d_coordinates_for_plate(
 
 def get_translation(meta):
     return meta["coordinates"]["transform"]["translation"]
+
+
+def get_rotation(meta):
+    return meta["coordinates"]["transform"].get("rotation", {"x": 0, "y": 0, "z": 0})
+
+
+"""
+Function to get the rotation applied to the coordinates of the children of a store element
+The children are rotated by the inverse of the Rodrigues vector of the element, e.g. the
+shelves of gondola 5 (rotation z=-pi/2) are rotated by 90 degrees: (x, y) -> (-y, x)
+Input:
+    meta: gondola, shelf or plate meta
+Returns:
+    ndarray [3, 3]
+"""
+
+
+def get_children_rotation_matrix(meta):
+    rotation = get_rotation(meta)
+    # inverse rotation: same axis, opposite angle
+    vector = -np.array([rotation["x"], rotation["y"], rotation["z"]], dtype=np.float64)
+    angle = np.linalg.norm(vector)
+    if angle == 0:
+        return np.eye(3)
+    k = vector / angle
+    cross = np.array([[0, -k[2], k[1]], [k[2], 0, -k[0]], [-k[1], k[0], 0]])
+    return np.eye(3) + np.sin(angle) * cross + (1 - np.cos(angle)) * cross @ cross
+
+
+"""
+Function to precompute the absolute 3D coordinates of every plate center of the store
+A plate missing from the store meta gets the coordinates of its shelf, the plates of a missing
+gondola or shelf are NaN
+Input:
+    gondolas_dict, shelves_dict, plates_dict: see build_dicts_from_store_meta
+Returns:
+    ndarray [gondola, shelf, plate, xyz] in meter, indexed by 0-based ids
+"""
+
+
+def build_plate_coordinates(
+    gondolas_dict,
+    shelves_dict,
+    plates_dict,
+    num_gondola=NUM_GONDOLA,
+    num_shelf=NUM_SHELF,
+    num_plate=NUM_PLATE,
+):
+    plate_coordinates = np.full((num_gondola, num_shelf, num_plate, 3), np.nan)
+    for gondola in range(1, num_gondola + 1):
+        gondola_meta = gondolas_dict.get(str(gondola))
+        if gondola_meta is None:
+            continue
+        gondola_translation = translation_to_array(get_translation(gondola_meta))
+        gondola_rotation = get_children_rotation_matrix(gondola_meta)
+        for shelf in range(1, num_shelf + 1):
+            shelf_meta = shelves_dict.get(str(gondola) + "_" + str(shelf))
+            if shelf_meta is None:
+                continue
+            shelf_translation = translation_to_array(get_translation(shelf_meta))
+            shelf_rotation = get_children_rotation_matrix(shelf_meta)
+            shelf_3d = gondola_translation + gondola_rotation @ shelf_translation
+            plate_coordinates[gondola - 1, shelf - 1, :] = shelf_3d
+            for plate in range(1, num_plate + 1):
+                plate_meta = plates_dict.get(
+                    str(gondola) + "_" + str(shelf) + "_" + str(plate)
+                )
+                if plate_meta is None:
+                    continue
+                plate_translation = translation_to_array(get_translation(plate_meta))
+                plate_coordinates[gondola - 1, shelf - 1, plate - 1] = (
+                    shelf_3d + gondola_rotation @ (shelf_rotation @ plate_translation)
+                )
+    return plate_coordinates
+
+
+def translation_to_array(translation):
+    return np.array(
+        [translation["x"], translation["y"], translation["z"]], dtype=np.float64
+    )
@@ -0,0 +1,226 @@
+import contextlib
+import cProfile
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+
+# the peak of every span needs tracemalloc.reset_peak, new in Python 3.9, only the peak of the
+# run is measured without it
+TRACE_SPAN_MEMORY = hasattr(tracemalloc, "reset_peak")
+
+
+class Instrumentation:
+    """
+    Named timers, counters and memory peaks of a run, collected while it is entered:
+        with instrumentation:
+            with instrumentation.span("stage"):
+                instrumentation.count("events", num_events)
+    Spans nest, the path of a span is the names of its enclosing spans joined by "/". Spans of
+    worker threads are nested in the span the main thread is in. The seconds of a span are
+    summed over its calls, over all threads.
+    trace_memory: record the peak of the memory traced by tracemalloc during the run, in bytes,
+        and with TRACE_SPAN_MEMORY the peak of every span of the main thread, in bytes above the
+        memory traced when the span was entered
+    profile: capture a cProfile of the main thread, the top functions are reported
+    """
+
+    def __init__(self, trace_memory=False, profile=False, profile_top=30):
+        self.trace_memory = trace_memory
+        self.profile = profile
+        self.profile_top = profile_top
+        # path -> {"calls", "seconds"[, "peak_bytes"]}
+        self.spans = {}
+        self.counters = {}
+        self.seconds = 0.0
+        self.peak_bytes = 0
+        self.profile_stats = None
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._main_thread = None
+        # open spans of the main thread, [name, peak_bytes, entry_bytes] frames, the peak and
+        # the memory traced when the span was entered
+        self._main_stack = []
+        self._root_frame = None
+        self._started_tracemalloc = False
+        self._profiler = None
+        self._start_time = None
+
+    def __enter__(self):
+        self._main_thread = threading.get_ident()
+        self._local.stack = self._main_stack
+        self._root_frame = [None, 0, 0]
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            elif TRACE_SPAN_MEMORY:
+                tracemalloc.reset_peak()
+        if self.profile:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.seconds += time.perf_counter() - self._start_time
+        if self._profiler is not None:
+            self._profiler.disable()
+            self.profile_stats = pstats.Stats(self._profiler)
+            self._profiler = None
+        if self.trace_memory:
+            if TRACE_SPAN_MEMORY:
+                self.__fold_peak()
+                peak_bytes = self._root_frame[1]
+            else:
+                peak_bytes = tracemalloc.get_traced_memory()[1]
+            self.peak_bytes = max(self.peak_bytes, peak_bytes)
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+        return False
+
+    @contextlib.contextmanager
+    def span(self, name):
+        stack = self.__get_stack()
+        is_main = threading.get_ident() == self._main_thread
+        trace_memory = (
+            self.trace_memory
+            and TRACE_SPAN_MEMORY
+            and is_main
+            and tracemalloc.is_tracing()
+        )
+        frame = [name, 0, 0]
+        if trace_memory:
+            self.__fold_peak()
+            frame[2] = tracemalloc.get_traced_memory()[0]
+        stack.append(frame)
+        path = "/".join(open_frame[0] for open_frame in self.__get_base() + stack)
+        with self._lock:
+            # reported in the order the spans are first entered
+            self.spans.setdefault(path, {"calls": 0, "seconds": 0.0})
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start_time
+            if trace_memory:
+                self.__fold_peak()
+            stack.pop()
+            with self._lock:
+                span = self.spans[path]
+                span["calls"] += 1
+                span["seconds"] += seconds
+                if trace_memory:
+                    span["peak_bytes"] = max(span.get("peak_bytes", 0), frame[1])
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get_report(self):
+        report = {
+            "seconds": self.seconds,
+            "spans": {path: dict(span) for path, span in self.spans.items()},
+            "counters": dict(self.counters),
+        }
+        if self.trace_memory:
+            report["peak_bytes"] = self.peak_bytes
+        if self.profile_stats is not None:
+            report["profile"] = self.__get_profile_report()
+        return report
+
+    def format_report(self):
+        lines = ["Total: {:.3f}s".format(self.seconds)]
+        if self.trace_memory:
+            lines[0] += ", peak memory: {:.1f}MB".format(self.peak_bytes / 2**20)
+        for path, span in self.spans.items():
+            line = "{}{}: {:.3f}s, {} calls".format(
+                "    " * path.count("/"),
+                path.rsplit("/", 1)[-1],
+                span["seconds"],
+                span["calls"],
+            )
+            if "peak_bytes" in span:
+                line += ", peak memory: {:.1f}MB".format(span["peak_bytes"] / 2**20)
+            lines.append(line)
+        for name, value in self.counters.items():
+            lines.append("{}: {}".format(name, value))
+        return "\n".join(lines)
+
+    def save_report(self, path):
+        with open(path, "w") as f:
+            json.dump(self.get_report(), f, indent=2)
+
+    # fold the peak traced since the last reset into the open frames of the main thread and the
+    # run, and reset it, so the next peak is measured from the current memory
+    def __fold_peak(self):
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        for frame in [self._root_frame] + self._main_stack:
+            frame[1] = max(frame[1], peak_bytes - frame[2])
+        tracemalloc.reset_peak()
+
+    def __get_stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    # enclosing spans of a worker thread: the spans the main thread is in
+    def __get_base(self):
+        if threading.get_ident() == self._main_thread:
+            return []
+        return list(self._main_stack)
+
+    # the top functions by cumulative time
+    def __get_profile_report(self):
+        stats = self.profile_stats.stats
+        rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)
+        return [
+            {
+                "function": "{}:{}({})".format(*function),
+                "calls": calls,
+                "total_seconds": total_seconds,
+                "cumulative_seconds": cumulative_seconds,
+            }
+            for function, (_, calls, total_seconds, cumulative_seconds, _) in rows[
+                : self.profile_top
+            ]
+        ]
+
+
+class _NullSpan:
+    """
+    Span of NullInstrumentation, a context manager that does nothing
+    """
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class NullInstrumentation:
+    """
+    Instrumentation that records nothing, its spans and counters cost a method call
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def span(self, name):
+        return _NULL_SPAN
+
+    def count(self, name, value=1):
+        pass
+
+
+NO_INSTRUMENTATION = NullInstrumentation()
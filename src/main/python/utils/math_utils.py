@@ -1,6 +1,7 @@
 import math
 
 import numpy as np
+from scipy.special import erfc
 from scipy.stats import norm
 
 
@@ -18,6 +19,140 @@ def area_under_two_gaussians(m1, std1, m2, std2):
     return area
 
 
+"""
+Function to calculate the overlapping area of two gaussians with the same standard deviation
+The intersection is the midpoint of the means, so the area has the closed form
+2 * cdf(-|m1 - m2| / (2 * std)), which works element-wise on ndarrays
+"""
+
+
+def area_under_two_gaussians_same_std(m1, m2, std):
+    return erfc(np.abs(np.subtract(m1, m2)) / (2 * np.sqrt(2) * std))
+
+
+"""
+Function to find the indices of the k highest scores, ordered by decreasing score
+Ties keep the order of `scores`, the same as a stable sort of the whole array
+"""
+
+
+def top_k_indices(scores, k):
+    scores = np.asarray(scores)
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp)
+    kth_score = np.partition(scores, len(scores) - k)[len(scores) - k]
+    candidates = np.flatnonzero(scores >= kth_score)
+    order = np.argsort(-scores[candidates], kind="stable")
+    return candidates[order[:k]]
+
+
+"""
+Function to calculate the moving mean and standard deviation over the last axis
+The cumulative sums restart every `window` samples, so the value of a window only depends on
+the samples from the start of its block: an array split at multiples of `window`, processed
+piece by piece with the same reference, gives exactly the same values as the whole array
+Input:
+    a: ndarray [..., time]
+    window: number of samples per window
+    reference: ndarray [...], value subtracted from every row to keep the sums small,
+        the first sample of every row by default
+    block_rows: number of leading rows processed at once, bounds the temporaries
+Returns:
+    mean, std: ndarrays [..., time - window + 1], the same values as np.mean and
+    np.std over rolling_window(a, window) but computed from cumulative sums in O(N)
+"""
+
+
+def rolling_mean_std(a, window, reference=None, block_rows=8):
+    a = np.asarray(a)
+    num_samples = a.shape[-1]
+    num_windows = max(num_samples - window + 1, 0)
+    rows = a.reshape(-1, num_samples)
+    mean = np.empty((rows.shape[0], num_windows))
+    std = np.empty((rows.shape[0], num_windows))
+    if num_windows == 0:
+        return mean.reshape(a.shape[:-1] + (0,)), std.reshape(a.shape[:-1] + (0,))
+    if reference is None:
+        reference = rows[:, 0]
+    references = np.asarray(reference, dtype=np.float64).reshape(-1, 1)
+    # one spare block past the end, for the second part of the last windows
+    num_blocks = -(-num_samples // window) + 1
+
+    for begin in range(0, rows.shape[0], block_rows):
+        block = rows[begin : begin + block_rows]
+        block_reference = references[begin : begin + block_rows]
+        shifted = np.zeros((block.shape[0], num_blocks * window))
+        np.subtract(block, block_reference, out=shifted[:, :num_samples])
+        shifted = shifted.reshape(block.shape[0], num_blocks, window)
+
+        window_mean = block_window_sums(shifted, num_windows) / window
+        np.square(shifted, out=shifted)
+        window_var = block_window_sums(shifted, num_windows) / window
+        window_var -= window_mean * window_mean
+        np.maximum(window_var, 0, out=window_var)
+
+        mean[begin : begin + block_rows] = window_mean + block_reference
+        std[begin : begin + block_rows] = np.sqrt(window_var)
+
+    shape = a.shape[:-1] + (num_windows,)
+    return mean.reshape(shape), std.reshape(shape)
+
+
+# sums of the windows of [row, block, window] samples, a window starting at sample r of a
+# block is the end of the block, from r on, plus the start of the next block, before r
+def block_window_sums(blocks, num_windows):
+    prefix = np.zeros(blocks.shape)
+    np.cumsum(blocks[..., :-1], axis=-1, out=prefix[..., 1:])
+    block_sums = prefix[..., -1:] + blocks[..., -1:]
+    sums = (block_sums[:, :-1] - prefix[:, :-1]) + prefix[:, 1:]
+    return sums.reshape(blocks.shape[0], -1)[:, :num_windows]
+
+
+"""
+Function to find the runs of consecutive active samples of every row
+Input:
+    is_active: boolean ndarray [row, time]
+Returns:
+    rows, begins, ends: int ndarrays, one entry per run, ordered by row and then by time,
+    `ends` is inclusive
+"""
+
+
+def find_active_runs(is_active):
+    is_active = np.asarray(is_active, dtype=bool).reshape(-1, np.shape(is_active)[-1])
+    padded = np.zeros((is_active.shape[0], is_active.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = is_active
+    boundaries = np.diff(padded, axis=1)
+    rows, begins = np.nonzero(boundaries == 1)
+    _, ends = np.nonzero(boundaries == -1)
+    return rows, begins, ends - 1
+
+
+"""
+Function to find the position of the maximum of every run, the first one on ties
+Input:
+    values: ndarray [row, time]
+    rows, begins, ends: runs as returned by find_active_runs
+Returns:
+    int ndarray with the time index of the maximum of every run
+"""
+
+
+def segment_argmax(values, rows, begins, ends):
+    if len(rows) == 0:
+        return np.zeros(0, dtype=np.intp)
+    lengths = ends - begins + 1
+    offsets = np.cumsum(lengths) - lengths
+    segment_ids = np.repeat(np.arange(len(rows)), lengths)
+    positions = np.arange(lengths.sum()) - offsets[segment_ids] + begins[segment_ids]
+    segment_values = values[rows[segment_ids], positions]
+    segment_max = np.maximum.reduceat(segment_values, offsets)
+    max_indices = np.flatnonzero(segment_values == segment_max[segment_ids])
+    _, first = np.unique(segment_ids[max_indices], return_index=True)
+    return positions[max_indices[first]]
+
+
 """
 Function to calculate distance of two 3D coordinates
 """
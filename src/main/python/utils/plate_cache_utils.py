@@ -0,0 +1,68 @@
+"""
+Function to load the aggregated plate data of a database from the stage cache, the tensors are
+memory mapped read-only
+Input:
+    stage_cache: StageCache
+    cache_key: key of the plate data, see cashier.get_plate_data_cache_key
+Returns:
+    agg_plate_data, agg_shelf_data, timestamps, samples_per_doc, frequencies as returned by
+    WeightTrigger.get_agg_weight, or None when there is no cache for this database content
+"""
+
+
+def load_agg_weight(stage_cache, cache_key):
+    cached = stage_cache.load("agg_weight", cache_key)
+    if cached is None:
+        return None
+
+    agg_plate_data = []
+    agg_shelf_data = []
+    timestamps = []
+    samples_per_doc = []
+    for gondola_idx, has_data in enumerate(cached["has_data"]):
+        gondola_id = gondola_idx + 1
+        if has_data:
+            agg_plate_data.append(cached["plate_{}".format(gondola_id)])
+            agg_shelf_data.append(cached["shelf_{}".format(gondola_id)])
+        else:
+            agg_plate_data.append(None)
+            agg_shelf_data.append(None)
+        timestamps.append(cached["timestamps_{}".format(gondola_id)])
+        samples_per_doc.append(cached["samples_per_doc_{}".format(gondola_id)])
+    return (
+        agg_plate_data,
+        agg_shelf_data,
+        timestamps,
+        samples_per_doc,
+        cached["frequencies"],
+    )
+
+
+"""
+Function to save the aggregated plate data of a database to the stage cache
+Input:
+    stage_cache, cache_key: see load_agg_weight
+    agg_weight: agg_plate_data, agg_shelf_data, timestamps, samples_per_doc, frequencies
+"""
+
+
+def save_agg_weight(stage_cache, cache_key, agg_weight):
+    (
+        agg_plate_data,
+        agg_shelf_data,
+        timestamps,
+        samples_per_doc,
+        frequencies,
+    ) = agg_weight
+    cached = {
+        "has_data": [plate_data is not None for plate_data in agg_plate_data],
+        "frequencies": [float(frequency) for frequency in frequencies],
+    }
+    for gondola_idx in range(len(agg_plate_data)):
+        gondola_id = gondola_idx + 1
+        if agg_plate_data[gondola_idx] is not None:
+            cached["plate_{}".format(gondola_id)] = agg_plate_data[gondola_idx]
+            cached["shelf_{}".format(gondola_id)] = agg_shelf_data[gondola_idx]
+        cached["timestamps_{}".format(gondola_id)] = timestamps[gondola_idx]
+        cached["samples_per_doc_{}".format(gondola_id)] = samples_per_doc[gondola_idx]
+    stage_cache.save("agg_weight", cache_key, cached)
@@ -0,0 +1,56 @@
+from cpsdriver.codec import PlateData
+from datasource.data_source import PLATE_DATA_BATCH_SIZE
+from utils.instrumentation_utils import NO_INSTRUMENTATION
+from utils.prefetch_utils import prefetch
+
+"""
+Function to stream the decoded plate data of a test case in a timely order
+Documents before the test start time are skipped by the data source and every batch of
+documents is decoded at once. With a prefetch depth, the cursor is read in one background
+thread and the batches are decoded in an other one, up to prefetch_depth batches ahead of
+the consumer, so the network and the decoding overlap the aggregation and detection;
+otherwise every batch is read and decoded when it is consumed.
+Input:
+    data_source: DataSource of the test case
+    test_start_time: seconds since epoch
+    prefetch_depth: number of batches read and decoded ahead, 0 to read them when consumed
+Returns:
+    generator of PlateData
+"""
+
+
+def stream_plate_data(
+    data_source,
+    test_start_time,
+    batch_size=PLATE_DATA_BATCH_SIZE,
+    prefetch_depth=0,
+    instrumentation=NO_INSTRUMENTATION,
+):
+    batches = iter_batches(
+        data_source.get_plate_data(test_start_time, batch_size), batch_size
+    )
+    if prefetch_depth > 0:
+        batches = prefetch(batches, prefetch_depth, "plate_data_fetch")
+
+    def decode(batch):
+        with instrumentation.span("decode"):
+            return PlateData.from_dicts(batch)
+
+    plate_data_batches = (decode(batch) for batch in batches)
+    if prefetch_depth > 0:
+        plate_data_batches = prefetch(
+            plate_data_batches, prefetch_depth, "plate_data_decode"
+        )
+    for plate_data_batch in plate_data_batches:
+        yield from plate_data_batch
+
+
+# lists of batch_size consecutive documents, the last one may be shorter or empty
+def iter_batches(docs, batch_size):
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    yield batch
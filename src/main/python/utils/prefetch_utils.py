@@ -0,0 +1,66 @@
+import queue
+import threading
+
+# items a stage of a prefetch pipeline produces ahead of its consumer, at most
+PREFETCH_DEPTH = 4
+# seconds a stage waits on a full queue before checking whether its consumer stopped
+STOP_POLL_INTERVAL = 0.1
+
+# marks the end of the items of a stage, with the exception that ended it if any
+_END = object()
+
+"""
+Function to iterate an iterable in a background thread, ahead of the consumer
+The items are produced into a bounded queue, so waiting on the network or decoding the next
+items overlaps the work done on the current ones. Stages are chained by prefetching the
+items of an other prefetch. Exceptions of the iterable are raised to the consumer, and the
+thread stops once the consumer closes the generator.
+Input:
+    iterable
+    depth: number of items produced ahead of the consumer, at most
+    name: name of the thread
+Returns:
+    generator of the items of iterable, in the same order
+"""
+
+
+def prefetch(iterable, depth=PREFETCH_DEPTH, name="prefetch"):
+    items = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    # False when the consumer stopped before the item could be queued
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=STOP_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((_END, e))
+            return
+        finally:
+            close = getattr(iterable, "close", None)
+            if close is not None:
+                close()
+        put((_END, None))
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _END:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stopped.set()
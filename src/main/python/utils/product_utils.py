@@ -1,6 +1,16 @@
 from cpsdriver.codec import Product
+from data.product_catalog import ProductCatalog
 from data.product_extended import ProductExtended
 
+# Workarounds for database errors, barcode -> real weight in gram
+PRODUCT_WEIGHT_CORRECTIONS = {
+    # [JD] Good catch, the real weight is 538g,
+    # Our store operator made a mistake when inputing the product in :scales:
+    "898999010007": 538.0,
+    # [JD] 1064g for the large one (ACQUA PANNA PET MINERAL DRINK), 800g for the small one
+    "041508922487": 1064.0,
+}
+
 
 def get_product_by_id(product_id, products_cache):
     if product_id in products_cache:
@@ -8,44 +18,41 @@ def get_product_by_id(product_id, products_cache):
     return None
 
 
-def build_all_products_cache(products_cursor):
+def build_all_products_cache(product_docs):
     products_cache = {}
     product_ids_from_products_table = set()
 
-    for item in products_cursor.find():
+    for item in product_docs:
         product = Product.from_dict(item)
         if product.weight == 0.0:
             continue
 
+        # the corrected weight is used everywhere the product weight is read
+        if product.product_id.barcode in PRODUCT_WEIGHT_CORRECTIONS:
+            product = product._replace(
+                weight=PRODUCT_WEIGHT_CORRECTIONS[product.product_id.barcode]
+            )
         product_extended = ProductExtended(product)
 
-        # Workaround for database error: [JD] Good catch, the real weight is 538g,
-        # Our store operator made a mistake when inputing the product in :scales:
-        if product_extended.get_barcode() == "898999010007":
-            product_extended.weight = 538.0
-
-        # Workaround for database error: [JD] 1064g for the large one (ACQUA PANNA PET MINERAL DRINK), 800g for the small one
-        if product_extended.get_barcode() == "041508922487":
-            product_extended.weight = 1064.0
-
         products_cache[product_extended.get_barcode()] = product_extended
         product_ids_from_products_table.add(product_extended.get_barcode())
 
     return products_cache, product_ids_from_products_table
 
 
+def build_product_catalog(products_cache, product_ids_from_products_table):
+    return ProductCatalog(
+        get_product_by_id(product_id, products_cache)
+        for product_id in product_ids_from_products_table
+    )
+
+
 def get_product_ids_from_position_2d(gondola_idx, shelf_idx, planogram):
-    # remove Nones
-    product_ids = set()
-    for productIDSetForPlate in planogram[gondola_idx - 1][shelf_idx - 1]:
-        if productIDSetForPlate is None:
-            continue
-        product_ids = product_ids.union(productIDSetForPlate)
-    return product_ids
+    return planogram.get_product_ids_2d(gondola_idx, shelf_idx)
 
 
 def get_product_ids_from_position_3d(gondola_idx, shelf_idx, plate_idx, planogram):
-    return planogram[gondola_idx - 1][shelf_idx - 1][plate_idx - 1]
+    return planogram.get_product_ids_3d(gondola_idx, shelf_idx, plate_idx)
 
 
 def get_product_positions(product_id, products_cache):
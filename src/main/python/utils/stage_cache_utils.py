@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+import numpy as np
+
+STAGE_CACHE_DIR = "data/cache/stages"
+# size of the cache on disk, the least recently used entries are evicted past it
+STAGE_CACHE_MAX_BYTES = 4 * 1024**3
+# bump when the output of a stage changes for the same inputs, older entries are not read
+STAGE_CACHE_VERSION = 1
+
+
+# json encoding of the parts of a cache key that json does not encode, arrays by content
+def encode_key_part(value):
+    if isinstance(value, np.ndarray):
+        digest = hashlib.sha256(np.ascontiguousarray(value).tobytes()).hexdigest()
+        return {"dtype": value.dtype.str, "shape": value.shape, "sha256": digest}
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+"""
+Function to get the key of the output of a stage in the stage cache
+Input:
+    parts: json encodable inputs of the stage and configuration it depends on, e.g. the key
+        of the stage it reads from, its parameters and thresholds; arrays are hashed by content
+Returns:
+    hex digest, the same parts always give the same key
+"""
+
+
+def get_cache_key(*parts):
+    encoded = json.dumps(
+        [STAGE_CACHE_VERSION, parts], sort_keys=True, default=encode_key_part
+    )
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class StageCache:
+    """
+    Outputs of the stages of cashier.process kept on the local disk, addressed by keys of
+    their inputs, see get_cache_key. A stage whose inputs and configuration did not change is
+    loaded instead of computed, the stages after a changed one get new keys and are computed.
+    An output is a dict of arrays and json encodable values. An entry is the directory
+    <cache_dir>/<stage>/<key> with a .npy file per array, loaded memory mapped read-only, and a
+    meta.json with the other values. Loading an entry marks it as used, the least recently
+    used entries are evicted once the cache is larger than max_bytes.
+    cache_dir: directory of the cache
+    max_bytes: size of the cache on disk
+    """
+
+    def __init__(self, cache_dir=STAGE_CACHE_DIR, max_bytes=STAGE_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # stages of different gondolas are saved from several threads
+        self._evict_lock = threading.Lock()
+
+    def __repr__(self):
+        return "StageCache(%s)" % self.cache_dir
+
+    # output of a stage, None when the key is None or the output is not cached
+    def load(self, stage, key):
+        if key is None:
+            return None
+        entry_dir = os.path.join(self.cache_dir, stage, key)
+        try:
+            with open(os.path.join(entry_dir, "meta.json")) as f:
+                meta = json.load(f)
+            output = dict(meta["values"])
+            for name in meta["arrays"]:
+                output[name] = np.load(
+                    os.path.join(entry_dir, name + ".npy"), mmap_mode="r"
+                )
+            os.utime(entry_dir)
+        except FileNotFoundError:
+            # not cached, or evicted while it was loaded
+            return None
+        return output
+
+    # save the output of a stage, nothing is saved when the key is None
+    # the files are written to a temporary directory that becomes the entry once complete, so
+    # an interrupted run never leaves a partial entry behind
+    def save(self, stage, key, output):
+        if key is None:
+            return
+        entry_dir = os.path.join(self.cache_dir, stage, key)
+        tmp_dir = "%s.tmp.%d.%d" % (entry_dir, os.getpid(), threading.get_ident())
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        meta = {"values": {}, "arrays": []}
+        for name, value in output.items():
+            if isinstance(value, np.ndarray):
+                np.save(os.path.join(tmp_dir, name + ".npy"), value)
+                meta["arrays"].append(name)
+            else:
+                meta["values"][name] = value
+        with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+            json.dump(meta, f)
+
+        try:
+            os.replace(tmp_dir, entry_dir)
+        except OSError:
+            # saved by an other run in the meantime, with the same content
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    # remove the least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        with self._evict_lock:
+            entries = []
+            for stage in os.listdir(self.cache_dir):
+                stage_dir = os.path.join(self.cache_dir, stage)
+                for key in os.listdir(stage_dir):
+                    if ".tmp." in key:
+                        continue
+                    entry_dir = os.path.join(stage_dir, key)
+                    try:
+                        size = sum(
+                            entry.stat().st_size for entry in os.scandir(entry_dir)
+                        )
+                        entries.append((os.stat(entry_dir).st_mtime, size, entry_dir))
+                    except FileNotFoundError:
+                        continue
+            total_bytes = sum(size for _, size, _ in entries)
+            for _, size, entry_dir in sorted(entries):
+                if total_bytes <= self.max_bytes:
+                    break
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total_bytes -= size
+
+
+class NullStageCache:
+    """
+    StageCache that caches nothing, every stage is computed
+    """
+
+    def load(self, stage, key):
+        return None
+
+    def save(self, stage, key, output):
+        pass
+
+
+NO_STAGE_CACHE = NullStageCache()
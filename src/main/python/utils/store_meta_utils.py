@@ -1,3 +1,9 @@
+import json
+import os
+
+STORE_META_DIR = "src/main/resources/store_meta"
+
+
 def build_dicts_from_store_meta(gondolas_meta, shelves_meta, plates_meta):
     gondolas_dict = {}
     shelves_dict = {}
@@ -24,3 +30,22 @@ def build_dicts_from_store_meta(gondolas_meta, shelves_meta, plates_meta):
         plates_dict[plate_meta_index_key] = plate_meta
 
     return gondolas_dict, shelves_dict, plates_dict
+
+
+"""
+Function to load the store meta files into dicts, see build_dicts_from_store_meta
+Input:
+    store_meta_dir: directory of Gondolas.json, Shelves.json and Plates.json
+Returns:
+    gondolas_dict, shelves_dict, plates_dict
+"""
+
+
+def load_store_meta(store_meta_dir=STORE_META_DIR):
+    with open(os.path.join(store_meta_dir, "Gondolas.json")) as f:
+        gondolas_meta = json.load(f)["gondolas"]
+    with open(os.path.join(store_meta_dir, "Shelves.json")) as f:
+        shelves_meta = json.load(f)["shelves"]
+    with open(os.path.join(store_meta_dir, "Plates.json")) as f:
+        plates_meta = json.load(f)["plates"]
+    return build_dicts_from_store_meta(gondolas_meta, shelves_meta, plates_meta)
@@ -1,3 +1,5 @@
+import numpy as np
+
 from constants import BODY_THRESH
 
 from utils.math_utils import calculate_distance3D
@@ -114,6 +116,88 @@ def associate_product_closest(product_loc, targets):
             result_id = id
             result_target = target
             min_dist = closest_dist
-    if not result_id or not result_target:
-        result_id, result_target = targets.items[0]
+    if (not result_id or not result_target) and len(targets) > 0:
+        result_id, result_target = next(iter(targets.items()))
     return result_id, result_target
+
+
+"""
+Helper functions to associate targets to products with stacked body part arrays
+All the targets of one or many events are handled in one NumPy expression, leading
+dimensions are batch dimensions, e.g. [event, target, ...] for many events at once.
+Input:
+    product_locs: ndarray [..., xyz], product locations (global coordinate)
+    positions: ndarray [..., target, body part, xyz], body parts are head, left hand, right hand
+    scores: ndarray [..., target, body part]
+    has_part: ndarray [..., target, body part], False for body parts that were not detected
+    has_target: ndarray [..., target], False for padding targets, all targets by default
+Returns:
+    ndarray [...] of result target indices, -1 when no target could be associated
+"""
+
+
+def associate_product_naive_array(
+    product_locs, positions, scores, has_part, has_target=None
+):
+    distances = _calculate_body_part_distances(product_locs, positions)[..., 0]
+    distances = np.where(has_part[..., 0], distances, np.inf)
+    return _select_closest_target(distances, has_target, last_on_ties=False)
+
+
+def associate_product_ce_array(
+    product_locs, positions, scores, has_part, has_target=None
+):
+    scores = np.where(has_part, scores, 0)
+    distances = np.where(
+        has_part, _calculate_body_part_distances(product_locs, positions), 0
+    )
+    total_score = scores.sum(axis=-1)
+    ce_distance = (distances * scores).sum(axis=-1)
+    is_scored = total_score != 0
+    ce_distance = np.where(
+        is_scored, ce_distance / np.where(is_scored, total_score, 1), np.inf
+    )
+    return _select_closest_target(
+        ce_distance, has_target, last_on_ties=True, allow_inf=True
+    )
+
+
+def associate_product_closest_array(
+    product_locs, positions, scores, has_part, has_target=None
+):
+    distances = np.where(
+        has_part & (scores > BODY_THRESH),
+        _calculate_body_part_distances(product_locs, positions),
+        np.inf,
+    )
+    return _select_closest_target(
+        distances.min(axis=-1), has_target, last_on_ties=True, allow_inf=True
+    )
+
+
+# distances [..., target, body part] between every body part and its product location
+def _calculate_body_part_distances(product_locs, positions):
+    product_locs = np.asarray(product_locs, dtype=np.float64)
+    deltas = positions - product_locs[..., None, None, :]
+    return np.sqrt((deltas * deltas).sum(axis=-1))
+
+
+# index of the target with the minimum distance, the first or the last one on ties,
+# targets at an infinite distance can only be selected when allow_inf is set
+def _select_closest_target(distances, has_target, last_on_ties, allow_inf=False):
+    if has_target is None:
+        has_target = np.ones(distances.shape, dtype=bool)
+    num_targets = distances.shape[-1]
+    if num_targets == 0:
+        return np.full(distances.shape[:-1], -1, dtype=np.intp)
+    distances = np.where(has_target, distances, np.inf)
+    is_closest = has_target & (
+        distances == distances.min(axis=-1, initial=np.inf)[..., None]
+    )
+    if not allow_inf:
+        is_closest &= np.isfinite(distances)
+    if last_on_ties:
+        closest = num_targets - 1 - np.argmax(is_closest[..., ::-1], axis=-1)
+    else:
+        closest = np.argmax(is_closest, axis=-1)
+    return np.where(is_closest.any(axis=-1), closest, -1)
@@ -2,9 +2,11 @@ import json
 import os
 
 
-def get_test_start_time(plate_cursor, dbname):
+def get_test_start_time(data_source, dbname):
     video_start_time = get_clean_start_time(dbname)
-    db_start_time = plate_cursor.find_one(sort=[("timestamp", 1)])["timestamp"]
+    db_start_time = data_source.get_plate_data_start_time()
+    if db_start_time is None:
+        return 0
     if video_start_time - db_start_time >= 10:
         return video_start_time
     else:
@@ -0,0 +1,43 @@
+import base64
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main", "python")
+)
+
+from cpsdriver.codec import NumpyRecordCodec
+
+
+def encode(array):
+    return base64.b64encode(array.tobytes()).decode()
+
+
+class DecodeBatchTest(unittest.TestCase):
+    def assert_decode_batch(self, arrays, enc_type):
+        datas = [encode(array) for array in arrays]
+        batch = NumpyRecordCodec.decode_batch(datas, arrays[0].shape, enc_type)
+        np.testing.assert_array_equal(batch, np.stack(arrays))
+        self.assertTrue(batch.flags.writeable)
+        batch[0] = 0
+
+    # [plate, sample] float32 documents are 3 bytes aligned, decoded at once
+    def test_joined(self):
+        rng = np.random.RandomState(0)
+        arrays = [rng.normal(size=(12, 3)).astype(np.float32) for _ in range(5)]
+        self.assertEqual(len(encode(arrays[0])) * 3, arrays[0].nbytes * 4)
+        self.assert_decode_batch(arrays, "DATATYPE_FLOAT32")
+
+    # padded blobs, decoded one per row
+    def test_per_row(self):
+        rng = np.random.RandomState(0)
+        arrays = [rng.normal(size=(5, 1)).astype(np.float32) for _ in range(5)]
+        self.assertNotEqual(len(encode(arrays[0])) * 3, arrays[0].nbytes * 4)
+        self.assert_decode_batch(arrays, "DATATYPE_FLOAT32")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main", "python")
+)
+
+from utils.instrumentation_utils import (
+    NO_INSTRUMENTATION,
+    TRACE_SPAN_MEMORY,
+    Instrumentation,
+)
+
+MB = 2**20
+# bytes traced besides the blocks of a test, e.g. the frames and spans of the instrumentation
+OVERHEAD_BYTES = MB
+
+
+class InstrumentationMemoryTest(unittest.TestCase):
+    def assert_peak(self, peak_bytes, expected_bytes):
+        self.assertGreaterEqual(peak_bytes, expected_bytes)
+        self.assertLess(peak_bytes, expected_bytes + OVERHEAD_BYTES)
+
+    # a span frees the memory allocated before it, the run peak is the largest memory held
+    def test_run_peak_with_freed_memory(self):
+        instrumentation = Instrumentation(trace_memory=True)
+        with instrumentation:
+            blocks = [bytearray(40 * MB)]
+            with instrumentation.span("free"):
+                blocks.clear()
+                blocks.append(bytearray(30 * MB))
+                blocks.clear()
+        self.assert_peak(instrumentation.peak_bytes, 40 * MB)
+        if TRACE_SPAN_MEMORY:
+            self.assert_peak(instrumentation.spans["free"]["peak_bytes"], 0)
+
+    # the block of a span is released once the block of the next span is allocated
+    def test_run_peak_of_replaced_blocks(self):
+        instrumentation = Instrumentation(trace_memory=True)
+        with instrumentation:
+            keep = None
+            for _ in range(5):
+                with instrumentation.span("replace"):
+                    keep = [bytearray(50 * MB)]
+            del keep
+        self.assert_peak(instrumentation.peak_bytes, 100 * MB)
+        self.assertEqual(instrumentation.spans["replace"]["calls"], 5)
+
+    @unittest.skipUnless(TRACE_SPAN_MEMORY, "needs tracemalloc.reset_peak")
+    def test_span_peaks(self):
+        instrumentation = Instrumentation(trace_memory=True)
+        with instrumentation:
+            outside = bytearray(20 * MB)
+            with instrumentation.span("outer"):
+                kept = bytearray(8 * MB)
+                with instrumentation.span("inner"):
+                    transient = bytearray(16 * MB)
+                    del transient
+                del kept
+            del outside
+        spans = instrumentation.spans
+        self.assert_peak(spans["outer"]["peak_bytes"], 24 * MB)
+        self.assert_peak(spans["outer/inner"]["peak_bytes"], 16 * MB)
+        self.assert_peak(instrumentation.peak_bytes, 44 * MB)
+
+    @unittest.skipIf(TRACE_SPAN_MEMORY, "spans have peaks with tracemalloc.reset_peak")
+    def test_no_span_peaks(self):
+        instrumentation = Instrumentation(trace_memory=True)
+        with instrumentation:
+            with instrumentation.span("stage"):
+                block = bytearray(10 * MB)
+                del block
+        self.assertNotIn("peak_bytes", instrumentation.spans["stage"])
+        self.assert_peak(instrumentation.peak_bytes, 10 * MB)
+
+    def test_null_span(self):
+        with NO_INSTRUMENTATION:
+            with NO_INSTRUMENTATION.span("stage") as span:
+                NO_INSTRUMENTATION.count("events")
+        self.assertIsNone(span)
+
+
+if __name__ == "__main__":
+    unittest.main()
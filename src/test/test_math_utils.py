@@ -0,0 +1,80 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main", "python")
+)
+
+from utils.coordinate_utils import rolling_window
+from utils.math_utils import rolling_mean_std
+
+
+# [shelf, plate, time] weights in grams, steps of picked up and put back products over the
+# noise of the sensors and a large constant load, as the aggregated plate data
+def make_weights(num_samples, seed=0):
+    rng = np.random.RandomState(seed)
+    weights = 20000.0 + rng.normal(0, 2.0, size=(2, 3, num_samples))
+    for _ in range(4):
+        shelf, plate = rng.randint(2), rng.randint(3)
+        weights[shelf, plate, rng.randint(num_samples) :] += rng.uniform(-500, 500)
+    return weights
+
+
+class RollingMeanStdTest(unittest.TestCase):
+    def assert_rolling_mean_std(self, a, window, reference=None):
+        mean, std = rolling_mean_std(a, window, reference)
+        expected_mean = np.mean(rolling_window(a, window), -1)
+        expected_std = np.std(rolling_window(a, window), -1)
+        self.assertEqual(mean.shape, expected_mean.shape)
+        self.assertEqual(std.shape, expected_std.shape)
+        np.testing.assert_allclose(mean, expected_mean, rtol=1e-12, atol=1e-9)
+        np.testing.assert_allclose(std, expected_std, rtol=1e-6, atol=1e-6)
+
+    def test_window_sizes(self):
+        a = make_weights(600)
+        for window in [1, 2, 7, 60, 600]:
+            with self.subTest(window=window):
+                self.assert_rolling_mean_std(a, window)
+
+    def test_length_not_multiple_of_window(self):
+        for num_samples, window in [(601, 60), (125, 60), (599, 7), (61, 60)]:
+            with self.subTest(num_samples=num_samples, window=window):
+                self.assert_rolling_mean_std(make_weights(num_samples), window)
+
+    def test_rows(self):
+        a = make_weights(300)
+        shelf_weights = a.sum(axis=1)
+        self.assert_rolling_mean_std(shelf_weights, 60)
+        self.assert_rolling_mean_std(shelf_weights[0], 60)
+
+    def test_shorter_than_window(self):
+        mean, std = rolling_mean_std(make_weights(59), 60)
+        self.assertEqual(mean.shape, (2, 3, 0))
+        self.assertEqual(std.shape, (2, 3, 0))
+
+    def test_reference(self):
+        a = make_weights(601)
+        for reference in [a[..., 0], np.zeros(a.shape[:-1]), a.mean(axis=-1)]:
+            self.assert_rolling_mean_std(a, 60, reference)
+
+    # GondolaWeightStream computes the windows of the samples it kept, from a multiple of the
+    # window on, with the first sample of the recording as reference
+    def test_reference_split_at_window(self):
+        window = 60
+        a = make_weights(1000)
+        reference = a[..., 0]
+        mean, std = rolling_mean_std(a, window, reference)
+        for offset in [window, 5 * window, 15 * window]:
+            with self.subTest(offset=offset):
+                split_mean, split_std = rolling_mean_std(
+                    a[..., offset:], window, reference
+                )
+                np.testing.assert_array_equal(split_mean, mean[..., offset:])
+                np.testing.assert_array_equal(split_std, std[..., offset:])
+
+
+if __name__ == "__main__":
+    unittest.main()